@@ -28,6 +28,7 @@ from .fake_clock import FakeClock
 
 from solent import uniq
 from solent.eng import cs
+from solent.eng.engine import CsEngTimer
 from solent.eng.orb import Orb
 
 class FakeSocket:
@@ -46,6 +47,8 @@ class FakeEngine:
         self.events = []
         self.sent_bb = []
         self.sids = {}
+        # timer_h vs [at_t, period, cb_eng_timer]
+        self.timers = {}
         #
         self.mtu = 500
     def get_clock(self):
@@ -55,6 +58,26 @@ class FakeEngine:
             spin_h='fake_engine/orb/%s'%uniq(),
             engine=self,
             i_nearcast=i_nearcast)
+    def call_every(self, period, cb_eng_timer):
+        timer_h = 'fake_timer_%s'%uniq()
+        self.timers[timer_h] = [self.clock.now() + period, period, cb_eng_timer]
+        return timer_h
+    def cancel_timer(self, timer_h):
+        if timer_h in self.timers:
+            del self.timers[timer_h]
+    def simulate_timers(self):
+        'Fires the timers that are due by the fake clock.'
+        now = self.clock.now()
+        for (timer_h, entry) in list(self.timers.items()):
+            if timer_h not in self.timers or entry[0] > now:
+                continue
+            entry[0] = now + entry[1]
+            cs_eng_timer = CsEngTimer()
+            cs_eng_timer.engine = self
+            cs_eng_timer.timer_h = timer_h
+            cs_eng_timer.at_t = now
+            entry[2](
+                cs_eng_timer=cs_eng_timer)
     def send(self, sid, bb):
         self.sent_bb.append(bb[:])
     def open_tcp_client(self, addr, port, cb_tcp_connect, cb_tcp_condrop, cb_tcp_recv):
@@ -59,6 +59,7 @@ from .base import init_ext_fn
 
 from .eng import Clock
 from .eng import Engine
+from .eng import pool_handler
 
 # Above this point, solent is structured into a clear dependency hierarchy.
 # After this point, it becomes less-deliberate, shabby. At the time of
@@ -163,7 +163,7 @@ class SignalConsumer(object):
         if method_name not in dir(self):
             raise Exception('no handler [%s]'%method_name)
         method = getattr(self, method_name)
-        argspec = inspect.getargspec(method)[0][1:]
+        argspec = inspect.getfullargspec(method)[0][1:]
         if argspec != vfields:
             raise Exception('inconsistent spec for %s got:%s method:%s'%(
                 iname, str(argspec), str(vfields)))
@@ -11,6 +11,17 @@
 # think of this as a C codebase that happens to currently be implemented in
 # python.
 #
+# Accounting. The pool counts allocs and frees in each size class as it
+# goes, which is cheap enough to leave on. get_stats gives a snapshot of
+# these, and get_rates the allocs and frees per second since it was last
+# called.
+#
+# Leaks. A sip that is never freed just stays on ltotal. To find out where
+# such sips come from, turn on set_track_sites. The pool then records the
+# call site and time of each alloc until the sip is freed, and
+# get_leak_report (or log_leak_report) groups the sips still out by site.
+# Tracking costs a stack walk per alloc, so it is off by default.
+#
 # // license
 # Copyright 2016, Free Software Foundation.
 #
@@ -29,42 +40,318 @@
 # You should have received a copy of the GNU General Public License along with
 # Solent. If not, see <http://www.gnu.org/licenses/>.
 
+from .liblog import log
 from .sip import Sip
 
+from bisect import bisect_left
+from collections import OrderedDict as od
+import sys
+import time
+
+# Capacities of the sips the pool hands out, smallest first. A request is
+# rounded up to the next one. Powers of two from 64 bytes to 64k.
+DEFAULT_SIZE_CLASSES = tuple([1 << n for n in range(6, 17)])
+
+# Most free sips the pool keeps in each size class. Beyond this, freed sips
+# are left to the garbage collector.
+DEFAULT_FREE_CAP = 256
+
+# Frames recorded for each alloc when tracking sites.
+DEFAULT_SITE_DEPTH = 4
+
+class MempoolSite:
+    def __init__(self, sip, size, site, t):
+        self.sip = sip
+        self.size = size
+        # tuple of 'file:line function', innermost first
+        self.site = site
+        # time.monotonic() of the alloc
+        self.t = t
+
 class Mempool:
-    def __init__(self):
-        # int size vs [sip]
+    '''
+    Free lists of sips, by size class.
+
+    alloc rounds the requested size up to a size class, and takes a sip of
+    that capacity from the free list (or makes one). sip.size is what you
+    asked for, and sip.capacity is the class. Requests larger than the
+    largest class get a sip of exactly their size, which is not kept when
+    it is freed.
+
+    Each class keeps at most free_cap free sips. trim gives free sips back
+    to the garbage collector. trim_idle is gentler: it only lets go of sips
+    that the pool could not have needed since the last trim_idle, going by
+    the high-water mark of sips lent out in each class. The engine can call
+    this for you on a timer (see Engine.set_mempool_trim_period).
+    '''
+    def __init__(self, size_classes=DEFAULT_SIZE_CLASSES, free_cap=DEFAULT_FREE_CAP):
+        if not size_classes:
+            raise Exception("Need at least one size class.")
+        self.size_classes = tuple(sorted(size_classes))
+        self.max_class = self.size_classes[-1]
+        self.free_cap = free_cap
+        #
+        # capacity vs [sip]
         self.pool = {}
-        # int size vs int count
+        # capacity vs int count
         self.lent = {}
+        # capacity vs most sips lent at once since the last trim_idle
+        self.hwm_lent = {}
+        # capacity vs most sips lent at once before the last trim_idle
+        self.peak_lent = {}
+        # capacity vs int count
+        self.count_alloc = {}
+        for capacity in self.size_classes:
+            self.pool[capacity] = []
+            self.lent[capacity] = 0
+            self.hwm_lent[capacity] = 0
+            self.peak_lent[capacity] = 0
+            self.count_alloc[capacity] = 0
         self.ltotal = 0
+        # size vs capacity, filled in as sizes turn up. (Quicker than
+        # working it out each time.)
+        self.d_size_class = {}
+        #
+        # allocs that were too large for any class, and their frees
+        self.count_oversize = 0
+        self.count_oversize_free = 0
+        # frees that the pool did not keep
+        self.count_dropped = 0
+        #
+        # See get_rates.
+        self.t_rates = time.time()
+        self.count_alloc_rates = 0
+        self.count_free_rates = 0
+        #
+        # See set_track_sites. id(sip) vs MempoolSite
+        self.b_track_sites = False
+        self.site_depth = DEFAULT_SITE_DEPTH
+        self.d_sites = {}
+    def get_size_class(self, size):
+        '''
+        Returns the capacity that a sip of size gets, or None if it is
+        larger than the largest class.
+        '''
+        if size > self.max_class:
+            return None
+        return self.size_classes[bisect_left(self.size_classes, size)]
     def alloc(self, size):
         'Returns a sip of size.'
-        if size not in self.pool:
-            self.pool[size] = []
-            self.lent[size] = 0
-        self.lent[size] += 1
         self.ltotal += 1
-        if len(self.pool[size]) == 0:
-            sip = Sip(size)
+        capacity = self.d_size_class.get(size)
+        if capacity == None:
+            capacity = self.get_size_class(size)
+            if capacity == None:
+                self.count_oversize += 1
+                sip = Sip(size)
+                sip._ref_handle = object()
+                if self.b_track_sites:
+                    self._track(sip)
+                return sip
+            self.d_size_class[size] = capacity
+        self.count_alloc[capacity] += 1
+        lent = self.lent[capacity] + 1
+        self.lent[capacity] = lent
+        if lent > self.hwm_lent[capacity]:
+            self.hwm_lent[capacity] = lent
+        free = self.pool[capacity]
+        if free:
+            sip = free.pop()
+            sip.size = size
         else:
-            sip = self.pool[size].pop()
+            sip = Sip(
+                size=size,
+                capacity=capacity)
         # This is part of a hack to allow sip references in this python
         # implementation. See section in sip.py.
         sip._ref_handle = object()
+        if self.b_track_sites:
+            self._track(sip)
         return sip
     def clone(self, sip):
-        '''Allocate a new sip, copy the supplied sip's arr to it, and
+        '''Allocate a new sip, copy the supplied sip's data to it, and
         then return that newly-allocated sip.'''
         nsip = self.alloc(
             size=sip.size)
-        nsip.arr[:] = sip.arr
+        nsip.arr[:sip.size] = sip.view()
         return nsip
     def free(self, sip):
         self.ltotal -= 1
-        self.lent[sip.size] -= 1
-        self.pool[sip.size].append(sip)
         # This is part of a hack to allow sip references in this python
         # implementation. See section in sip.py.
         sip._ref_handle = None
+        if self.b_track_sites:
+            self.d_sites.pop(id(sip), None)
+        capacity = sip.capacity
+        free = self.pool.get(capacity)
+        if free == None:
+            # oversize
+            self.count_oversize_free += 1
+            return
+        self.lent[capacity] -= 1
+        if len(free) >= self.free_cap or len(sip.arr) != capacity:
+            # (The second is someone having resized arr.)
+            self.count_dropped += 1
+            return
+        free.append(sip)
+    def get_retained_bytes(self):
+        'Bytes held in free sips.'
+        return sum([capacity * len(free)
+                    for (capacity, free) in self.pool.items()])
+    def trim(self, keep=0):
+        '''
+        Lets go of free sips, leaving at most keep in each class. Returns
+        the number of bytes let go.
+        '''
+        released = 0
+        for (capacity, free) in self.pool.items():
+            if len(free) > keep:
+                released += capacity * (len(free) - keep)
+                del free[keep:]
+        return released
+    def trim_idle(self):
+        '''
+        For each class, lets go of the free sips beyond the most that were
+        lent out at once since the last call. (Those were not needed.) Then
+        starts a new period. Returns the number of bytes let go.
+        '''
+        released = 0
+        for (capacity, free) in self.pool.items():
+            lent = self.lent[capacity]
+            hwm_lent = self.hwm_lent[capacity]
+            keep = hwm_lent - lent
+            if len(free) > keep:
+                released += capacity * (len(free) - keep)
+                del free[keep:]
+            if hwm_lent > self.peak_lent[capacity]:
+                self.peak_lent[capacity] = hwm_lent
+            self.hwm_lent[capacity] = lent
+        return released
+    #
+    def get_count_alloc(self):
+        'Allocs since the pool was made.'
+        return sum(self.count_alloc.values()) + self.count_oversize
+    def get_count_free(self):
+        'Frees since the pool was made.'
+        return self.get_count_alloc() - self.ltotal
+    def get_stats(self):
+        '''
+        Returns a snapshot of the counters, as a dict. 'classes' has a dict
+        for each size class, by capacity, with
 
+            outstanding     sips lent out now
+            peak            most sips lent out at once
+            free            sips on the free list
+            allocs          since the pool was made
+            frees           since the pool was made
+        '''
+        classes = od()
+        for capacity in self.size_classes:
+            lent = self.lent[capacity]
+            count_alloc = self.count_alloc[capacity]
+            classes[capacity] = {
+                'outstanding': lent,
+                'peak': max(self.peak_lent[capacity], self.hwm_lent[capacity]),
+                'free': len(self.pool[capacity]),
+                'allocs': count_alloc,
+                'frees': count_alloc - lent,
+            }
+        count_alloc = self.get_count_alloc()
+        return {
+            'outstanding': self.ltotal,
+            'allocs': count_alloc,
+            'frees': count_alloc - self.ltotal,
+            'oversize_outstanding': self.count_oversize - self.count_oversize_free,
+            'oversize_allocs': self.count_oversize,
+            'dropped': self.count_dropped,
+            'retained_bytes': self.get_retained_bytes(),
+            'classes': classes,
+        }
+    def get_rates(self, now=None):
+        '''
+        Returns (allocs per second, frees per second) since the last call,
+        or since the pool was made. now defaults to time.time().
+        '''
+        if now == None:
+            now = time.time()
+        count_alloc = self.get_count_alloc()
+        count_free = count_alloc - self.ltotal
+        duration = now - self.t_rates
+        if duration <= 0:
+            return (0.0, 0.0)
+        rates = ( (count_alloc - self.count_alloc_rates) / duration
+                , (count_free - self.count_free_rates) / duration
+                )
+        self.t_rates = now
+        self.count_alloc_rates = count_alloc
+        self.count_free_rates = count_free
+        return rates
+    #
+    def set_track_sites(self, b_track_sites, depth=DEFAULT_SITE_DEPTH):
+        '''
+        Turns recording of alloc call sites on or off. Only sips allocated
+        while it is on show up in leak reports. Turning it off forgets what
+        was recorded.
+        '''
+        self.b_track_sites = b_track_sites
+        self.site_depth = depth
+        self.d_sites.clear()
+    def get_leak_report(self, min_age=0.0):
+        '''
+        Groups the tracked sips that are still out by the site that
+        allocated them, leaving out those younger than min_age seconds.
+        Returns a list of dicts with site, count, bytes and oldest (age in
+        seconds), most sips first.
+        '''
+        now = time.monotonic()
+        # site vs dict
+        d_report = {}
+        for mempool_site in self.d_sites.values():
+            age = now - mempool_site.t
+            if age < min_age:
+                continue
+            entry = d_report.get(mempool_site.site)
+            if entry == None:
+                entry = {
+                    'site': mempool_site.site,
+                    'count': 0,
+                    'bytes': 0,
+                    'oldest': 0.0,
+                }
+                d_report[mempool_site.site] = entry
+            entry['count'] += 1
+            entry['bytes'] += mempool_site.size
+            if age > entry['oldest']:
+                entry['oldest'] = age
+        return sorted(
+            d_report.values(),
+            key=lambda entry: (-entry['count'], -entry['bytes']))
+    def log_leak_report(self, min_age=0.0, limit=10):
+        report = self.get_leak_report(
+            min_age=min_age)
+        log('mempool: %s sips out, %s tracked at %s sites'%(
+            self.ltotal,
+            sum([entry['count'] for entry in report]),
+            len(report)))
+        for entry in report[:limit]:
+            log('  %s sips, %s bytes, oldest %.1fs'%(
+                entry['count'], entry['bytes'], entry['oldest']))
+            for frame in entry['site']:
+                log('    %s'%(frame))
+    #
+    def _track(self, sip):
+        # Skip our own frames, so that clone reports its caller.
+        frame = sys._getframe(1)
+        while frame != None and frame.f_code.co_filename == __file__:
+            frame = frame.f_back
+        lst = []
+        while frame != None and len(lst) < self.site_depth:
+            code = frame.f_code
+            lst.append('%s:%s %s'%(
+                code.co_filename, frame.f_lineno, code.co_name))
+            frame = frame.f_back
+        self.d_sites[id(sip)] = MempoolSite(
+            sip=sip,
+            size=sip.size,
+            site=tuple(lst),
+            t=time.monotonic())
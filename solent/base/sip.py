@@ -40,10 +40,21 @@ import struct
 TWO16 = pow(2, 16)
 
 class Sip:
-    def __init__(self, size):
+    def __init__(self, size, capacity=None):
+        '''
+        size is the logical length: the part of arr that is in use. arr
+        holds capacity bytes, which defaults to size. (Sips from a Mempool
+        are rounded up to a size class, see mempool.py.)
+        '''
+        if capacity == None:
+            capacity = size
+        elif capacity < size:
+            raise Exception("Capacity %s is less than size %s."%(
+                capacity, size))
         self.size = size
+        self.capacity = capacity
         #
-        self.arr = bytearray(size)
+        self.arr = bytearray(capacity)
         #
         self._references = []
     def _cleanup(self):
@@ -61,9 +72,15 @@ class Sip:
         'note: returns an int'
         return self.arr[key]
     def __len__(self):
-        return len(self.arr)
+        return self.size
     def get(self):
         return self.arr
+    def view(self):
+        '''
+        A memoryview of the first size bytes of arr. Hand this on, rather
+        than arr, when arr may be longer than the data.
+        '''
+        return memoryview(self.arr)[:self.size]
     def clone(self, bb):
         '''Writes the bytes into the current sip. The supplied sip length must
         be less than or equal to this sip.
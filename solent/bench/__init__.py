@@ -0,0 +1,32 @@
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+#
+# // overview
+# Benchmarks for the hot paths of the system. Each module here offers a run
+# function that returns a dictionary of measurements, and a main so that it
+# can be run on its own. For example,
+#
+#   python3 -B -m solent.bench.accept_rate
+#
+# Everything here works over local sockets only.
+#
+# To run them all, and to compare the results against an earlier run, see
+# suite.py. In short,
+#
+#   python3 -B -m solent.bench --out baseline.json
+#   python3 -B -m solent.bench --baseline baseline.json
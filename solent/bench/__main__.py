@@ -0,0 +1,112 @@
+#
+# __main__
+#
+# // overview
+# Command-line front end for the benchmark suite. See suite.py.
+#
+#   python3 -B -m solent.bench [--quick] [--out FILE] [--baseline FILE]
+#                              [--threshold FRACTION] [bench ...]
+#
+# Exits with status 1 if a baseline was given and something has regressed
+# beyond the threshold.
+#
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from .suite import compare
+from .suite import DEFAULT_THRESHOLD
+from .suite import list_bench_names
+from .suite import load_suite
+from .suite import run_suite
+from .suite import save_suite
+
+from solent import init_logging
+
+import argparse
+import logging
+import sys
+
+def format_value(value):
+    if isinstance(value, float):
+        return '%.6g'%(value)
+    return str(value)
+
+def cb_progress(name, d_result):
+    print(name)
+    for key in sorted(d_result.keys()):
+        print('    %-26s %s'%(key, format_value(d_result[key])))
+    sys.stdout.flush()
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='python3 -m solent.bench',
+        description='Benchmarks for the hot paths of solent.')
+    parser.add_argument(
+        'names',
+        nargs='*',
+        help='benches to run (default all): %s'%(
+            ', '.join(list_bench_names())))
+    parser.add_argument(
+        '--quick',
+        action='store_true',
+        help='small runs, for checking that the suite works')
+    parser.add_argument(
+        '--out',
+        help='write the results to this json file')
+    parser.add_argument(
+        '--baseline',
+        help='compare against the results in this json file')
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help='regression threshold, as a fraction (default %s)'%(
+            DEFAULT_THRESHOLD))
+    args = parser.parse_args()
+    #
+    init_logging()
+    # Otherwise, the per-connection lines that metasock logs flood the
+    # terminal.
+    logging.getLogger().setLevel(logging.WARNING)
+    #
+    d_suite = run_suite(
+        names=args.names,
+        b_quick=args.quick,
+        cb_progress=cb_progress)
+    if args.out:
+        save_suite(
+            d_suite=d_suite,
+            filename=args.out)
+    if not args.baseline:
+        return
+    regressions = compare(
+        d_suite=d_suite,
+        d_baseline=load_suite(args.baseline),
+        threshold=args.threshold)
+    if not regressions:
+        print('No regressions beyond %.0f%%.'%(args.threshold * 100))
+        return
+    print('Regressions beyond %.0f%%:'%(args.threshold * 100))
+    for (name, metric, baseline_value, value, change) in regressions:
+        print('    %s.%s: %s -> %s (%+.1f%%)'%(
+            name, metric, format_value(baseline_value), format_value(value),
+            change * 100))
+    sys.exit(1)
+
+if __name__ == '__main__':
+    main()
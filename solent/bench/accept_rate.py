@@ -0,0 +1,136 @@
+#
+# accept_rate
+#
+# // overview
+# Measures how many tcp connections per second an engine can accept. Clients
+# are opened in bursts of non-blocking sockets from this same process, so the
+# kernel completes the handshakes and the connections pile up in the server's
+# backlog. We then turn the engine until it has accepted the whole burst.
+#
+# Run this with different accept budgets to see the effect of draining the
+# backlog on each wakeup.
+#
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent import Engine
+from solent import init_logging
+
+import logging
+import socket
+import time
+
+MTU = 1500
+
+ADDR = '127.0.0.1'
+
+METRICS = {
+    'accepts_per_second': 'higher',
+}
+
+class SpinAcceptCounter:
+    def __init__(self, spin_h, engine):
+        self.spin_h = spin_h
+        self.engine = engine
+        #
+        self.server_sid = None
+        self.port = None
+        self.count_accept = 0
+    def eng_turn(self, activity):
+        pass
+    def eng_close(self):
+        pass
+    #
+    def start(self, addr, backlog):
+        self.engine.open_tcp_server(
+            addr=addr,
+            port=0,
+            cb_tcp_server_start=self.cb_tcp_server_start,
+            cb_tcp_server_stop=self.cb_tcp_server_stop,
+            cb_tcp_accept_connect=self.cb_tcp_accept_connect,
+            cb_tcp_accept_condrop=self.cb_tcp_accept_condrop,
+            cb_tcp_accept_recv=self.cb_tcp_accept_recv,
+            backlog=backlog)
+    #
+    def cb_tcp_server_start(self, cs_tcp_server_start):
+        self.server_sid = cs_tcp_server_start.server_sid
+        ms = self.engine._get_ms_for_sid(self.server_sid)
+        self.port = ms.sock.getsockname()[1]
+    def cb_tcp_server_stop(self, cs_tcp_server_stop):
+        self.server_sid = None
+    def cb_tcp_accept_connect(self, cs_tcp_accept_connect):
+        self.count_accept += 1
+        self.engine.close_tcp_accept(
+            accept_sid=cs_tcp_accept_connect.accept_sid)
+    def cb_tcp_accept_condrop(self, cs_tcp_accept_condrop):
+        pass
+    def cb_tcp_accept_recv(self, cs_tcp_accept_recv):
+        pass
+
+def run(connections=4000, burst=100, backlog=128, accept_budget=64):
+    engine = Engine(
+        mtu=MTU)
+    engine.set_accept_budget(accept_budget)
+    spin = engine.init_spin(
+        construct=SpinAcceptCounter)
+    spin.start(
+        addr=ADDR,
+        backlog=backlog)
+    engine.cycle()
+    #
+    turns = 0
+    t_start = time.time()
+    opened = 0
+    while opened < connections:
+        clients = []
+        for i in range(min(burst, connections - opened)):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(0)
+            sock.connect_ex( (ADDR, spin.port) )
+            clients.append(sock)
+        opened += len(clients)
+        while spin.count_accept < opened:
+            engine.turn(
+                timeout=0.05)
+            turns += 1
+        for sock in clients:
+            sock.close()
+    duration = time.time() - t_start
+    engine.close()
+    #
+    return {
+        'connections': connections,
+        'accept_budget': accept_budget,
+        'turns': turns,
+        'seconds': duration,
+        'accepts_per_second': connections / duration,
+    }
+
+def main():
+    init_logging()
+    # Otherwise, the per-connection lines that metasock logs flood the
+    # terminal.
+    logging.getLogger().setLevel(logging.WARNING)
+    for accept_budget in (1, 64):
+        d = run(
+            accept_budget=accept_budget)
+        print('accept_budget %4s: %8.0f accepts/s over %s turns'%(
+            d['accept_budget'], d['accepts_per_second'], d['turns']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#
+# cgrid
+#
+# // overview
+# Cost of diffing one Cgrid against another, which is how the console demos
+# work out which cells to redraw (see weeds._diff_display_refresh). Each
+# frame, we change a few cells in the next grid, walk both grids to find the
+# cells that differ, and then blit next onto last.
+#
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent import solent_cpair
+from solent.console.cgrid import Cgrid
+
+import time
+
+METRICS = {
+    'frames_per_second': 'higher',
+}
+
+def diff_cgrids(cgrid_last, cgrid_next):
+    'Returns a list of (drop, rest, c, cpair) for the cells that differ.'
+    changes = []
+    for drop in range(cgrid_next.height):
+        for rest in range(cgrid_next.width):
+            (old_c, old_cpair) = cgrid_last.get(
+                drop=drop,
+                rest=rest)
+            (c, cpair) = cgrid_next.get(
+                drop=drop,
+                rest=rest)
+            if c == old_c and cpair == old_cpair:
+                continue
+            changes.append( (drop, rest, c, cpair) )
+    return changes
+
+def run(frames=200, width=80, height=25, changes_per_frame=20):
+    cgrid_last = Cgrid(
+        width=width,
+        height=height)
+    cgrid_next = Cgrid(
+        width=width,
+        height=height)
+    cpair = solent_cpair('white')
+    count_changes = 0
+    #
+    t_start = time.perf_counter()
+    for frame in range(frames):
+        for idx in range(changes_per_frame):
+            cell = (frame * changes_per_frame + idx) * 7
+            cgrid_next.put(
+                drop=(cell // width) % height,
+                rest=cell % width,
+                s=chr(ord('a') + (frame % 26)),
+                cpair=cpair)
+        changes = diff_cgrids(
+            cgrid_last=cgrid_last,
+            cgrid_next=cgrid_next)
+        count_changes += len(changes)
+        cgrid_last.blit(
+            src_cgrid=cgrid_next)
+    duration = time.perf_counter() - t_start
+    #
+    return {
+        'frames': frames,
+        'width': width,
+        'height': height,
+        'changes': count_changes,
+        'frames_per_second': frames / duration,
+    }
+
+def main():
+    d = run()
+    print('%.0f frames/s (%sx%s, %s changes)'%(
+        d['frames_per_second'], d['width'], d['height'], d['changes']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+#
+# echo
+#
+# // overview
+# Tcp echo over loopback. A server and a client run on one engine. The
+# server sends back whatever it receives.
+#
+# There are two phases,
+#
+#   latency     The client sends one small message at a time, and waits for
+#               it to come back before sending the next. We keep the time
+#               of each round trip, and report exact percentiles. (The
+#               engine's histograms are too coarse to compare runs with.)
+#
+#   throughput  The client queues a large amount of data at once, and we
+#               time how long it takes for all of it to come back.
+#
+# Both sides run on the same engine, so a round trip here includes two
+# passes through the poller but no scheduling between processes.
+#
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent import Engine
+from solent import init_logging
+from solent.eng.instrument import sample_percentile
+
+import logging
+import time
+
+MTU = 1500
+
+ADDR = '127.0.0.1'
+
+METRICS = {
+    'round_trips_per_second': 'higher',
+    'latency_p50': 'lower',
+    'latency_p99': 'lower',
+    'mb_per_second': 'higher',
+}
+
+class SpinEcho:
+    def __init__(self, spin_h, engine):
+        self.spin_h = spin_h
+        self.engine = engine
+        #
+        self.server_sid = None
+        self.port = None
+        self.accept_sid = None
+        self.client_sid = None
+        self.count_client_recv = 0
+    def eng_turn(self, activity):
+        pass
+    def eng_close(self):
+        pass
+    #
+    def start(self):
+        self.engine.open_tcp_server(
+            addr=ADDR,
+            port=0,
+            cb_tcp_server_start=self.cb_tcp_server_start,
+            cb_tcp_server_stop=self.cb_tcp_server_stop,
+            cb_tcp_accept_connect=self.cb_tcp_accept_connect,
+            cb_tcp_accept_condrop=self.cb_tcp_accept_condrop,
+            cb_tcp_accept_recv=self.cb_tcp_accept_recv)
+        self.engine.open_tcp_client(
+            addr=ADDR,
+            port=self.port,
+            cb_tcp_client_connect=self.cb_tcp_client_connect,
+            cb_tcp_client_condrop=self.cb_tcp_client_condrop,
+            cb_tcp_client_recv=self.cb_tcp_client_recv)
+        while self.client_sid == None or self.accept_sid == None:
+            self.engine.turn(
+                timeout=0.05)
+    #
+    def cb_tcp_server_start(self, cs_tcp_server_start):
+        self.server_sid = cs_tcp_server_start.server_sid
+        ms = self.engine._get_ms_for_sid(self.server_sid)
+        self.port = ms.sock.getsockname()[1]
+    def cb_tcp_server_stop(self, cs_tcp_server_stop):
+        self.server_sid = None
+    def cb_tcp_accept_connect(self, cs_tcp_accept_connect):
+        self.accept_sid = cs_tcp_accept_connect.accept_sid
+    def cb_tcp_accept_condrop(self, cs_tcp_accept_condrop):
+        self.accept_sid = None
+    def cb_tcp_accept_recv(self, cs_tcp_accept_recv):
+        self.engine.send(
+            sid=self.accept_sid,
+            bb=cs_tcp_accept_recv.bb)
+    def cb_tcp_client_connect(self, cs_tcp_client_connect):
+        self.client_sid = cs_tcp_client_connect.client_sid
+    def cb_tcp_client_condrop(self, cs_tcp_client_condrop):
+        self.client_sid = None
+    def cb_tcp_client_recv(self, cs_tcp_client_recv):
+        self.count_client_recv += len(cs_tcp_client_recv.bb)
+
+def run(round_trips=10000, message_size=32, bulk_mb=32):
+    engine = Engine(
+        mtu=MTU)
+    spin = engine.init_spin(
+        construct=SpinEcho)
+    spin.start()
+    #
+    # latency
+    samples = []
+    bb = bytes(message_size)
+    t_start = time.perf_counter()
+    for i in range(round_trips):
+        target = spin.count_client_recv + message_size
+        t_send = time.perf_counter()
+        engine.send(
+            sid=spin.client_sid,
+            bb=bb)
+        while spin.count_client_recv < target:
+            engine.turn(
+                timeout=0.05)
+        samples.append(time.perf_counter() - t_send)
+    t_latency = time.perf_counter() - t_start
+    samples.sort()
+    #
+    # throughput
+    bulk_size = bulk_mb * 1024 * 1024
+    target = spin.count_client_recv + bulk_size
+    bb_bulk = bytes(bulk_size)
+    t_start = time.perf_counter()
+    engine.send(
+        sid=spin.client_sid,
+        bb=bb_bulk)
+    while spin.count_client_recv < target:
+        engine.turn(
+            timeout=0.05)
+    t_bulk = time.perf_counter() - t_start
+    engine.close()
+    #
+    return {
+        'round_trips': round_trips,
+        'message_size': message_size,
+        'round_trips_per_second': round_trips / t_latency,
+        'latency_mean': sum(samples) / len(samples),
+        'latency_p50': sample_percentile(samples, 0.5),
+        'latency_p99': sample_percentile(samples, 0.99),
+        'latency_max': samples[-1],
+        'bulk_bytes': bulk_size,
+        'mb_per_second': bulk_size / t_bulk / 1e6,
+    }
+
+def main():
+    init_logging()
+    logging.getLogger().setLevel(logging.WARNING)
+    d = run()
+    print(' '.join( [ '%.0f round trips/s,'%(d['round_trips_per_second'])
+                    , 'p50 %.1fus,'%(d['latency_p50'] * 1e6)
+                    , 'p99 %.1fus,'%(d['latency_p99'] * 1e6)
+                    , 'bulk %.1f MB/s'%(d['mb_per_second'])
+                    ] ))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#
+# line_finder
+#
+# // overview
+# Parsing rate of RailLineFinder, which the line consoles use to split their
+# input into lines. We feed it a buffer of lines of varying length, as
+# bytes (the way it gets them from the network).
+#
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent import RailLineFinder
+
+import time
+
+# Chunk size for feeding the rail, roughly what a recv would give it.
+CHUNK_SIZE = 1500
+
+METRICS = {
+    'mb_per_second': 'higher',
+}
+
+def make_text(size):
+    sb = []
+    total = 0
+    idx = 0
+    while total < size:
+        line = 'line %s %s\n'%(idx, 'x' * (idx % 80))
+        sb.append(line)
+        total += len(line)
+        idx += 1
+    return ''.join(sb).encode('ascii')[:size]
+
+def run(size=1024*1024):
+    bb = make_text(size)
+    count_lines = [0]
+    def cb_line_finder_event(cs_line_finder_event):
+        count_lines[0] += 1
+    rail_line_finder = RailLineFinder()
+    rail_line_finder.zero(
+        rail_h='bench',
+        cb_line_finder_event=cb_line_finder_event)
+    #
+    mv = memoryview(bb)
+    t_start = time.perf_counter()
+    for offset in range(0, len(bb), CHUNK_SIZE):
+        rail_line_finder.accept_bytes(
+            bb=mv[offset:offset+CHUNK_SIZE])
+    duration = time.perf_counter() - t_start
+    #
+    return {
+        'bytes': len(bb),
+        'lines': count_lines[0],
+        'mb_per_second': len(bb) / duration / 1e6,
+    }
+
+def main():
+    d = run()
+    print('%.2f MB/s (%s lines)'%(d['mb_per_second'], d['lines']))
+
+if __name__ == '__main__':
+    main()
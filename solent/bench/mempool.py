@@ -0,0 +1,66 @@
+#
+# mempool
+#
+# // overview
+# Cost of Mempool.alloc and Mempool.free. We hold a set of sips at once
+# (depth), free them, and go again, so that the pool has to juggle more than
+# one sip per size. We cycle through a few sizes, as the engine does when
+# messages vary in length.
+#
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent import Mempool
+
+import time
+
+SIZES = (32, 100, 512, 1500)
+
+METRICS = {
+    'ops_per_second': 'higher',
+}
+
+def run(cycles=20000, depth=16):
+    mempool = Mempool()
+    lst = []
+    sizes = SIZES
+    count_sizes = len(sizes)
+    t_start = time.perf_counter()
+    for i in range(cycles):
+        for j in range(depth):
+            lst.append(mempool.alloc(
+                size=sizes[(i + j) % count_sizes]))
+        for sip in lst:
+            mempool.free(
+                sip=sip)
+        lst.clear()
+    duration = time.perf_counter() - t_start
+    #
+    ops = cycles * depth * 2
+    return {
+        'cycles': cycles,
+        'depth': depth,
+        'ops_per_second': ops / duration,
+    }
+
+def main():
+    d = run()
+    print('%.0f alloc+free ops/s'%(d['ops_per_second']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#
+# nearcast
+#
+# // overview
+# Nearcast message rate through an orb. One cog (the pump) responds to each
+# tick message by nearcasting the next one. Every other cog listens to the
+# ticks. So each message is delivered to cogs receivers.
+#
+# With b_sparse, the other cogs instead listen to one each of a handful of
+# messages that are never sent. Each tick then has one receiver, however
+# many cogs there are. This is the shape of a large application, where most
+# cogs care about few messages, and it shows what the orb spends on cogs
+# that are not interested in a message.
+#
+# This is a measure of the cost of the orb's dispatch: queueing, snoops (we
+# have none here), and looking up and calling the handlers.
+#
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent import Engine
+from solent import init_logging
+
+import logging
+import time
+
+MTU = 1500
+
+I_NEARCAST = '''
+    i message h
+    i field h
+
+    message tick
+        field n
+
+    message other_0
+        field n
+    message other_1
+        field n
+    message other_2
+        field n
+    message other_3
+        field n
+'''
+
+COUNT_OTHER_MESSAGES = 4
+
+METRICS = {
+    'messages_per_second': 'higher',
+    'deliveries_per_second': 'higher',
+}
+
+class CogPump:
+    def __init__(self, cog_h, orb, engine):
+        self.cog_h = cog_h
+        self.orb = orb
+        self.engine = engine
+        #
+        self.limit = None
+        self.b_done = False
+    def on_tick(self, n):
+        if n < self.limit:
+            self.nearcast.tick(
+                n=n+1)
+        else:
+            self.b_done = True
+
+class CogListener:
+    def __init__(self, cog_h, orb, engine):
+        self.cog_h = cog_h
+        self.orb = orb
+        self.engine = engine
+        #
+        self.count = 0
+    def on_tick(self, n):
+        self.count += 1
+
+def make_sparse_listener_class(idx):
+    message_h = 'other_%s'%(idx % COUNT_OTHER_MESSAGES)
+    def fn_init(self, cog_h, orb, engine):
+        self.cog_h = cog_h
+        self.orb = orb
+        self.engine = engine
+    def fn_on_other(self, n):
+        pass
+    return type('CogSparse%s'%(idx), (object,), {
+        '__init__': fn_init,
+        'on_%s'%(message_h): fn_on_other })
+
+def run(messages=100000, cogs=4, b_sparse=False):
+    engine = Engine(
+        mtu=MTU)
+    orb = engine.init_orb(
+        i_nearcast=I_NEARCAST)
+    pump = orb.init_cog(CogPump)
+    pump.limit = messages
+    for idx in range(cogs - 1):
+        # Orbs name cogs after their class, so each listener needs one of
+        # its own.
+        if b_sparse:
+            construct = make_sparse_listener_class(idx)
+        else:
+            construct = type('CogListener%s'%(idx), (CogListener,), {})
+        orb.init_cog(construct)
+    if b_sparse:
+        receivers = 1
+    else:
+        receivers = cogs
+    bridge = orb.init_autobridge()
+    #
+    t_start = time.perf_counter()
+    bridge.nc_tick(
+        n=0)
+    while not pump.b_done:
+        engine.turn(
+            timeout=0)
+    duration = time.perf_counter() - t_start
+    engine.close()
+    #
+    return {
+        'messages': messages,
+        'cogs': cogs,
+        'b_sparse': b_sparse,
+        'messages_per_second': messages / duration,
+        'deliveries_per_second': (messages * receivers) / duration,
+    }
+
+def main():
+    init_logging()
+    logging.getLogger().setLevel(logging.WARNING)
+    for (cogs, b_sparse) in ((1, False), (4, False), (16, False), (30, True)):
+        d = run(
+            cogs=cogs,
+            b_sparse=b_sparse)
+        print('%2s cogs%s: %8.0f messages/s, %9.0f deliveries/s'%(
+            d['cogs'], ' (sparse)' if b_sparse else '',
+            d['messages_per_second'], d['deliveries_per_second']))
+
+if __name__ == '__main__':
+    main()
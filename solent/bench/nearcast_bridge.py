@@ -0,0 +1,275 @@
+#
+# nearcast_bridge
+#
+# // overview
+# Nearcast between two processes, through SpinNearcastShmBridge (transport
+# 'shm') or SpinNearcastBridge over loopback udp (transport 'udp'). We fork.
+# The child runs an orb with a cog that answers pings and counts ticks.
+#
+# There are two phases,
+#
+#   latency     The parent nearcasts a ping, and waits for the pong to come
+#               back before sending the next. We keep the time of each
+#               round trip, and report exact percentiles. (Bucketed ones
+#               would hide the difference between the transports.)
+#
+#   throughput  The parent nearcasts ticks in windows. At the end of each
+#               window, it asks the child how many it has seen, and waits
+#               for the answer. (Windows keep udp within the kernel's
+#               receive buffer. The ring does not need them, but it gets
+#               the same treatment, so that the numbers compare.)
+#
+# Each side sleeps in the poller when it has nothing to do, so a round trip
+# includes waking the other process up.
+#
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent import Engine
+from solent import init_logging
+from solent import SolentQuitException
+from solent.eng.instrument import sample_percentile
+from solent.util import SpinNearcastBridge
+from solent.util import SpinNearcastShmBridge
+
+import logging
+import os
+import time
+
+MTU = 1500
+
+ADDR = '127.0.0.1'
+
+TRANSPORTS = ('shm', 'udp')
+
+I_NEARCAST = '''
+    i message h
+        i field h t
+
+    message ping
+        field n u4
+    message pong
+        field n u4
+    message tick
+        field n u4
+    message count_please
+    message count
+        field n u4
+    message quit
+'''
+
+METRICS = {
+    'latency_p50': 'lower',
+    'latency_p99': 'lower',
+    'messages_per_second': 'higher',
+}
+
+class CogChild:
+    def __init__(self, cog_h, orb, engine):
+        self.cog_h = cog_h
+        self.orb = orb
+        self.engine = engine
+        #
+        self.count_ticks = 0
+    def on_ping(self, n):
+        self.nearcast.pong(
+            n=n)
+    def on_tick(self, n):
+        self.count_ticks += 1
+    def on_count_please(self):
+        self.nearcast.count(
+            n=self.count_ticks)
+    def on_quit(self):
+        raise SolentQuitException()
+
+class CogParent:
+    def __init__(self, cog_h, orb, engine):
+        self.cog_h = cog_h
+        self.orb = orb
+        self.engine = engine
+        #
+        self.last_pong = None
+        self.last_count = None
+    def on_pong(self, n):
+        self.last_pong = n
+    def on_count(self, n):
+        self.last_count = n
+
+def read_line(fd):
+    sb = []
+    while True:
+        c = os.read(fd, 1)
+        if not c or c == b'\n':
+            break
+        sb.append(c)
+    return b''.join(sb).decode('utf8')
+
+def init_bridge(engine, orb, transport, send_message_hs, recv_message_hs, fd_out, fd_in):
+    '''
+    Sets up our end, tells the other process where to send to, and then
+    waits to hear the same from it.
+    '''
+    if transport == 'shm':
+        spin = engine.init_spin(
+            construct=SpinNearcastShmBridge,
+            orb=orb,
+            send_message_hs=send_message_hs,
+            recv_message_hs=recv_message_hs)
+        address = spin.open_recv()
+    elif transport == 'udp':
+        spin = engine.init_spin(
+            construct=SpinNearcastBridge,
+            orb=orb,
+            send_message_hs=send_message_hs,
+            recv_message_hs=recv_message_hs)
+        spin.open_sub(
+            addr=ADDR,
+            port=0)
+        engine.turn(
+            timeout=0)
+        address = str(spin.get_sub_port())
+    else:
+        raise Exception("Unknown transport [%s]. (Have: %s)"%(
+            transport, ', '.join(TRANSPORTS)))
+    os.write(fd_out, ('%s\n'%(address)).encode('utf8'))
+    other_address = read_line(fd_in)
+    if transport == 'shm':
+        spin.open_send(
+            name=other_address)
+    else:
+        spin.open_pub(
+            addr=ADDR,
+            port=int(other_address))
+    engine.turn(
+        timeout=0)
+    return spin
+
+def run_child(transport, fd_out, fd_in):
+    engine = Engine(
+        mtu=MTU)
+    orb = engine.init_orb(
+        i_nearcast=I_NEARCAST)
+    orb.init_cog(CogChild)
+    init_bridge(
+        engine=engine,
+        orb=orb,
+        transport=transport,
+        send_message_hs=['pong', 'count'],
+        recv_message_hs=['ping', 'tick', 'count_please', 'quit'],
+        fd_out=fd_out,
+        fd_in=fd_in)
+    try:
+        while True:
+            engine.turn(
+                timeout=1.0)
+    except SolentQuitException:
+        pass
+    engine.close()
+
+def run(transport='shm', round_trips=5000, messages=200000, window_size=10000):
+    (fd_child_in, fd_parent_out) = os.pipe()
+    (fd_parent_in, fd_child_out) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_child(
+                transport=transport,
+                fd_out=fd_child_out,
+                fd_in=fd_child_in)
+        finally:
+            os._exit(0)
+    engine = Engine(
+        mtu=MTU)
+    orb = engine.init_orb(
+        i_nearcast=I_NEARCAST)
+    cog = orb.init_cog(CogParent)
+    bridge = orb.init_autobridge()
+    spin = init_bridge(
+        engine=engine,
+        orb=orb,
+        transport=transport,
+        send_message_hs=['ping', 'tick', 'count_please', 'quit'],
+        recv_message_hs=['pong', 'count'],
+        fd_out=fd_parent_out,
+        fd_in=fd_parent_in)
+    #
+    # latency
+    samples = []
+    for n in range(round_trips):
+        t_send = time.perf_counter()
+        bridge.nc_ping(
+            n=n)
+        while cog.last_pong != n:
+            engine.turn(
+                timeout=0.05)
+        samples.append(time.perf_counter() - t_send)
+    samples.sort()
+    #
+    # throughput
+    count_sent = 0
+    t_start = time.perf_counter()
+    while count_sent < messages:
+        for i in range(min(window_size, messages - count_sent)):
+            bridge.nc_tick(
+                n=count_sent)
+            count_sent += 1
+        bridge.nc_count_please()
+        cog.last_count = None
+        while cog.last_count == None:
+            engine.turn(
+                timeout=0.05)
+    duration = time.perf_counter() - t_start
+    count_received = cog.last_count
+    #
+    bridge.nc_quit()
+    engine.turn(
+        timeout=0)
+    engine.turn(
+        timeout=0)
+    os.waitpid(pid, 0)
+    engine.close()
+    for fd in (fd_child_in, fd_parent_out, fd_parent_in, fd_child_out):
+        os.close(fd)
+    #
+    return {
+        'transport': transport,
+        'round_trips': round_trips,
+        'latency_mean': sum(samples) / len(samples),
+        'latency_p50': sample_percentile(samples, 0.5),
+        'latency_p99': sample_percentile(samples, 0.99),
+        'latency_max': samples[-1],
+        'messages': messages,
+        'lost': messages - count_received,
+        'messages_per_second': count_received / duration,
+    }
+
+def main():
+    init_logging()
+    logging.getLogger().setLevel(logging.WARNING)
+    for transport in TRANSPORTS:
+        d = run(
+            transport=transport)
+        print(' '.join( [ '%s:'%(transport)
+                        , 'p50 %.1fus,'%(d['latency_p50'] * 1e6)
+                        , 'p99 %.1fus,'%(d['latency_p99'] * 1e6)
+                        , '%.0f messages/s'%(d['messages_per_second'])
+                        , '(%s lost)'%(d['lost'])
+                        ] ))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#
+# pubsub
+#
+# // overview
+# Udp datagram rate over loopback. A pub and a sub run on one engine. The
+# pub sends datagrams in windows of window_size, and we turn the engine
+# until the sub has seen the whole window (or until the window goes quiet,
+# in which case we count the difference as lost).
+#
+# Sending in windows keeps us within the kernel's receive buffer, so that
+# what we measure is the engine rather than how fast the kernel drops
+# packets.
+#
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent import Engine
+from solent import init_logging
+
+import logging
+import time
+
+MTU = 1500
+
+ADDR = '127.0.0.1'
+
+# If a window has made no progress for this long, we give up on the rest of
+# it.
+QUIET_SECONDS = 0.2
+
+METRICS = {
+    'datagrams_per_second': 'higher',
+}
+
+class SpinPubSub:
+    def __init__(self, spin_h, engine):
+        self.spin_h = spin_h
+        self.engine = engine
+        #
+        self.sub_sid = None
+        self.port = None
+        self.pub_sid = None
+        self.count_recv = 0
+    def eng_turn(self, activity):
+        pass
+    def eng_close(self):
+        pass
+    #
+    def start(self):
+        self.engine.open_sub(
+            addr=ADDR,
+            port=0,
+            cb_sub_start=self.cb_sub_start,
+            cb_sub_stop=self.cb_sub_stop,
+            cb_sub_recv=self.cb_sub_recv)
+        self.engine.open_pub(
+            addr=ADDR,
+            port=self.port,
+            cb_pub_start=self.cb_pub_start,
+            cb_pub_stop=self.cb_pub_stop)
+    #
+    def cb_sub_start(self, cs_sub_start):
+        self.sub_sid = cs_sub_start.sub_sid
+        ms = self.engine._get_ms_for_sid(self.sub_sid)
+        self.port = ms.sock.getsockname()[1]
+    def cb_sub_stop(self, cs_sub_stop):
+        self.sub_sid = None
+    def cb_sub_recv(self, cs_sub_recv):
+        self.count_recv += 1
+    def cb_pub_start(self, cs_pub_start):
+        self.pub_sid = cs_pub_start.pub_sid
+    def cb_pub_stop(self, cs_pub_stop):
+        self.pub_sid = None
+
+def run(datagrams=100000, datagram_size=256, window_size=64):
+    engine = Engine(
+        mtu=MTU)
+    spin = engine.init_spin(
+        construct=SpinPubSub)
+    spin.start()
+    #
+    bb = bytes(datagram_size)
+    count_sent = 0
+    t_start = time.perf_counter()
+    while count_sent < datagrams:
+        n = min(window_size, datagrams - count_sent)
+        for i in range(n):
+            engine.send(
+                sid=spin.pub_sid,
+                bb=bb)
+        count_sent += n
+        t_progress = time.perf_counter()
+        count_seen = spin.count_recv
+        while spin.count_recv < count_sent:
+            engine.turn(
+                timeout=0.01)
+            now = time.perf_counter()
+            if spin.count_recv != count_seen:
+                count_seen = spin.count_recv
+                t_progress = now
+            elif now - t_progress > QUIET_SECONDS:
+                break
+    duration = time.perf_counter() - t_start
+    engine.close()
+    #
+    return {
+        'datagrams': datagrams,
+        'datagram_size': datagram_size,
+        'received': spin.count_recv,
+        'lost': datagrams - spin.count_recv,
+        'datagrams_per_second': spin.count_recv / duration,
+    }
+
+def main():
+    init_logging()
+    logging.getLogger().setLevel(logging.WARNING)
+    d = run()
+    print('%.0f datagrams/s (%s x %s bytes, %s lost)'%(
+        d['datagrams_per_second'], d['datagrams'], d['datagram_size'],
+        d['lost']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+#
+# send_throughput
+#
+# // overview
+# Measures how quickly an engine can push many small messages over a
+# loopback tcp connection. A client queues all of its messages as soon as
+# it connects, and we then turn the engine until the server side has
+# received every byte.
+#
+# This is the workload where the cost of the send path per message matters
+# most: the payloads are small, so almost all of the work is bookkeeping.
+#
+# The api argument selects how messages are handed to the engine,
+#
+#   send        engine.send on an immutable bytes. The engine queues it as
+#               it is. No sip, no copy.
+#   send_copy   engine.send on a bytearray. The engine allocates a sip and
+#               copies into it, so that the caller can reuse its buffer.
+#   send_sip    the producer writes into a sip from engine.mempool and hands
+#               it over with engine.send_sip. One copy, by the producer.
+#   send_view   engine.send_view on an immutable bytes. No sip, no copy.
+#
+# allocs_per_message is the number of mempool allocs over the whole run
+# (including the engine's own), divided by the number of messages. See
+# Mempool.get_count_alloc.
+#
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent import Engine
+from solent import init_logging
+
+import logging
+import time
+
+MTU = 1500
+
+ADDR = '127.0.0.1'
+
+METRICS = {
+    'messages_per_second': 'higher',
+    'mb_per_second': 'higher',
+    'allocs_per_message': 'lower',
+}
+
+class SpinLoopbackPair:
+    '''
+    A tcp server and a tcp client on the same engine, connected to one
+    another.
+    '''
+    def __init__(self, spin_h, engine):
+        self.spin_h = spin_h
+        self.engine = engine
+        #
+        self.server_sid = None
+        self.port = None
+        self.accept_sid = None
+        self.client_sid = None
+        self.count_recv_bytes = 0
+    def eng_turn(self, activity):
+        pass
+    def eng_close(self):
+        pass
+    #
+    def start(self):
+        self.engine.open_tcp_server(
+            addr=ADDR,
+            port=0,
+            cb_tcp_server_start=self.cb_tcp_server_start,
+            cb_tcp_server_stop=self.cb_tcp_server_stop,
+            cb_tcp_accept_connect=self.cb_tcp_accept_connect,
+            cb_tcp_accept_condrop=self.cb_tcp_accept_condrop,
+            cb_tcp_accept_recv=self.cb_tcp_accept_recv)
+        self.engine.open_tcp_client(
+            addr=ADDR,
+            port=self.port,
+            cb_tcp_client_connect=self.cb_tcp_client_connect,
+            cb_tcp_client_condrop=self.cb_tcp_client_condrop,
+            cb_tcp_client_recv=self.cb_tcp_client_recv)
+        while self.client_sid == None or self.accept_sid == None:
+            self.engine.turn(
+                timeout=0.05)
+    #
+    def cb_tcp_server_start(self, cs_tcp_server_start):
+        self.server_sid = cs_tcp_server_start.server_sid
+        ms = self.engine._get_ms_for_sid(self.server_sid)
+        self.port = ms.sock.getsockname()[1]
+    def cb_tcp_server_stop(self, cs_tcp_server_stop):
+        self.server_sid = None
+    def cb_tcp_accept_connect(self, cs_tcp_accept_connect):
+        self.accept_sid = cs_tcp_accept_connect.accept_sid
+    def cb_tcp_accept_condrop(self, cs_tcp_accept_condrop):
+        self.accept_sid = None
+    def cb_tcp_accept_recv(self, cs_tcp_accept_recv):
+        self.count_recv_bytes += len(cs_tcp_accept_recv.bb)
+    def cb_tcp_client_connect(self, cs_tcp_client_connect):
+        self.client_sid = cs_tcp_client_connect.client_sid
+    def cb_tcp_client_condrop(self, cs_tcp_client_condrop):
+        self.client_sid = None
+    def cb_tcp_client_recv(self, cs_tcp_client_recv):
+        pass
+
+API_SEND = 'send'
+API_SEND_COPY = 'send_copy'
+API_SEND_SIP = 'send_sip'
+API_SEND_VIEW = 'send_view'
+
+APIS = (API_SEND, API_SEND_COPY, API_SEND_SIP, API_SEND_VIEW)
+
+def run(messages=200000, message_size=32, api=API_SEND):
+    engine = Engine(
+        mtu=MTU)
+    spin = engine.init_spin(
+        construct=SpinLoopbackPair)
+    spin.start()
+    #
+    bb = bytes(message_size)
+    total_bytes = messages * message_size
+    turns = 0
+    t_start = time.time()
+    client_sid = spin.client_sid
+    mempool = engine.mempool
+    count_alloc_start = mempool.get_count_alloc()
+    if api == API_SEND:
+        for i in range(messages):
+            engine.send(
+                sid=client_sid,
+                bb=bb)
+    elif api == API_SEND_COPY:
+        arr = bytearray(bb)
+        for i in range(messages):
+            engine.send(
+                sid=client_sid,
+                bb=arr)
+    elif api == API_SEND_SIP:
+        for i in range(messages):
+            sip = mempool.alloc(
+                size=message_size)
+            sip.arr[:message_size] = bb
+            engine.send_sip(
+                sid=client_sid,
+                sip=sip)
+    elif api == API_SEND_VIEW:
+        for i in range(messages):
+            engine.send_view(
+                sid=client_sid,
+                mv=bb)
+    else:
+        raise Exception("Unknown api %s"%(api))
+    t_queued = time.time()
+    while spin.count_recv_bytes < total_bytes:
+        engine.turn(
+            timeout=0.05)
+        turns += 1
+    t_done = time.time()
+    count_alloc = mempool.get_count_alloc() - count_alloc_start
+    engine.close()
+    #
+    duration = t_done - t_start
+    return {
+        'api': api,
+        'allocs_per_message': count_alloc / messages,
+        'messages': messages,
+        'message_size': message_size,
+        'turns': turns,
+        'seconds_queue': t_queued - t_start,
+        'seconds_total': duration,
+        'messages_per_second': messages / duration,
+        'mb_per_second': total_bytes / duration / 1e6,
+    }
+
+def main():
+    init_logging()
+    logging.getLogger().setLevel(logging.WARNING)
+    for api in APIS:
+        d = run(
+            api=api)
+        print(' '.join( [ '%-9s'%(d['api'])
+                        , '%s x %s bytes:'%(d['messages'], d['message_size'])
+                        , '%.0f msg/s,'%(d['messages_per_second'])
+                        , '%.2f MB/s,'%(d['mb_per_second'])
+                        , 'queue %.3fs,'%(d['seconds_queue'])
+                        , '%.2f allocs/msg'%(d['allocs_per_message'])
+                        ] ))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+#
+# suite
+#
+# // overview
+# Runs the benchmarks in this package as a set, and compares the results
+# against a stored baseline. The command-line front end is in __main__.py,
+#
+#   python3 -B -m solent.bench --out now.json
+#   python3 -B -m solent.bench --baseline then.json --threshold 0.15
+#
+# Each bench module offers,
+#
+#   run(**kwargs)   Returns a dict of measurements.
+#
+#   METRICS         A dict of the measurements that matter for comparison,
+#                   vs 'higher' or 'lower' (whichever direction is better).
+#
+# The registry below names the kwargs we use for a full run and for a quick
+# run. A quick run is for smoke-testing the suite, not for comparisons.
+#
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from . import accept_rate
+from . import cgrid
+from . import echo
+from . import line_finder
+from . import mempool
+from . import nearcast
+from . import nearcast_bridge
+from . import pubsub
+from . import send_throughput
+
+import json
+import platform
+import sys
+import time
+
+DEFAULT_THRESHOLD = 0.10
+
+# name, module, full kwargs, quick kwargs
+BENCHES = [
+    ( 'accept_rate', accept_rate
+    , {}
+    , {'connections': 200} ),
+    ( 'send_throughput', send_throughput
+    , {}
+    , {'messages': 5000} ),
+    ( 'echo', echo
+    , {}
+    , {'round_trips': 200, 'bulk_mb': 1} ),
+    ( 'pubsub', pubsub
+    , {}
+    , {'datagrams': 2000} ),
+    ( 'nearcast', nearcast
+    , {}
+    , {'messages': 2000} ),
+    ( 'nearcast_sparse', nearcast
+    , {'cogs': 30, 'b_sparse': True}
+    , {'messages': 2000, 'cogs': 30, 'b_sparse': True} ),
+    ( 'bridge_shm', nearcast_bridge
+    , {'transport': 'shm'}
+    , {'transport': 'shm', 'round_trips': 200, 'messages': 5000} ),
+    ( 'bridge_udp', nearcast_bridge
+    , {'transport': 'udp'}
+    , {'transport': 'udp', 'round_trips': 200, 'messages': 5000} ),
+    ( 'mempool', mempool
+    , {}
+    , {'cycles': 500} ),
+    ( 'line_finder', line_finder
+    , {}
+    , {'size': 16 * 1024} ),
+    ( 'cgrid', cgrid
+    , {}
+    , {'frames': 5} ),
+]
+
+def list_bench_names():
+    return [name for (name, _, _, _) in BENCHES]
+
+def run_suite(names=None, b_quick=False, cb_progress=None):
+    '''
+    Returns a dict that can be written out as json. names limits the run to
+    some of the benches. cb_progress, if supplied, is called as
+    cb_progress(name, d_result) after each bench.
+    '''
+    known = list_bench_names()
+    if names:
+        for name in names:
+            if name not in known:
+                raise Exception("Unknown bench [%s]. (Have: %s)"%(
+                    name, ', '.join(known)))
+    d_results = {}
+    for (name, module, kwargs_full, kwargs_quick) in BENCHES:
+        if names and name not in names:
+            continue
+        if b_quick:
+            kwargs = kwargs_quick
+        else:
+            kwargs = kwargs_full
+        d_result = module.run(**kwargs)
+        d_results[name] = d_result
+        if cb_progress != None:
+            cb_progress(name, d_result)
+    return {
+        'meta': {
+            'time': time.time(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'b_quick': b_quick,
+        },
+        'results': d_results,
+    }
+
+def compare(d_suite, d_baseline, threshold=DEFAULT_THRESHOLD):
+    '''
+    Returns a list of (name, metric, baseline_value, value, change) for
+    each metric that has got worse by more than threshold (a fraction).
+    change is the relative change, signed so that negative means worse.
+    Benches or metrics that are missing from either side are skipped.
+    '''
+    regressions = []
+    d_results = d_suite['results']
+    d_baseline_results = d_baseline['results']
+    for (name, module, _, _) in BENCHES:
+        if name not in d_results or name not in d_baseline_results:
+            continue
+        for (metric, direction) in sorted(module.METRICS.items()):
+            value = d_results[name].get(metric)
+            baseline_value = d_baseline_results[name].get(metric)
+            if value == None or not baseline_value:
+                continue
+            change = (value - baseline_value) / baseline_value
+            if direction == 'lower':
+                change = -change
+            if change < -threshold:
+                regressions.append(
+                    (name, metric, baseline_value, value, change) )
+    return regressions
+
+def save_suite(d_suite, filename):
+    with open(filename, 'w') as f_ptr:
+        json.dump(d_suite, f_ptr, indent=2, sort_keys=True)
+
+def load_suite(filename):
+    with open(filename) as f_ptr:
+        return json.load(f_ptr)
@@ -30,4 +30,5 @@ if sys.version_info.major < 3:
 from .clock import Clock
 from .engine import Engine
 from .ip_validator import IpValidator
+from .worker_pool import pool_handler
 
@@ -5,6 +5,16 @@
 # Object pool wrapping actions, a class of object designed to be used by the
 # engine for controlling the initiative in its event loop.
 #
+# The engine uses actions to implement its timers. Fields,
+#
+#   action_h    handle given to the user, used for cancellation
+#   at_t        clock time at which the action is next due
+#   b_live      False once the action has been cancelled or has run out
+#   tmil        period of a recurring action, in milliseconds
+#   fn_ask      reserved
+#   fn_turn     callback to run when the action is due
+#   b_recurring whether to reschedule after running
+#
 # // license
 # Copyright 2016, Free Software Foundation.
 #
@@ -25,6 +35,11 @@
 
 class Action:
     def __init__(self):
+        self.action_h = None
+        self.at_t = None
+        self.b_live = False
+        # (Used by the engine's timers.)
+        self.b_in_heap = False
         #
         self.tmil = None
         self.fn_ask = None
@@ -40,6 +55,14 @@ class ActionPool:
     def __init__(self):
         self.stack = []
     def push(self, action):
+        # Drop references, so that the pool does not keep user objects
+        # alive.
+        action.b_live = False
+        action.set(
+            tmil=None,
+            fn_ask=None,
+            fn_turn=None,
+            b_recurring=None)
         self.stack.append(action)
     def pull(self, tmil, fn_ask, fn_turn, b_recurring):
         if 0 == len(self.stack):
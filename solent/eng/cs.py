@@ -89,6 +89,11 @@ class CsSubStop:
 
 class CsSubRecv:
     # TCP data receivers for UDP and multicast subscribers.
+    #
+    # For this and the other recv structs: bb is bytes by default. If the
+    # application has called engine.enable_recv_views, it is instead a
+    # memoryview onto the engine's receive buffer, which is only valid until
+    # the callback returns. Copy it if you want to keep it.
     def __init__(self):
         self.engine = None
         self.sub_sid = None
@@ -172,3 +177,36 @@ class CsTcpClientRecv:
         self.client_sid = None
         self.bb = None
 
+class CsTcpAcceptPause:
+    # Fired when the send queue of an accept connection has risen to its
+    # high watermark. The engine will still take more data, but you should
+    # stop producing until you get the matching resume. send_queue_bytes
+    # is the number of bytes queued at the time of the callback.
+    def __init__(self):
+        self.engine = None
+        self.server_sid = None
+        self.accept_sid = None
+        self.send_queue_bytes = None
+
+class CsTcpAcceptResume:
+    # Fired when the send queue of a paused accept connection has drained to
+    # its low watermark.
+    def __init__(self):
+        self.engine = None
+        self.server_sid = None
+        self.accept_sid = None
+        self.send_queue_bytes = None
+
+class CsTcpClientPause:
+    # As for CsTcpAcceptPause, but for a tcp client connection.
+    def __init__(self):
+        self.engine = None
+        self.client_sid = None
+        self.send_queue_bytes = None
+
+class CsTcpClientResume:
+    # As for CsTcpAcceptResume, but for a tcp client connection.
+    def __init__(self):
+        self.engine = None
+        self.client_sid = None
+        self.send_queue_bytes = None
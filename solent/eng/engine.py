@@ -39,26 +39,47 @@ from .action_pool import ActionPool
 from .activity import Activity
 from .clock import Clock
 from .metasock import MetasockCloseCondition
+from .metasock import MS_TYPE_PUB
 from .metasock import metasock_create_sub
 from .metasock import metasock_create_pub
 from .metasock import metasock_create_tcp_accept
 from .metasock import metasock_create_tcp_client
 from .metasock import metasock_create_tcp_server
 from .orb import Orb
+from .instrument import instrument_new
+from .poller import poller_new
 
 from solent import uniq
 from solent import log
 from solent import Mempool
 
 from collections import OrderedDict as od
+import heapq
 import platform
-import select
 import socket
 import time
 import traceback
 
 PLATFORM_SYSTEM = platform.system()
 
+# Default listen backlog for tcp servers. The kernel will clamp this to its
+# own maximum (net.core.somaxconn on Linux).
+TCP_SERVER_BACKLOG = 128
+
+# Default for the number of connections a tcp server will accept in a single
+# turn of the event loop.
+ACCEPT_BUDGET = 64
+
+# Default for the number of bytes we will read from a single socket in a
+# single turn of the event loop. This stops one busy connection from
+# starving the others.
+RECV_BUDGET = 256 * 1024
+
+# Defaults for the send queue watermarks of each metasock, in bytes. See
+# set_send_watermarks.
+SEND_HIGH_WATERMARK = 1024 * 1024
+SEND_LOW_WATERMARK = 256 * 1024
+
 def eloop_debug(msg):
     log('(@) %s'%msg)
 
@@ -92,44 +113,199 @@ class CsEngCustomFdRead:
         self.cfd_h = None
         self.fd = None
 
+class CsEngTimer:
+    def __init__(self):
+        self.engine = None
+        self.timer_h = None
+        self.at_t = None
+
 class Engine(object):
-    def __init__(self, mtu):
+    def __init__(self, mtu, poller_h=None):
+        '''
+        poller_h: readiness backend (see poller.py). Leave this as None to
+        get the best one available on the platform.
+        '''
         self.mtu = mtu
         #
         self.mempool = Mempool()
         self.clock = Clock()
         self.action_pool = ActionPool()
+        self.poller = poller_new(
+            poller_h=poller_h)
         self.sid_to_metasock = od()
+        self.fd_to_metasock = {}
         self.spins = od()
         #
         self.activity = Activity()
         self.b_debug_eloop = False
         self.sid_counter = 0
         self.default_timeout = 0.2
+        self.accept_budget = ACCEPT_BUDGET
+        self.recv_budget = RECV_BUDGET
+        self.b_recv_views = False
         self.b_nodelay = False
+        self.b_reuseport = False
+        self.send_high_watermark = SEND_HIGH_WATERMARK
+        self.send_low_watermark = SEND_LOW_WATERMARK
         #
         self.cb_ms_close = None
         self.cs_ms_close = CsMsClose()
         #
         # fd vs (cfd_h, cb_eng_custom_fd_read)
         self.d_eng_custom_read = {}
+        # fileno vs fd. (Users may supply objects that have a fileno
+        # method, such as sys.stdin. The poller wants ints.)
+        self.d_eng_custom_fileno = {}
         self.cs_eng_custom_fd_read = CsEngCustomFdRead()
+        #
+        # Timers. The heap contains tuples of (at_t, seq, action). seq
+        # breaks ties, so that timers due at the same time fire in the order
+        # they were booked. Cancellation is lazy: the action is marked dead
+        # and dropped from the heap when it reaches the top, or when dead
+        # entries come to dominate the heap.
+        self.timer_heap = []
+        self.timer_seq = 0
+        self.timer_count_dead = 0
+        self.d_timer = {} # timer_h vs action
+        self.lst_due_timers = []
+        self.cs_eng_timer = CsEngTimer()
+        #
+        # See set_mempool_trim_period.
+        self.mempool_trim_timer_h = None
+        #
+        # None unless enable_instrumentation has been called.
+        self.instrument = None
     def enable_nodelay(self):
         self.b_nodelay = True
     def disable_nodelay(self):
         self.b_nodelay = False
+    def enable_reuseport(self):
+        '''
+        Tcp servers and subs opened from now on will set SO_REUSEPORT, as
+        though you had passed b_reuseport=True. This lets several processes
+        listen on the same port, with the kernel spreading new connections
+        (or datagrams) between them. See supervisor.py.
+        '''
+        self.b_reuseport = True
+    def disable_reuseport(self):
+        self.b_reuseport = False
+    def enable_recv_views(self):
+        '''
+        Opt-in. Recv callbacks (cb_sub_recv, cb_tcp_accept_recv,
+        cb_tcp_client_recv) will be given a memoryview onto the engine's
+        receive buffer rather than their own bytes. This saves an allocation
+        and a copy on every read. The contract: the view is only valid until
+        your callback returns. If you want to keep the data, copy it.
+        '''
+        self.b_recv_views = True
+    def disable_recv_views(self):
+        self.b_recv_views = False
+    def enable_instrumentation(self):
+        '''
+        Opt-in. Records phase timings for each turn, and durations for each
+        socket, timer and custom fd callback, into histograms. See
+        instrument.py for what gets recorded.
+        '''
+        if self.instrument == None:
+            self.instrument = instrument_new()
+    def disable_instrumentation(self):
+        self.instrument = None
+    def get_instrumentation_snapshot(self, b_reset=False):
+        '''
+        Returns a dict of histogram name vs a dict of its stats (count,
+        total, mean, max, p50, p90, p99, p999, buckets). Durations are in
+        seconds. With b_reset, the histograms are cleared after they have
+        been read, so that the next snapshot covers a fresh interval.
+        '''
+        if self.instrument == None:
+            raise Exception("Instrumentation is not enabled.")
+        d = self.instrument.snapshot()
+        if b_reset:
+            self.instrument.reset()
+        return d
+    def reset_instrumentation(self):
+        if self.instrument != None:
+            self.instrument.reset()
     def debug_eloop_on(self):
         self.b_debug_eloop = True
     def debug_eloop_off(self):
         self.b_debug_eloop = False
     def get_clock(self):
         return self.clock
+    def get_poller_h(self):
+        return self.poller.poller_h
     def get_mtu(self):
         return self.mtu
     def set_mtu(self, mtu):
         self.mtu = mtu
+    def set_mempool_trim_period(self, period):
+        '''
+        Every period seconds, the engine gives free sips that the mempool
+        has not needed back to the garbage collector (see
+        Mempool.trim_idle). None turns this off, which is the default.
+        '''
+        if self.mempool_trim_timer_h != None:
+            self.cancel_timer(
+                timer_h=self.mempool_trim_timer_h)
+            self.mempool_trim_timer_h = None
+        if period == None:
+            return
+        self.mempool_trim_timer_h = self.call_every(
+            period=period,
+            cb_eng_timer=self.cb_mempool_trim)
+    def cb_mempool_trim(self, cs_eng_timer):
+        self.mempool.trim_idle()
     def set_default_timeout(self, value):
         self.default_timeout = value
+    def set_recv_budget(self, value):
+        '''
+        Maximum number of bytes that will be read from a single socket in a
+        single turn.
+        '''
+        if value < 1:
+            raise Exception("Recv budget must be at least 1. (got %s)"%(
+                value))
+        self.recv_budget = value
+    def set_accept_budget(self, value):
+        '''
+        Maximum number of connections that a tcp server will accept from
+        the kernel backlog in a single turn.
+        '''
+        if value < 1:
+            raise Exception("Accept budget must be at least 1. (got %s)"%(
+                value))
+        self.accept_budget = value
+    def set_send_watermarks(self, high, low):
+        '''
+        Default send queue watermarks for sockets opened from now on. When
+        the bytes queued for a tcp client or accept rise to high, the engine
+        calls its pause callback (cb_tcp_client_pause, cb_tcp_accept_pause).
+        Once they have drained to low, it calls the resume callback.
+        '''
+        self._check_watermarks(high, low)
+        self.send_high_watermark = high
+        self.send_low_watermark = low
+    def set_sid_send_watermarks(self, sid, high, low):
+        '''
+        As for set_send_watermarks, but for a single socket that is already
+        open.
+        '''
+        self._check_watermarks(high, low)
+        ms = self._get_ms_for_sid(sid)
+        ms.set_send_watermarks(
+            high=high,
+            low=low)
+    def _check_watermarks(self, high, low):
+        if low < 0 or high <= low:
+            raise Exception("Watermarks need 0 <= low < high. (got %s, %s)"%(
+                low, high))
+    def get_send_queue_bytes(self, sid):
+        '''
+        Number of bytes that have been given to the engine for this sid,
+        but which have not yet been taken by the kernel.
+        '''
+        ms = self._get_ms_for_sid(sid)
+        return ms.send_buf_bytes
     def create_sid(self):
         next = self.sid_counter
         self.sid_counter += 1
@@ -148,6 +324,11 @@ class Engine(object):
                 orb.eng_close()
             except:
                 traceback.print_exc()
+        for action in self.d_timer.values():
+            self.action_pool.push(action)
+        self.d_timer.clear()
+        self.timer_heap.clear()
+        self.poller.close()
     def _add_spin(self, spin_h, spin):
         eng_methods = [m for m in dir(spin) if m.startswith('eng_')]
         m = "Missing method. Need eng_turn(activity), eng_close()"
@@ -189,13 +370,196 @@ class Engine(object):
     def del_spin(self, spin_h):
         # xxx unsubscribe logic if it is an orb
         del self.spins[spin_h]
+    def call_at(self, at_t, cb_eng_timer):
+        '''
+        Books cb_eng_timer(cs_eng_timer) to be called once, on the first turn
+        at or after clock time at_t. Returns a timer_h, which you can pass
+        to cancel_timer.
+        '''
+        return self._book_timer(
+            at_t=at_t,
+            period=None,
+            cb_eng_timer=cb_eng_timer)
+    def call_later(self, delay, cb_eng_timer):
+        '''
+        As for call_at, but delay is relative to the current clock time.
+        '''
+        return self._book_timer(
+            at_t=self.clock.now() + delay,
+            period=None,
+            cb_eng_timer=cb_eng_timer)
+    def call_every(self, period, cb_eng_timer):
+        '''
+        Books cb_eng_timer to be called every period seconds, starting one
+        period from now. If the engine falls behind, missed calls are not
+        made up: the next call is booked for one period after the late one.
+        Returns a timer_h.
+        '''
+        if period <= 0:
+            raise Exception("Period must be positive. (got %s)"%(period))
+        return self._book_timer(
+            at_t=self.clock.now() + period,
+            period=period,
+            cb_eng_timer=cb_eng_timer)
+    def cancel_timer(self, timer_h):
+        '''
+        Cancelling a timer that has already fired (or been cancelled) is
+        harmless.
+        '''
+        if timer_h not in self.d_timer:
+            return
+        action = self.d_timer.pop(timer_h)
+        action.b_live = False
+        if not action.b_in_heap:
+            # Due in the current pass of _fire_due_timers, which drops it.
+            return
+        self.timer_count_dead += 1
+        if self.timer_count_dead > 64 and \
+                self.timer_count_dead * 2 > len(self.timer_heap):
+            self._compact_timer_heap()
+    def get_next_timer_deadline(self):
+        '''
+        Returns the clock time of the next live timer, or None.
+        '''
+        heap = self.timer_heap
+        while heap and not heap[0][2].b_live:
+            (_, _, action) = heapq.heappop(heap)
+            action.b_in_heap = False
+            self.timer_count_dead -= 1
+            self.action_pool.push(action)
+        if heap:
+            return heap[0][0]
+        return None
+    def _book_timer(self, at_t, period, cb_eng_timer):
+        if period == None:
+            tmil = None
+            b_recurring = False
+        else:
+            tmil = period * 1000.0
+            b_recurring = True
+        action = self.action_pool.pull(
+            tmil=tmil,
+            fn_ask=None,
+            fn_turn=cb_eng_timer,
+            b_recurring=b_recurring)
+        action.action_h = self.create_sid()
+        action.at_t = at_t
+        action.b_live = True
+        self.d_timer[action.action_h] = action
+        self._push_timer(action)
+        return action.action_h
+    def _push_timer(self, action):
+        action.b_in_heap = True
+        self.timer_seq += 1
+        heapq.heappush(
+            self.timer_heap,
+            (action.at_t, self.timer_seq, action))
+    def _compact_timer_heap(self):
+        live = []
+        for entry in self.timer_heap:
+            if entry[2].b_live:
+                live.append(entry)
+            else:
+                entry[2].b_in_heap = False
+                self.action_pool.push(entry[2])
+        heapq.heapify(live)
+        self.timer_heap = live
+        self.timer_count_dead = 0
+    def _fire_due_timers(self):
+        '''
+        Returns True if any timer fired. Timers that are booked by callbacks
+        during this pass will not fire until the next turn, even if they are
+        already due. This stops a timer that re-books itself at zero delay
+        from starving the rest of the engine.
+        '''
+        now = self.clock.now()
+        heap = self.timer_heap
+        due = self.lst_due_timers
+        while heap and heap[0][0] <= now:
+            (_, _, action) = heapq.heappop(heap)
+            action.b_in_heap = False
+            if not action.b_live:
+                self.timer_count_dead -= 1
+                self.action_pool.push(action)
+                continue
+            due.append(action)
+        if not due:
+            return False
+        cs_eng_timer = self.cs_eng_timer
+        idx = 0
+        try:
+            while idx < len(due):
+                action = due[idx]
+                idx += 1
+                if not action.b_live:
+                    # Cancelled by an earlier callback in this pass. (It
+                    # was not in the heap, so it was not counted dead.)
+                    self.action_pool.push(action)
+                    continue
+                timer_h = action.action_h
+                cs_eng_timer.engine = self
+                cs_eng_timer.timer_h = timer_h
+                cs_eng_timer.at_t = action.at_t
+                if action.b_recurring:
+                    action.at_t += action.tmil / 1000.0
+                    if action.at_t <= now:
+                        action.at_t = now + action.tmil / 1000.0
+                    self._push_timer(action)
+                else:
+                    del self.d_timer[timer_h]
+                if self.instrument != None:
+                    t_cb = time.perf_counter()
+                    action.fn_turn(
+                        cs_eng_timer=cs_eng_timer)
+                    self.instrument.record(
+                        ('callback', 'timer'),
+                        time.perf_counter() - t_cb)
+                else:
+                    action.fn_turn(
+                        cs_eng_timer=cs_eng_timer)
+                if not action.b_recurring:
+                    self.action_pool.push(action)
+        finally:
+            # If a callback raised, the timers after it in this pass have
+            # not fired. They go back in the heap, and fire next turn.
+            for action in due[idx:]:
+                if action.b_live:
+                    self._push_timer(action)
+                else:
+                    self.action_pool.push(action)
+            due.clear()
+        return True
     def turn(self, timeout=0):
+        inst = self.instrument
+        if inst != None:
+            perf_counter = time.perf_counter
+            t_turn = perf_counter()
+
         b_any_activity_at_all = False
 
-        spins_in_this_loop = list(self.spins.values())
-        for spin in spins_in_this_loop:
-            spin.eng_turn(
-                activity=self.activity)
+        if self.timer_heap:
+            if inst != None:
+                t_phase = perf_counter()
+            if self._fire_due_timers():
+                b_any_activity_at_all = True
+                if self.b_debug_eloop:
+                    eloop_debug('timer activity')
+            if inst != None:
+                inst.record(('phase', 'timers'), perf_counter() - t_phase)
+
+        spins_in_this_loop = list(self.spins.items())
+        if inst != None:
+            t_phase = perf_counter()
+            for (spin_h, spin) in spins_in_this_loop:
+                t_spin = perf_counter()
+                spin.eng_turn(
+                    activity=self.activity)
+                inst.record(('spin', spin_h), perf_counter() - t_spin)
+            inst.record(('phase', 'spins'), perf_counter() - t_phase)
+        else:
+            for (spin_h, spin) in spins_in_this_loop:
+                spin.eng_turn(
+                    activity=self.activity)
 
         # Determine if there was activity from the spins
         lst_orb_activity = self.activity.get()
@@ -205,6 +569,17 @@ class Engine(object):
             if self.b_debug_eloop:
                 for s in lst_orb_activity:
                     eloop_debug('*ACTIVITY* %s'%(s))
+            # The spins have work in flight (e.g. messages they have just
+            # queued). Don't sit in select on their account.
+            timeout = 0
+
+        # The next timer deadline caps how long we can wait in the poller.
+        if self.timer_heap:
+            deadline = self.get_next_timer_deadline()
+            if deadline != None:
+                wait = deadline - self.clock.now()
+                if wait < timeout:
+                    timeout = max(wait, 0)
 
         # Select
         activity_from_select = self._call_select(timeout)
@@ -222,6 +597,8 @@ class Engine(object):
             # We are in a period of inactivity: let the next loop
             # select have some timeout.
             timeout = self.default_timeout
+        if inst != None:
+            inst.record(('phase', 'turn'), perf_counter() - t_turn)
         return timeout
     def cycle(self):
         '''
@@ -255,79 +632,125 @@ class Engine(object):
         in the mail, and carry on without further concern. So long as
         connectivity stays up, your user will get a copy of what was in
         bb when it was supplied to this method.
+
+        For stream sockets, bb can be any size. Do not slice it into mtu
+        pieces first: the engine streams it to the kernel from a cursor,
+        as fast as the kernel will take it. For pub sockets, each call is
+        a datagram, and so must fit in the mtu.
+
+        If you are sending a lot of data and want to avoid the copy, see
+        send_sip and send_view.
         '''
-        # --------------------------------------------------------
-        #   conversion logic from bb to sip
-        # --------------------------------------------------------
-        #
-        #   !   This is only needed whilst we are switching between the
-        #       new and old memory models.
-        #
-        sip = self.mempool.alloc(
+        ms = self._get_send_ms(
+            sid=sid,
             size=len(bb))
-        sip.arr[:] = bb
-        # --------------------------------------------------------
-        #   standard logic
-        # --------------------------------------------------------
-        #log('send sid:%s data_len:%s'%(sid, len(data)))
+        if isinstance(bb, bytes):
+            # bytes are immutable, so we can honour the contract above
+            # without copying.
+            ms.enqueue_send(
+                bb=bb,
+                sip=None)
+        elif len(bb) > self.mtu:
+            # Large payload. Take a single copy outside of the mempool, so
+            # that the pool does not go on to hold a buffer of this size.
+            ms.enqueue_send(
+                bb=bytes(bb),
+                sip=None)
+        else:
+            size = len(bb)
+            sip = self.mempool.alloc(
+                size=size)
+            sip.arr[:size] = bb
+            ms.enqueue_send(
+                bb=sip.view(),
+                sip=sip)
+    def send_sip(self, sid, sip):
+        '''
+        Queues sip for sending, without copying it. Ownership passes to the
+        engine: the sip must have come from engine.mempool, and the engine
+        will free it once it has been sent (or the socket closes). Do not
+        touch it after this call.
+        '''
+        ms = self._get_send_ms(
+            sid=sid,
+            size=sip.size)
+        ms.enqueue_send(
+            bb=sip.view(),
+            sip=sip)
+    def send_view(self, sid, mv):
+        '''
+        Queues a buffer for sending, without copying it. mv can be bytes, or
+        anything else that supports the buffer protocol.
+
+        The engine holds a reference to your buffer until it has been sent.
+        If the buffer is mutable, you must not change it in the meantime.
+        Immutable bytes are always safe.
+        '''
+        if not isinstance(mv, (bytes, bytearray)):
+            # Normalise to a flat view of bytes, so that len gives us a
+            # byte count.
+            mv = memoryview(mv).cast('B')
+        ms = self._get_send_ms(
+            sid=sid,
+            size=len(mv))
+        ms.enqueue_send(
+            bb=mv,
+            sip=None)
+    def _get_send_ms(self, sid, size):
+        #log('send sid:%s data_len:%s'%(sid, size))
         ms = self._get_ms_for_sid(sid)
         if not ms.can_it_send:
             raise Exception("%s does not have can_it_send"%(sid))
-        if len(bb) > self.mtu:
+        if size > self.mtu and ms.ms_type == MS_TYPE_PUB:
             raise Exception('Payload size %s is larger than mtu %s'%(
-                len(bb), self.mtu))
-        ms.copy_to_send_queue(
-            sip=sip)
-        # --------------------------------------------------------
-        #   cleanup of converstion logic
-        # --------------------------------------------------------
-        #
-        # This will need to go also
-        #
-        self.mempool.free(
-            sip=sip)
+                size, self.mtu))
+        return ms
     def add_custom_fd_read(self, cfd_h, fd, cb_eng_custom_fd_read):
+        if isinstance(fd, int):
+            fileno = fd
+        else:
+            fileno = fd.fileno()
         self.d_eng_custom_read[fd] = (cfd_h, cb_eng_custom_fd_read)
+        self.d_eng_custom_fileno[fileno] = fd
+        self.poller.register(
+            fd=fileno,
+            b_read=True,
+            b_write=False)
+    def del_custom_fd_read(self, fd):
+        '''
+        Undoes add_custom_fd_read. Call this before you close fd.
+        '''
+        if isinstance(fd, int):
+            fileno = fd
+        else:
+            fileno = fd.fileno()
+        del self.d_eng_custom_read[fd]
+        del self.d_eng_custom_fileno[fileno]
+        self.poller.unregister(
+            fd=fileno)
     def _call_select(self, timeout=0):
         "Return True or False depending on whether or not there was activity."
         #
         # Windows gives an OS error when you make a call to select with all
         # arguments being empty sets. We avoid this scenario by detecting if
         # there is no networking being done. In this case, we honour the
-        # timeout with a short sleep. [Emphasis: in the current logic below,
-        # xlist gets every socket in it. So if we get past this conditional,
+        # timeout with a short sleep. [Emphasis: the select poller puts every
+        # registered socket in its xlist. So if we get past this conditional,
         # there should not be further circumstances in which the Windows error
         # circumstance can be triggered.]
-        if 0 == len(self.sid_to_metasock) and not self.d_eng_custom_read:
+        if self.poller.is_empty():
             time.sleep(timeout)
             return False
         #
-        # Convenience for further down
-        sock_to_metasock = {}
-        def create_lookup_for_metasock(ms):
-            sock_to_metasock[ms.sock] = ms
-        #
         # Say we're doing a read, and then find that we unexpectedly need
         # to shut the socket. In this case, we want a place to buffer the
-        # sockets that have been closed since the last select so we can
-        # avoid processing them.
-        sock_ignore_list = []
-        # It is important we make a copy of this here, before the loop
-        # starts running
-        candidate_pairs = [pair
-            for pair
-            in self.sid_to_metasock.items()]
-        # This function combines the items above to give you socket resources
-        # that are still in play
-        def active_sid_ms_pairs():
-            'generator. yields (sid, ms).'
-            for (sid, ms) in candidate_pairs:
-                if ms.sock not in sock_ignore_list:
-                    yield (sid, ms)
+        # metasocks that have been closed since the poll so we can avoid
+        # processing them.
+        ms_ignore_list = []
         #
         # All socket closes in the metasock give a callback. This allows us to
         # have cleanup functionality in a single place. The reason it's here
-        # rather than in metasock is so that we can access sock_ignore_list.
+        # rather than in metasock is so that we can access ms_ignore_list.
         # This could probably be a global variable instead, but for the moment
         # it's no big deal.
         def cb_ms_close(cs_ms_close):
@@ -335,51 +758,92 @@ class Engine(object):
             sid = cs_ms_close.sid
             message = cs_ms_close.message
             #
-            sock_ignore_list.append(ms.sock)
+            ms_ignore_list.append(ms)
         self.cb_ms_close = cb_ms_close
         #
-        # Groundwork for the select
-        rlist = []
-        wlist = []
-        xlist = []
-        for (sid, ms) in active_sid_ms_pairs():
-            create_lookup_for_metasock(ms)
-            if ms.desire_for_readable_select_list():
-                rlist.append(ms.sock)
-            if ms.desire_for_writable_select_list():
-                wlist.append(ms.sock)
-            xlist.append(ms.sock)
-        for fd in self.d_eng_custom_read:
-            rlist.append(fd)
+        # Poll. Interest was registered as metasocks changed state, so there
+        # is no groundwork to do here.
+        inst = self.instrument
+        if inst != None:
+            perf_counter = time.perf_counter
+            t_phase = perf_counter()
+        events = self.poller.poll(timeout)
+        if inst != None:
+            inst.record(('phase', 'poll'), perf_counter() - t_phase)
         #
-        # Select
-        rlist, wlist, xlist = select.select(rlist, wlist, xlist, timeout)
-        #log('select /r%s /w%s /x%s /t:%s'%(rlist, wlist, xlist, timeout))
+        # Resolve descriptors to metasocks before we act on any of them. Once
+        # a socket is closed during this pass, the kernel is free to reuse
+        # its descriptor number (e.g. for an accept), and we would not want
+        # a stale event to be applied to the new socket.
+        x_lst = []
+        r_lst = []
+        w_lst = []
+        custom_lst = []
+        for (fd, b_read, b_write, b_except) in events:
+            if fd in self.d_eng_custom_fileno:
+                if b_read:
+                    custom_lst.append(self.d_eng_custom_fileno[fd])
+                continue
+            if fd not in self.fd_to_metasock:
+                continue
+            ms = self.fd_to_metasock[fd]
+            if b_except:
+                x_lst.append(ms)
+            if b_read:
+                r_lst.append(ms)
+            if b_write:
+                w_lst.append(ms)
+        #
+        if inst != None:
+            self._handle_events_instrumented(
+                inst=inst,
+                x_lst=x_lst,
+                custom_lst=custom_lst,
+                r_lst=r_lst,
+                w_lst=w_lst,
+                ms_ignore_list=ms_ignore_list)
+        else:
+            self._handle_events(
+                x_lst=x_lst,
+                custom_lst=custom_lst,
+                r_lst=r_lst,
+                w_lst=w_lst,
+                ms_ignore_list=ms_ignore_list)
         #
+        # Now we are out of the loop, we can clear the callback that was
+        # protecting against ships-in-the-night problems to do with sockets
+        # being in a state of closing.
+        self.cb_ms_close = None
+        #
+        # The caller may wish to use the return code to influence it on
+        # the timeout that it passes in on a further iteration.
+        if events or ms_ignore_list:
+            return True
+        else:
+            return False
+    def _handle_events(self, x_lst, custom_lst, r_lst, w_lst, ms_ignore_list):
         # Handle errors
-        for sock in xlist:
-            if sock in sock_ignore_list:
+        for ms in x_lst:
+            if ms in ms_ignore_list:
                 continue
-            ms = sock_to_metasock[sock]
             try:
                 ms.manage_exceptionable()
             except MetasockCloseCondition as e:
                 self._close_metasock(
                     sid=ms.sid,
                     reason=e.message)
-        for sock in rlist:
-            if sock in sock_ignore_list:
+        for fd in custom_lst:
+            if fd not in self.d_eng_custom_read:
+                # Removed by an earlier callback in this pass.
                 continue
-            if sock in self.d_eng_custom_read:
-                tpl = self.d_eng_custom_read[sock]
-                fd = sock
-                (cfd_h, cb_eng_custom_fd_read) = tpl
-                self._call_eng_custom_fd_read(
-                    cfd_h=cfd_h,
-                    fd=fd,
-                    cb_eng_custom_fd_read=cb_eng_custom_fd_read)
+            (cfd_h, cb_eng_custom_fd_read) = self.d_eng_custom_read[fd]
+            self._call_eng_custom_fd_read(
+                cfd_h=cfd_h,
+                fd=fd,
+                cb_eng_custom_fd_read=cb_eng_custom_fd_read)
+        for ms in r_lst:
+            if ms in ms_ignore_list:
                 continue
-            ms = sock_to_metasock[sock]
             try:
                 ms.manage_readable()
             except MetasockCloseCondition as e:
@@ -388,29 +852,81 @@ class Engine(object):
                     reason=e.message)
         #
         # Handle writes (and pending connections)
-        for sock in wlist:
-            if sock in sock_ignore_list:
+        for ms in w_lst:
+            if ms in ms_ignore_list:
                 continue
-            ms = sock_to_metasock[sock]
             try:
                 ms.manage_writable()
             except MetasockCloseCondition as e:
                 self._close_metasock(
                     sid=ms.sid,
                     reason=e.message)
+    def _handle_events_instrumented(self, inst, x_lst, custom_lst, r_lst, w_lst, ms_ignore_list):
+        '''
+        Does the same as _handle_events, but records timings as it goes.
+        This is kept separate so that the usual path pays nothing for it.
+        '''
+        perf_counter = time.perf_counter
         #
-        # Now we are out of the loop, we can clear the callback that was
-        # protecting against ships-in-the-night problems to do with sockets
-        # being in a state of closing.
-        self.cb_ms_close = None
+        t_phase = perf_counter()
+        for ms in x_lst:
+            if ms in ms_ignore_list:
+                continue
+            try:
+                ms.manage_exceptionable()
+            except MetasockCloseCondition as e:
+                self._close_metasock(
+                    sid=ms.sid,
+                    reason=e.message)
+        t_next = perf_counter()
+        inst.record(('phase', 'xlist'), t_next - t_phase)
         #
-        # The caller may wish to use the return code to influence it on
-        # the timeout that it passes in on a further iteration.
-        if rlist or wlist or xlist or sock_ignore_list:
-            return True
-        else:
-            return False
-    def open_sub(self, addr, port, cb_sub_start, cb_sub_stop, cb_sub_recv):
+        t_phase = t_next
+        for fd in custom_lst:
+            if fd not in self.d_eng_custom_read:
+                continue
+            (cfd_h, cb_eng_custom_fd_read) = self.d_eng_custom_read[fd]
+            t_cb = perf_counter()
+            self._call_eng_custom_fd_read(
+                cfd_h=cfd_h,
+                fd=fd,
+                cb_eng_custom_fd_read=cb_eng_custom_fd_read)
+            inst.record(('callback', 'custom'), perf_counter() - t_cb)
+        t_next = perf_counter()
+        inst.record(('phase', 'custom'), t_next - t_phase)
+        #
+        t_phase = t_next
+        for ms in r_lst:
+            if ms in ms_ignore_list:
+                continue
+            t_cb = perf_counter()
+            try:
+                ms.manage_readable()
+            except MetasockCloseCondition as e:
+                self._close_metasock(
+                    sid=ms.sid,
+                    reason=e.message)
+            inst.record(('readable', ms.ms_type), perf_counter() - t_cb)
+        t_next = perf_counter()
+        inst.record(('phase', 'rlist'), t_next - t_phase)
+        #
+        t_phase = t_next
+        for ms in w_lst:
+            if ms in ms_ignore_list:
+                continue
+            t_cb = perf_counter()
+            try:
+                ms.manage_writable()
+            except MetasockCloseCondition as e:
+                self._close_metasock(
+                    sid=ms.sid,
+                    reason=e.message)
+            inst.record(('writable', ms.ms_type), perf_counter() - t_cb)
+        inst.record(('phase', 'wlist'), perf_counter() - t_phase)
+    def open_sub(self, addr, port, cb_sub_start, cb_sub_stop, cb_sub_recv, b_reuseport=False):
+        '''
+        b_reuseport: set SO_REUSEPORT on the socket. (See enable_reuseport.)
+        '''
         sid = self.create_sid()
         ms = metasock_create_sub(
             engine=self,
@@ -420,7 +936,8 @@ class Engine(object):
             port=port,
             cb_sub_start=cb_sub_start,
             cb_sub_stop=cb_sub_stop,
-            cb_sub_recv=cb_sub_recv)
+            cb_sub_recv=cb_sub_recv,
+            b_reuseport=b_reuseport)
         return sid
     def close_sub(self, sub_sid):
         self._close_metasock(
@@ -441,7 +958,7 @@ class Engine(object):
         self._close_metasock(
             sid=pub_sid,
             reason='close_pub %s'%(pub_sid))
-    def register_tcp_accept(self, accept_sock, addr, port, parent_sid, cb_tcp_accept_connect, cb_tcp_accept_condrop, cb_tcp_accept_recv):
+    def register_tcp_accept(self, accept_sock, addr, port, parent_sid, cb_tcp_accept_connect, cb_tcp_accept_condrop, cb_tcp_accept_recv, cb_tcp_accept_pause=None, cb_tcp_accept_resume=None):
         """When metasock has a tcp server, it will create a new socket
         whenever it does an accept. At this point, it passes that new
         sock here so that we can set up a new metasock to manage it.
@@ -457,13 +974,55 @@ class Engine(object):
             parent_sid=parent_sid,
             cb_tcp_accept_connect=cb_tcp_accept_connect,
             cb_tcp_accept_condrop=cb_tcp_accept_condrop,
-            cb_tcp_accept_recv=cb_tcp_accept_recv)
+            cb_tcp_accept_recv=cb_tcp_accept_recv,
+            cb_tcp_accept_pause=cb_tcp_accept_pause,
+            cb_tcp_accept_resume=cb_tcp_accept_resume)
         return accept_sid
+    def register_tcp_accepts(self, lst_accept, parent_sid, cb_tcp_accept_connect, cb_tcp_accept_condrop, cb_tcp_accept_recv, cb_tcp_accept_pause=None, cb_tcp_accept_resume=None):
+        '''
+        Batch form of register_tcp_accept. lst_accept contains tuples of
+        (accept_sock, addr, port) that a tcp server accepted in a single
+        turn.
+
+        User code may close the server from within its accept callback (a
+        single-client line console does this). In that case, connections
+        that were accepted behind it in the batch are closed, as they would
+        have been if they had still been sitting in the server's backlog.
+        '''
+        for (idx, (accept_sock, addr, port)) in enumerate(lst_accept):
+            if parent_sid not in self.sid_to_metasock:
+                for (sock, _, _) in lst_accept[idx:]:
+                    try:
+                        sock.close()
+                    except:
+                        pass
+                break
+            self.register_tcp_accept(
+                accept_sock=accept_sock,
+                addr=addr,
+                port=port,
+                parent_sid=parent_sid,
+                cb_tcp_accept_connect=cb_tcp_accept_connect,
+                cb_tcp_accept_condrop=cb_tcp_accept_condrop,
+                cb_tcp_accept_recv=cb_tcp_accept_recv,
+                cb_tcp_accept_pause=cb_tcp_accept_pause,
+                cb_tcp_accept_resume=cb_tcp_accept_resume)
     def close_tcp_accept(self, accept_sid):
         self._close_metasock(
             sid=accept_sid,
             reason='close_tcp_accept %s'%accept_sid)
-    def open_tcp_server(self, addr, port, cb_tcp_server_start, cb_tcp_server_stop, cb_tcp_accept_connect, cb_tcp_accept_condrop, cb_tcp_accept_recv):
+    def open_tcp_server(self, addr, port, cb_tcp_server_start, cb_tcp_server_stop, cb_tcp_accept_connect, cb_tcp_accept_condrop, cb_tcp_accept_recv, backlog=TCP_SERVER_BACKLOG, cb_tcp_accept_pause=None, cb_tcp_accept_resume=None, b_reuseport=False):
+        '''
+        backlog: passed to listen. This is the number of fully-established
+        connections the kernel will queue for us before it starts dropping
+        SYNs.
+
+        cb_tcp_accept_pause, cb_tcp_accept_resume: optional. Backpressure
+        for accepted connections. See set_send_watermarks.
+
+        b_reuseport: set SO_REUSEPORT on the listening socket, so that
+        other processes can listen on the same port. (See enable_reuseport.)
+        '''
         sid = self.create_sid()
         ms = metasock_create_tcp_server(
             engine=self,
@@ -471,17 +1030,25 @@ class Engine(object):
             sid=sid,
             addr=addr,
             port=port,
+            backlog=backlog,
             cb_tcp_server_start=cb_tcp_server_start,
             cb_tcp_server_stop=cb_tcp_server_stop,
             cb_tcp_accept_connect=cb_tcp_accept_connect,
             cb_tcp_accept_condrop=cb_tcp_accept_condrop,
-            cb_tcp_accept_recv=cb_tcp_accept_recv)
+            cb_tcp_accept_recv=cb_tcp_accept_recv,
+            cb_tcp_accept_pause=cb_tcp_accept_pause,
+            cb_tcp_accept_resume=cb_tcp_accept_resume,
+            b_reuseport=b_reuseport)
         return sid
     def close_tcp_server(self, server_sid):
         self._close_metasock(
             sid=server_sid,
             reason='close_tcp_server %s'%server_sid)
-    def open_tcp_client(self, addr, port, cb_tcp_client_connect, cb_tcp_client_condrop, cb_tcp_client_recv):
+    def open_tcp_client(self, addr, port, cb_tcp_client_connect, cb_tcp_client_condrop, cb_tcp_client_recv, cb_tcp_client_pause=None, cb_tcp_client_resume=None):
+        '''
+        cb_tcp_client_pause, cb_tcp_client_resume: optional. Backpressure.
+        See set_send_watermarks.
+        '''
         sid = self.create_sid()
         ms = metasock_create_tcp_client(
             engine=self,
@@ -491,7 +1058,9 @@ class Engine(object):
             port=port,
             cb_tcp_client_connect=cb_tcp_client_connect,
             cb_tcp_client_condrop=cb_tcp_client_condrop,
-            cb_tcp_client_recv=cb_tcp_client_recv)
+            cb_tcp_client_recv=cb_tcp_client_recv,
+            cb_tcp_client_pause=cb_tcp_client_pause,
+            cb_tcp_client_resume=cb_tcp_client_resume)
         return sid
     def close_tcp_client(self, client_sid):
         self._close_metasock(
@@ -509,14 +1078,49 @@ class Engine(object):
         called against the metasock. That way if any of those sockets try to
         send as part of their initialisation callbacks, the sid will be
         waiting in this map already.
+
+        This is also where the metasock's socket is registered with the
+        poller. From here on, the metasock tells us when its interest changes
+        (see _update_metasock_interest).
         '''
         self.sid_to_metasock[sid] = ms
+        #
+        ms.fd = ms.sock.fileno()
+        ms.b_poll_read = ms.desire_for_readable_select_list()
+        ms.b_poll_write = ms.desire_for_writable_select_list()
+        self.fd_to_metasock[ms.fd] = ms
+        self.poller.register(
+            fd=ms.fd,
+            b_read=ms.b_poll_read,
+            b_write=ms.b_poll_write)
+    def _update_metasock_interest(self, ms):
+        '''
+        Metasock calls this whenever something happens that could change
+        whether it wants to be read from or written to. We only go to the
+        poller if the interest has really changed.
+        '''
+        b_read = ms.desire_for_readable_select_list()
+        b_write = ms.desire_for_writable_select_list()
+        if b_read == ms.b_poll_read and b_write == ms.b_poll_write:
+            return
+        ms.b_poll_read = b_read
+        ms.b_poll_write = b_write
+        self.poller.modify(
+            fd=ms.fd,
+            b_read=b_read,
+            b_write=b_write)
     def _get_ms_for_sid(self, sid):
         return self.sid_to_metasock[sid]
     def _close_metasock(self, sid, reason):
         ms = self._get_ms_for_sid(
             sid=sid)
+        # Unregister before the socket is closed. After close, the
+        # descriptor number is no longer ours.
+        self.poller.unregister(
+            fd=ms.fd)
+        del self.fd_to_metasock[ms.fd]
         ms.eng_close(reason)
+        ms.drop_send_buf()
         del self.sid_to_metasock[sid]
         #
         # If we are in the middle of a select loop, there is a mechanism
@@ -0,0 +1,160 @@
+#
+# instrument
+#
+# // overview
+# Opt-in timing for the event loop. Use this to find out where the time
+# goes in a turn of the engine, and in particular where the long tail of
+# latency comes from: a slow spin, a slow callback, or time spent waiting in
+# the poller.
+#
+# Enable it with engine.enable_instrumentation(). The engine then records
+# durations into a set of histograms, named like this,
+#
+#   phase/turn          The whole of engine.turn
+#   phase/timers        Firing due timers
+#   phase/spins         Calling eng_turn on every spin
+#   phase/poll          Waiting in the poller (includes the timeout)
+#   phase/xlist         Handling exceptional sockets
+#   phase/custom        Handling custom fds (add_custom_fd_read)
+#   phase/rlist         Handling readable sockets
+#   phase/wlist         Handling writable sockets
+#
+#   spin/<spin_h>       A single call to eng_turn on one spin
+#   readable/<ms_type>  A single manage_readable call. This is where recv
+#                       callbacks run.
+#   writable/<ms_type>  A single manage_writable call. (Connect callbacks.)
+#   callback/custom     A single custom fd callback
+#   callback/timer      A single timer callback
+#
+# Histograms have fixed, power-of-two buckets in microseconds. Recording is
+# a bit_length and a list increment, so it is cheap enough to leave on in
+# production. Percentiles are estimated from the bucket boundaries, so treat
+# them as an upper bound within a factor of two. Where you need them exact
+# (as the benchmarks do), keep the samples and use sample_percentile.
+#
+# Take a snapshot with engine.get_instrumentation_snapshot(). Pass
+# b_reset=True to start a fresh interval at the same time.
+#
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+import math
+
+# Bucket 0 counts durations under one microsecond. Bucket i counts durations
+# of at least 2**(i-1) and under 2**i microseconds. The last bucket also
+# takes everything beyond it (around two minutes and up).
+COUNT_BUCKETS = 28
+
+PERCENTILES = (
+    ('p50', 0.5),
+    ('p90', 0.9),
+    ('p99', 0.99),
+    ('p999', 0.999))
+
+def bucket_upper_bound(idx):
+    'In seconds.'
+    return (1 << idx) / 1000000.0
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * COUNT_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    def record(self, seconds):
+        idx = int(seconds * 1000000).bit_length()
+        if idx >= COUNT_BUCKETS:
+            idx = COUNT_BUCKETS - 1
+        self.buckets[idx] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+    def reset(self):
+        for idx in range(COUNT_BUCKETS):
+            self.buckets[idx] = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    def percentile(self, fraction):
+        '''
+        Upper bound of the bucket that contains the requested percentile,
+        capped at the largest value seen. Returns 0.0 when empty.
+        '''
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        cumulative = 0
+        for (idx, n) in enumerate(self.buckets):
+            cumulative += n
+            if cumulative >= target:
+                if idx == COUNT_BUCKETS - 1:
+                    # (open-ended)
+                    return self.max
+                return min(bucket_upper_bound(idx), self.max)
+        return self.max
+    def snapshot(self):
+        d = {
+            'count': self.count,
+            'total': self.total,
+            'mean': (self.total / self.count) if self.count else 0.0,
+            'max': self.max,
+            # Only the buckets that have something in them, as
+            # [upper_bound_seconds, count]
+            'buckets': [ [bucket_upper_bound(idx), n]
+                         for (idx, n) in enumerate(self.buckets) if n ],
+        }
+        for (name, fraction) in PERCENTILES:
+            d[name] = self.percentile(fraction)
+        return d
+
+def sample_percentile(samples, fraction):
+    '''
+    Exact percentile (nearest rank) of samples, which must be sorted.
+    Returns 0.0 when there are none.
+    '''
+    if not samples:
+        return 0.0
+    idx = math.ceil(fraction * len(samples)) - 1
+    return samples[min(max(idx, 0), len(samples) - 1)]
+
+class Instrument:
+    '''
+    A set of histograms. Internally, these are keyed by (kind, name) tuples
+    so that the engine does not need to build strings on the hot path. The
+    snapshot joins them as kind/name.
+    '''
+    def __init__(self):
+        self.d_histogram = {}
+    def record(self, key, seconds):
+        histogram = self.d_histogram.get(key)
+        if histogram == None:
+            histogram = Histogram()
+            self.d_histogram[key] = histogram
+        histogram.record(seconds)
+    def reset(self):
+        for histogram in self.d_histogram.values():
+            histogram.reset()
+    def snapshot(self):
+        return dict( ('%s/%s'%(kind, name), histogram.snapshot())
+                     for ((kind, name), histogram)
+                     in self.d_histogram.items() )
+
+def instrument_new():
+    ob = Instrument()
+    return ob
@@ -56,8 +56,12 @@ from .cs import CsSubRecv
 from .cs import CsTcpClientCondrop
 from .cs import CsTcpClientConnect
 from .cs import CsTcpClientRecv
+from .cs import CsTcpClientPause
+from .cs import CsTcpClientResume
 from .cs import CsTcpAcceptCondrop
 from .cs import CsTcpAcceptConnect
+from .cs import CsTcpAcceptPause
+from .cs import CsTcpAcceptResume
 from .cs import CsTcpAcceptRecv
 from .cs import CsTcpServerStart
 from .cs import CsTcpServerStop
@@ -67,7 +71,9 @@ from solent import log
 
 from collections import deque
 import errno
+import ipaddress
 import socket
+import struct
 import traceback
 
 def l_cb_error(cb_struct):
@@ -79,6 +85,13 @@ class MetasockCloseCondition(Exception):
     def __init__(self, message):
         self.message = message
 
+# Most buffers we will hand to a single sendmsg call. POSIX guarantees at
+# least 16 (IOV_MAX); Linux allows 1024.
+SEND_IOV_MAX = 64
+
+# Windows sockets do not offer sendmsg
+HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+
 MS_TYPE_TCP_ACCEPT = 'tcp_accept'
 MS_TYPE_TCP_CLIENT = 'tcp_client'
 MS_TYPE_TCP_SERVER = 'tcp_server'
@@ -98,9 +111,9 @@ class Metasock(object):
     information separately.
     
     An instance of this class tracks whether you want for it to be read from
-    or written to. This information will be used for contructing a select call
-    on the fly, and for appropriately managing a socket when it is market as
-    ready-for-action by the return from select().
+    or written to. This information is registered with the engine's poller
+    (see poller.py) whenever it changes, and is used for appropriately
+    managing a socket when it is marked as ready-for-action by the poller.
 
     // Anything else?
 
@@ -122,11 +135,45 @@ class Metasock(object):
         self.sock = None
         self.parent_sid = None
         #
+        # The engine fills these in when it registers the socket with its
+        # poller. They record the interest the poller currently holds for
+        # us, so that we only go back to the poller when it changes.
+        self.fd = None
+        self.b_poll_read = False
+        self.b_poll_write = False
+        #
         self.can_it_recv = False
         self.recv_len = engine.mtu
+        # Receive buffer, reused for every read. The factories allocate
+        # this for metasocks that can recv.
+        self.recv_arr = None
+        self.recv_mv = None
         #
         self.can_it_send = False
-        self.send_buf = deque() # buffers sips
+        # Queue of (bb, sip) tuples. bb is the buffer to be sent (bytes,
+        # bytearray or a byte-format memoryview). sip is the sip that owns
+        # it, which we will return to the mempool once it has been sent, or
+        # None where the buffer belongs to the application (see
+        # engine.send_view).
+        self.send_buf = deque()
+        # Number of bytes of the entry at the head of send_buf that have
+        # already been sent. (Stream sockets only.)
+        self.send_offset = 0
+        # Reused by _flush_stream to gather memoryviews for sendmsg.
+        self.send_views = []
+        # Backpressure. send_buf_bytes is the number of bytes in send_buf
+        # that have not yet gone to the kernel. When it rises to the high
+        # watermark we tell the producer to pause, and when it has fallen
+        # back to the low watermark we tell it to resume. The gap between
+        # the two stops us from flapping.
+        self.send_buf_bytes = 0
+        self.send_high_watermark = engine.send_high_watermark
+        self.send_low_watermark = engine.send_low_watermark
+        self.b_send_paused = False
+        #
+        # Reused by tcp servers for batching accepts. tuples of
+        # (accept_sock, addr, port)
+        self.accept_buf = []
         #
         self.b_tcp_client_connecting = False
         #
@@ -152,10 +199,23 @@ class Metasock(object):
         self.cs_tcp_client_condrop = CsTcpClientCondrop()
         self.cb_tcp_client_recv = l_cb_error('cb_tcp_client_recv not set')
         self.cs_tcp_client_recv = CsTcpClientRecv()
+        # The pause/resume callbacks are optional. Where they are None, we
+        # still track the watermarks, but tell no-one.
+        self.cb_tcp_accept_pause = None
+        self.cs_tcp_accept_pause = CsTcpAcceptPause()
+        self.cb_tcp_accept_resume = None
+        self.cs_tcp_accept_resume = CsTcpAcceptResume()
+        self.cb_tcp_client_pause = None
+        self.cs_tcp_client_pause = CsTcpClientPause()
+        self.cb_tcp_client_resume = None
+        self.cs_tcp_client_resume = CsTcpClientResume()
         self.cb_tcp_server_start = l_cb_error('cb_tcp_server_start not set')
         self.cs_tcp_server_start = CsTcpServerStart()
         self.cb_tcp_server_stop = l_cb_error('cb_tcp_server_stop not set')
         self.cs_tcp_server_stop = CsTcpServerStop()
+    def alloc_recv_buffer(self):
+        self.recv_arr = bytearray(self.recv_len)
+        self.recv_mv = memoryview(self.recv_arr)
     def after_init(self):
         '''This gets called after the factory function has finished setting up
         the instance to its taste. In practice, it's useful for sending
@@ -254,6 +314,10 @@ class Metasock(object):
         else:
             raise Exception('Algorithm exception. [%s]'%(self.ms_type))
     def desire_for_readable_select_list(self):
+        if self.ms_type == MS_TYPE_TCP_SERVER:
+            # For a listening socket, readable means that there is a
+            # connection waiting to be accepted.
+            return True
         if self.b_tcp_client_connecting:
             # (Because the process of connecting is handled out of the writable
             # select list.)
@@ -262,16 +326,93 @@ class Metasock(object):
             return True
         return False
     def desire_for_writable_select_list(self):
-        if self.b_tcp_client_connecting:
-            return True
         if self.ms_type == MS_TYPE_TCP_SERVER:
+            # A listening socket never has anything to write. On some
+            # platforms it will be reported as writable on every pass if we
+            # ask, and that would stop the engine from ever going idle.
+            return False
+        if self.b_tcp_client_connecting:
             return True
         if self.can_it_send and self.send_buf:
             return True
         return False
-    def copy_to_send_queue(self, sip):
-        self.send_buf.append(
-            self.mempool.clone(sip))
+    def enqueue_send(self, bb, sip):
+        '''
+        No copy is made. See the notes on send_buf for the meaning of the
+        arguments.
+        '''
+        self.send_buf.append( (bb, sip) )
+        self.send_buf_bytes += len(bb)
+        if 1 == len(self.send_buf):
+            # We have gone from nothing-to-send to something-to-send.
+            self.engine._update_metasock_interest(self)
+        if not self.b_send_paused:
+            if self.send_buf_bytes >= self.send_high_watermark:
+                self._pause_producer()
+    def set_send_watermarks(self, high, low):
+        self.send_high_watermark = high
+        self.send_low_watermark = low
+        if self.b_send_paused:
+            if self.send_buf_bytes <= low:
+                self._resume_producer()
+        elif self.send_buf_bytes >= high:
+            self._pause_producer()
+    def _pause_producer(self):
+        '''
+        The send queue has reached its high watermark. Note that this is
+        called from within engine.send, so the producer will hear about it
+        before its call to send returns.
+        '''
+        self.b_send_paused = True
+        if self.ms_type == MS_TYPE_TCP_ACCEPT:
+            if self.cb_tcp_accept_pause == None:
+                return
+            self.cs_tcp_accept_pause.engine = self.engine
+            self.cs_tcp_accept_pause.server_sid = self.parent_sid
+            self.cs_tcp_accept_pause.accept_sid = self.sid
+            self.cs_tcp_accept_pause.send_queue_bytes = self.send_buf_bytes
+            self.cb_tcp_accept_pause(
+                cs_tcp_accept_pause=self.cs_tcp_accept_pause)
+        elif self.ms_type == MS_TYPE_TCP_CLIENT:
+            if self.cb_tcp_client_pause == None:
+                return
+            self.cs_tcp_client_pause.engine = self.engine
+            self.cs_tcp_client_pause.client_sid = self.sid
+            self.cs_tcp_client_pause.send_queue_bytes = self.send_buf_bytes
+            self.cb_tcp_client_pause(
+                cs_tcp_client_pause=self.cs_tcp_client_pause)
+    def _resume_producer(self):
+        self.b_send_paused = False
+        if self.ms_type == MS_TYPE_TCP_ACCEPT:
+            if self.cb_tcp_accept_resume == None:
+                return
+            self.cs_tcp_accept_resume.engine = self.engine
+            self.cs_tcp_accept_resume.server_sid = self.parent_sid
+            self.cs_tcp_accept_resume.accept_sid = self.sid
+            self.cs_tcp_accept_resume.send_queue_bytes = self.send_buf_bytes
+            self.cb_tcp_accept_resume(
+                cs_tcp_accept_resume=self.cs_tcp_accept_resume)
+        elif self.ms_type == MS_TYPE_TCP_CLIENT:
+            if self.cb_tcp_client_resume == None:
+                return
+            self.cs_tcp_client_resume.engine = self.engine
+            self.cs_tcp_client_resume.client_sid = self.sid
+            self.cs_tcp_client_resume.send_queue_bytes = self.send_buf_bytes
+            self.cb_tcp_client_resume(
+                cs_tcp_client_resume=self.cs_tcp_client_resume)
+    def drop_send_buf(self):
+        '''
+        Returns any unsent sips to the mempool. The engine calls this after
+        the socket has been closed.
+        '''
+        send_buf = self.send_buf
+        while send_buf:
+            (bb, sip) = send_buf.popleft()
+            if sip != None:
+                self.mempool.free(
+                    sip=sip)
+        self.send_offset = 0
+        self.send_buf_bytes = 0
     def manage_exceptionable(self):
         '''
         Managed socket has appeared in xlist in the select. At some point we
@@ -295,40 +436,68 @@ class Metasock(object):
         #
         # // server socket codepath
         if self.ms_type == MS_TYPE_TCP_SERVER:
-            (accept_sock, (addr, port)) = self.sock.accept()
-            self.engine.register_tcp_accept(
-                accept_sock=accept_sock,
-                addr=addr,
-                port=port,
-                parent_sid=self.sid,
-                cb_tcp_accept_connect=self.cb_tcp_accept_connect,
-                cb_tcp_accept_condrop=self.cb_tcp_accept_condrop,
-                cb_tcp_accept_recv=self.cb_tcp_accept_recv)
+            self._accept_until_drained()
             return
         #
         # // non-server socket codepath
-        try:
-            bb = self.sock.recv(self.recv_len)
-        except Exception as e:
-            # If you're going to disappear errors here, do it with an
-            # exception that is specific to a real read_fail. Note,
-            # * You can't count on e.message existing
-            # * Ugly string comparison might be the only way to do it
-            log('recv exception [sid %s] [%s]'%(self.sid, str(e)))
-            raise MetasockCloseCondition('read_fail')
-            return
-        if bb in (None,) or 0 == len(bb):
-            # In this case, it's presumed that select told you that it
-            # was good to read from this, and yet when you went to read
-            # there wasn't anything empty. This indicates that it's time
-            # to close the socket, which we'll now do.
-            #
-            # Note that we're telling the network engine that we're done
-            # here, and not calling our own close method directly. This
-            # is so that cleanup happens properly.
-            self.engine._close_metasock(self.sid, 'empty_recv')
-            return
         #
+        # We read into a buffer that this metasock owns, and keep reading
+        # until the kernel has nothing more for us (EAGAIN), or we have
+        # taken the engine's per-turn byte budget. (The poller is
+        # level-triggered, so anything left over gets picked up on the next
+        # turn.)
+        engine = self.engine
+        budget = engine.recv_budget
+        b_recv_views = engine.b_recv_views
+        b_stream = self.ms_type != MS_TYPE_SUB
+        recv_arr = self.recv_arr
+        recv_mv = self.recv_mv
+        recv_len = len(recv_arr)
+        received = 0
+        while received < budget:
+            try:
+                n = self.sock.recv_into(recv_arr)
+            except (BlockingIOError, InterruptedError):
+                return
+            except Exception as e:
+                # If you're going to disappear errors here, do it with an
+                # exception that is specific to a real read_fail. Note,
+                # * You can't count on e.message existing
+                # * Ugly string comparison might be the only way to do it
+                log('recv exception [sid %s] [%s]'%(self.sid, str(e)))
+                raise MetasockCloseCondition('read_fail')
+                return
+            if 0 == n:
+                # In this case, it's presumed that select told you that it
+                # was good to read from this, and yet when you went to read
+                # there wasn't anything empty. This indicates that it's time
+                # to close the socket, which we'll now do.
+                #
+                # Note that we're telling the network engine that we're done
+                # here, and not calling our own close method directly. This
+                # is so that cleanup happens properly.
+                engine._close_metasock(self.sid, 'empty_recv')
+                return
+            received += n
+            #
+            # By default, the callback gets its own copy of the data. If the
+            # application has opted in to views, it gets a slice of our
+            # buffer, which is only valid until the callback returns. (If
+            # you want to keep it, copy it.)
+            if b_recv_views:
+                bb = recv_mv[:n]
+            else:
+                bb = bytes(recv_mv[:n])
+            self._call_recv(bb)
+            #
+            # The callback may have closed us.
+            if engine.sid_to_metasock.get(self.sid) is not self:
+                return
+            if b_stream and n < recv_len:
+                # A short read from a stream means that the kernel had no
+                # more. This saves a recv call that would give EAGAIN.
+                return
+    def _call_recv(self, bb):
         if self.ms_type == MS_TYPE_PUB:
             raise Exception("This port should never recv.")
         elif self.ms_type == MS_TYPE_SUB:
@@ -359,6 +528,45 @@ class Metasock(object):
             raise Exception("Should not get here.")
         else:
             raise Exception("Algorithm exception [%s]"%(self.ms_type))
+    def _accept_until_drained(self):
+        '''
+        Under a connection storm, accepting one connection per wakeup means
+        that each new client costs a full turn of the engine, and the kernel
+        drops SYNs once the backlog fills. Instead, we accept until the
+        kernel tells us there is nothing left (EAGAIN), or until we have
+        used up the engine's per-turn accept budget. Anything left over will
+        still be there on the next turn, since the poller is level-triggered.
+        '''
+        lst_accept = self.accept_buf
+        budget = self.engine.accept_budget
+        while len(lst_accept) < budget:
+            try:
+                (accept_sock, (addr, port)) = self.sock.accept()
+            except (BlockingIOError, InterruptedError):
+                break
+            except ConnectionAbortedError:
+                # The client gave up while it was in the backlog. Move on
+                # to the next one.
+                continue
+            except OSError as e:
+                # Typically EMFILE/ENFILE. Leave the connection in the
+                # backlog and try again later.
+                log('accept exception [sid %s] [%s]'%(self.sid, str(e)))
+                break
+            lst_accept.append( (accept_sock, addr, port) )
+        if not lst_accept:
+            return
+        try:
+            self.engine.register_tcp_accepts(
+                lst_accept=lst_accept,
+                parent_sid=self.sid,
+                cb_tcp_accept_connect=self.cb_tcp_accept_connect,
+                cb_tcp_accept_condrop=self.cb_tcp_accept_condrop,
+                cb_tcp_accept_recv=self.cb_tcp_accept_recv,
+                cb_tcp_accept_pause=self.cb_tcp_accept_pause,
+                cb_tcp_accept_resume=self.cb_tcp_accept_resume)
+        finally:
+            lst_accept.clear()
     def manage_writable(self):
         '''
         When select marks a socket as writable, it implies one of these
@@ -390,37 +598,124 @@ class Metasock(object):
                               , '[%s:%s]'%(ec, e_message)
                               ] )
                 raise MetasockCloseCondition(r)
+            self.engine._update_metasock_interest(self)
             return
         try:
-            if self.send_buf:
-                sip = self.send_buf.popleft()
-                bb = sip.get()
-                send_size = self.sock.send(bb)
-                if send_size == len(bb):
-                    # Ideal situation: our send was successful
-                    self.mempool.free(
-                        sip=sip)
-                elif 0 == send_size:
-                    # Network conjestion or slow throughput by the reader
-                    # is causing things to back up. This will happen from
-                    # time to time in normal operation.
-                    self.send_buf.appendleft(sip)
-                else:
-                    # This is weird. Since our bb must be smaller than
-                    # the MTU size, this should never happen.
-                    raise Algorithm("Weird: partial payload send. %s of %s"%(
-                        send_size, len(bb)))
+            if self.ms_type == MS_TYPE_PUB:
+                self._flush_datagrams()
+            else:
+                self._flush_stream()
+        except MetasockCloseCondition:
+            raise
         except:
             # When you try to do a send to a BSD socket that is in the
             # process of going down, you can get an exception. This caterss
             # for that scenario.
             raise MetasockCloseCondition('send_fail')
             return
+        if not self.send_buf:
+            # Nothing left to send. Stop asking to be told about writability.
+            self.engine._update_metasock_interest(self)
+        if self.b_send_paused:
+            if self.send_buf_bytes <= self.send_low_watermark:
+                self._resume_producer()
+    def _flush_datagrams(self):
+        '''
+        Each sip in the send buffer is a datagram, so these have to go out
+        with one send each. We keep going until the kernel pushes back.
+        '''
+        send_buf = self.send_buf
+        while send_buf:
+            (bb, sip) = send_buf[0]
+            try:
+                self.sock.send(bb)
+            except (BlockingIOError, InterruptedError):
+                return
+            send_buf.popleft()
+            self.send_buf_bytes -= len(bb)
+            if sip != None:
+                self.mempool.free(
+                    sip=sip)
+    def _flush_stream(self):
+        '''
+        For a stream socket, the send buffer is a sequence of bytes that
+        happens to be stored in several sips. We hand as many of them as we
+        can to the kernel in each call (scatter-gather, via sendmsg), and
+        keep going until the kernel's buffer is full.
+
+        The kernel may accept only part of what we offer. send_offset is a
+        cursor into the sip at the head of the queue, marking how much of it
+        has already gone.
+        '''
+        send_buf = self.send_buf
+        views = self.send_views
+        while send_buf:
+            total = 0
+            for (bb, sip) in send_buf:
+                if not views and self.send_offset:
+                    bb = memoryview(bb)[self.send_offset:]
+                views.append(bb)
+                total += len(bb)
+                if len(views) == SEND_IOV_MAX:
+                    break
+            try:
+                if HAS_SENDMSG:
+                    sent = self.sock.sendmsg(views)
+                else:
+                    # Windows. One buffer at a time.
+                    total = len(views[0])
+                    sent = self.sock.send(views[0])
+            except (BlockingIOError, InterruptedError):
+                return
+            finally:
+                views.clear()
+            self._consume_sent(sent)
+            if sent < total:
+                # The kernel took what it could. We will hear from the poller
+                # when there is room for more.
+                return
+    def _consume_sent(self, sent):
+        self.send_buf_bytes -= sent
+        send_buf = self.send_buf
+        while sent:
+            (bb, sip) = send_buf[0]
+            remaining = len(bb) - self.send_offset
+            if sent < remaining:
+                self.send_offset += sent
+                return
+            sent -= remaining
+            send_buf.popleft()
+            self.send_offset = 0
+            if sip != None:
+                self.mempool.free(
+                    sip=sip)
 
 def sock_nodelay_condition(engine, sock):
     if engine.b_nodelay:
         sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
+def sock_reuseport_condition(engine, sock, b_reuseport):
+    if not (b_reuseport or engine.b_reuseport):
+        return
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        raise Exception("SO_REUSEPORT is not available on this platform.")
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+def sock_multicast_membership_condition(sock, addr):
+    # A socket bound to a multicast group only sees the group's traffic
+    # once it has joined the group.
+    try:
+        if not ipaddress.ip_address(addr).is_multicast:
+            return
+    except ValueError:
+        # a hostname
+        return
+    mreq = struct.pack(
+        '!4sI',
+        socket.inet_aton(addr),
+        socket.INADDR_ANY)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+
 def metasock_create_pub(engine, mempool, sid, addr, port, cb_pub_start, cb_pub_stop):
     log('metasock_create_pub %s (%s:%s)'%(sid, addr, port))
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  
@@ -430,6 +725,7 @@ def metasock_create_pub(engine, mempool, sid, addr, port, cb_pub_start, cb_pub_s
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)  
     sock.connect((addr, port))
+    sock.setblocking(0)
     #
     ms = Metasock(
         engine=engine,
@@ -451,14 +747,21 @@ def metasock_create_pub(engine, mempool, sid, addr, port, cb_pub_start, cb_pub_s
     #
     return ms
 
-def metasock_create_sub(engine, mempool, sid, addr, port, cb_sub_start, cb_sub_stop, cb_sub_recv):
+def metasock_create_sub(engine, mempool, sid, addr, port, cb_sub_start, cb_sub_stop, cb_sub_recv, b_reuseport=False):
     log('metasock_create_sub %s (%s:%s)'%(sid, addr, port))
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock_nodelay_condition(
         engine=engine,
         sock=sock)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock_reuseport_condition(
+        engine=engine,
+        sock=sock,
+        b_reuseport=b_reuseport)
     sock.bind((addr, port))
+    sock_multicast_membership_condition(
+        sock=sock,
+        addr=addr)
     sock.setblocking(0)
     #
     ms = Metasock(
@@ -470,6 +773,7 @@ def metasock_create_sub(engine, mempool, sid, addr, port, cb_sub_start, cb_sub_s
         port=port)
     ms.sock = sock
     ms.can_it_recv = True
+    ms.alloc_recv_buffer()
     ms.can_it_send = False
     ms.cb_sub_start = cb_sub_start
     ms.cb_sub_stop = cb_sub_stop
@@ -482,7 +786,7 @@ def metasock_create_sub(engine, mempool, sid, addr, port, cb_sub_start, cb_sub_s
     #
     return ms
 
-def metasock_create_tcp_accept(engine, mempool, sid, accept_sock, addr, port, parent_sid, cb_tcp_accept_connect, cb_tcp_accept_condrop, cb_tcp_accept_recv):
+def metasock_create_tcp_accept(engine, mempool, sid, accept_sock, addr, port, parent_sid, cb_tcp_accept_connect, cb_tcp_accept_condrop, cb_tcp_accept_recv, cb_tcp_accept_pause=None, cb_tcp_accept_resume=None):
     """This is in the chain of functions that get called after a tcp server
     accepts a connection. In BSD sockets language, this is considered to be a
     'client' socket. But in our language, we call this an 'accept' socket.
@@ -491,6 +795,9 @@ def metasock_create_tcp_accept(engine, mempool, sid, accept_sock, addr, port, pa
     sock_nodelay_condition(
         engine=engine,
         sock=accept_sock)
+    # In python, accepted sockets do not inherit non-blocking mode from the
+    # listening socket.
+    accept_sock.setblocking(0)
     #
     ms = Metasock(
         engine=engine,
@@ -501,11 +808,14 @@ def metasock_create_tcp_accept(engine, mempool, sid, accept_sock, addr, port, pa
         port=port)
     ms.sock = accept_sock
     ms.can_it_recv = True
+    ms.alloc_recv_buffer()
     ms.can_it_send = True
     ms.parent_sid = parent_sid
     ms.cb_tcp_accept_connect = cb_tcp_accept_connect
     ms.cb_tcp_accept_condrop = cb_tcp_accept_condrop
     ms.cb_tcp_accept_recv = cb_tcp_accept_recv
+    ms.cb_tcp_accept_pause = cb_tcp_accept_pause
+    ms.cb_tcp_accept_resume = cb_tcp_accept_resume
     #
     engine._map_sid_to_metasock(
         sid=sid,
@@ -514,7 +824,7 @@ def metasock_create_tcp_accept(engine, mempool, sid, accept_sock, addr, port, pa
     #
     return ms
 
-def metasock_create_tcp_client(engine, mempool, sid, addr, port, cb_tcp_client_connect, cb_tcp_client_condrop, cb_tcp_client_recv):
+def metasock_create_tcp_client(engine, mempool, sid, addr, port, cb_tcp_client_connect, cb_tcp_client_condrop, cb_tcp_client_recv, cb_tcp_client_pause=None, cb_tcp_client_resume=None):
     log('metasock_create_tcp_client %s (%s:%s)'%(sid, addr, port))
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock_nodelay_condition(
@@ -532,11 +842,14 @@ def metasock_create_tcp_client(engine, mempool, sid, addr, port, cb_tcp_client_c
         port=port)
     ms.sock = sock
     ms.can_it_recv = True
+    ms.alloc_recv_buffer()
     ms.can_it_send = True
     ms.b_tcp_client_connecting = True
     ms.cb_tcp_client_connect = cb_tcp_client_connect
     ms.cb_tcp_client_condrop = cb_tcp_client_condrop
     ms.cb_tcp_client_recv = cb_tcp_client_recv
+    ms.cb_tcp_client_pause = cb_tcp_client_pause
+    ms.cb_tcp_client_resume = cb_tcp_client_resume
     #
     engine._map_sid_to_metasock(
         sid=sid,
@@ -545,16 +858,20 @@ def metasock_create_tcp_client(engine, mempool, sid, addr, port, cb_tcp_client_c
     #
     return ms
 
-def metasock_create_tcp_server(engine, mempool, sid, addr, port, cb_tcp_server_start, cb_tcp_server_stop, cb_tcp_accept_connect, cb_tcp_accept_condrop, cb_tcp_accept_recv):
+def metasock_create_tcp_server(engine, mempool, sid, addr, port, backlog, cb_tcp_server_start, cb_tcp_server_stop, cb_tcp_accept_connect, cb_tcp_accept_condrop, cb_tcp_accept_recv, cb_tcp_accept_pause=None, cb_tcp_accept_resume=None, b_reuseport=False):
     log('metasock_create_tcp_server %s (%s:%s)'%(sid, addr, port))
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock_nodelay_condition(
         engine=engine,
         sock=sock)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock_reuseport_condition(
+        engine=engine,
+        sock=sock,
+        b_reuseport=b_reuseport)
     sock.bind((addr, port))
     sock.setblocking(0)
-    sock.listen(0)
+    sock.listen(backlog)
     #
     ms = Metasock(
         engine=engine,
@@ -565,10 +882,12 @@ def metasock_create_tcp_server(engine, mempool, sid, addr, port, cb_tcp_server_s
         port=port)
     ms.sock = sock
     ms.can_it_recv = True
-    ms.can_it_send = True
+    ms.can_it_send = False
     ms.cb_tcp_accept_condrop = cb_tcp_accept_condrop
     ms.cb_tcp_accept_connect = cb_tcp_accept_connect
     ms.cb_tcp_accept_recv = cb_tcp_accept_recv
+    ms.cb_tcp_accept_pause = cb_tcp_accept_pause
+    ms.cb_tcp_accept_resume = cb_tcp_accept_resume
     ms.cb_tcp_server_start = cb_tcp_server_start
     ms.cb_tcp_server_stop = cb_tcp_server_stop
     #
@@ -0,0 +1,309 @@
+#
+# nearcast codec
+#
+# // overview
+# Binary encoding for the messages of a typed nearcast schema. This is what
+# you would use to move nearcast traffic off the box, or onto disk.
+#
+# A schema is typed when its fields have types, declared like this,
+#
+#   i message h
+#       i field h t
+#
+#   message person
+#       field h vs
+#       field age u1
+#       field photo_ref ref
+#
+# The types follow the primitives on Sip,
+#
+#   u1, u2, u4, u8  unsigned ints, big-endian
+#   vs              a str, stored as u2 length then utf8 (see Sip.store_vs)
+#   bytes           as vs, but the value is bytes
+#   ref             a u8 reference, stored with Sip.put_ref
+#
+# An encoded message is a u2 (the position of the message in the schema),
+# and then the fields in schema order. There is no padding.
+#
+# We generate an encoder and a decoder for each message. Neighbouring
+# fixed-size fields are packed with a single precompiled struct.Struct.
+#
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+import struct
+import zlib
+
+FIELD_TYPES = ('u1', 'u2', 'u4', 'u8', 'vs', 'bytes', 'ref')
+
+# struct codes for the fixed-size types
+STRUCT_CODES = {
+    'u1': 'B',
+    'u2': 'H',
+    'u4': 'I',
+    'u8': 'Q',
+}
+
+VS_MAX = 65535
+
+S_U2 = struct.Struct('!H')
+S_U8 = struct.Struct('!Q')
+
+class NearcastCodecOverflow(Exception):
+    '''
+    Raised by encode when the message does not fit in the sip. Nothing has
+    been written when this happens, so a caller that is packing messages
+    can send what it has and try again in a fresh sip.
+    '''
+    pass
+
+def codec_overflow(message_h, needed, room):
+    raise NearcastCodecOverflow("Encoding [%s] needs %s bytes, have %s."%(
+        message_h, needed, room))
+
+def codec_underflow(message_h, needed, room):
+    raise Exception("Decoding [%s] needs %s bytes, have %s."%(
+        message_h, needed, room))
+
+def codec_vs_too_long(message_h, field, length):
+    raise Exception("Field [%s:%s] is %s bytes. (Max %s.)"%(
+        message_h, field, length, VS_MAX))
+
+def _segments(fields, types):
+    '''
+    Groups the fields into runs that a single struct can pack. Returns a
+    list of ('fixed', [field], fmt), ('vs', field), ('bytes', field) and
+    ('ref', field).
+    '''
+    segments = []
+    run = None
+    for (field, t) in zip(fields, types):
+        if t in STRUCT_CODES:
+            if run == None:
+                run = ('fixed', [], [])
+                segments.append(run)
+            run[1].append(field)
+            run[2].append(STRUCT_CODES[t])
+        else:
+            run = None
+            segments.append( (t, field) )
+    return [ (s[0], s[1], '!' + ''.join(s[2])) if s[0] == 'fixed' else s
+             for s in segments ]
+
+def _render_encoder(idx, message_h, fields, types, structs):
+    sb = []
+    sb.append('def encode_%s(record, sip, o):'%(message_h))
+    sb.append('    arr = sip.arr')
+    size = 2
+    var_terms = []
+    for (field, t) in zip(fields, types):
+        if t in STRUCT_CODES:
+            size += struct.calcsize('!' + STRUCT_CODES[t])
+        elif t == 'ref':
+            size += 8
+        else:
+            size += 2
+            if t == 'vs':
+                sb.append("    v_%s = record.%s.encode('utf8')"%(field, field))
+            else:
+                sb.append('    v_%s = record.%s'%(field, field))
+            sb.append('    if len(v_%s) > VS_MAX:'%(field))
+            sb.append("        codec_vs_too_long('%s', '%s', len(v_%s))"%(
+                message_h, field, field))
+            var_terms.append('len(v_%s)'%(field))
+    sb.append('    end = o + %s'%(' + '.join([str(size)] + var_terms)))
+    sb.append('    if end > sip.size:')
+    sb.append("        codec_overflow('%s', end - o, sip.size - o)"%(
+        message_h))
+    #
+    # The message id goes in with the first run of fixed fields, if the
+    # message starts with one.
+    segments = _segments(fields, types)
+    if segments and segments[0][0] == 'fixed':
+        (_, run_fields, fmt) = segments.pop(0)
+        fmt = '!H' + fmt[1:]
+        values = ['%s'%(idx)] + ['record.%s'%f for f in run_fields]
+    else:
+        fmt = '!H'
+        values = ['%s'%(idx)]
+    structs.append(struct.Struct(fmt))
+    sb.append('    structs[%s].pack_into(arr, o, %s)'%(
+        len(structs) - 1, ', '.join(values)))
+    sb.append('    o += %s'%(struct.calcsize(fmt)))
+    for segment in segments:
+        kind = segment[0]
+        if kind == 'fixed':
+            (_, run_fields, fmt) = segment
+            structs.append(struct.Struct(fmt))
+            sb.append('    structs[%s].pack_into(arr, o, %s)'%(
+                len(structs) - 1,
+                ', '.join(['record.%s'%f for f in run_fields])))
+            sb.append('    o += %s'%(struct.calcsize(fmt)))
+        elif kind == 'ref':
+            field = segment[1]
+            sb.append('    sip.put_ref(')
+            sb.append('        ref=record.%s,'%(field))
+            sb.append('        o=o)')
+            sb.append('    o += 8')
+        else:
+            field = segment[1]
+            sb.append('    n = len(v_%s)'%(field))
+            sb.append('    S_U2.pack_into(arr, o, n)')
+            sb.append('    arr[o+2:o+2+n] = v_%s'%(field))
+            sb.append('    o += 2 + n')
+    sb.append('    return o')
+    return sb
+
+def _render_decoder(message_h, fields, types, structs):
+    sb = []
+    sb.append('def decode_%s(arr, o, cog_h):'%(message_h))
+    for segment in _segments(fields, types):
+        kind = segment[0]
+        if kind == 'fixed':
+            (_, run_fields, fmt) = segment
+            size = struct.calcsize(fmt)
+            structs.append(struct.Struct(fmt))
+            sb.append('    if o + %s > len(arr):'%(size))
+            sb.append("        codec_underflow('%s', %s, len(arr) - o)"%(
+                message_h, size))
+            sb.append('    (%s,) = structs[%s].unpack_from(arr, o)'%(
+                ', '.join(['f_%s'%f for f in run_fields]), len(structs) - 1))
+            sb.append('    o += %s'%(size))
+        elif kind == 'ref':
+            field = segment[1]
+            sb.append('    if o + 8 > len(arr):')
+            sb.append("        codec_underflow('%s', 8, len(arr) - o)"%(
+                message_h))
+            sb.append('    (f_%s,) = S_U8.unpack_from(arr, o)'%(field))
+            sb.append('    o += 8')
+        else:
+            field = segment[1]
+            sb.append('    if o + 2 > len(arr):')
+            sb.append("        codec_underflow('%s', 2, len(arr) - o)"%(
+                message_h))
+            sb.append('    (n,) = S_U2.unpack_from(arr, o)')
+            sb.append('    o += 2')
+            sb.append('    if o + n > len(arr):')
+            sb.append("        codec_underflow('%s', n, len(arr) - o)"%(
+                message_h))
+            if kind == 'vs':
+                sb.append("    f_%s = str(arr[o:o+n], 'utf8')"%(field))
+            else:
+                sb.append('    f_%s = bytes(arr[o:o+n])'%(field))
+            sb.append('    o += n')
+    sb.append('    record = records[%r](%s)'%(
+        message_h, ', '.join(['cog_h'] + ['f_%s'%f for f in fields])))
+    sb.append('    return (record, o)')
+    return sb
+
+def nearcast_schema_crc(nearcast_schema):
+    '''
+    A checksum over the messages, fields and types of a typed schema. Two
+    ends that agree on this can read each other's encoded messages.
+    '''
+    sb = []
+    for (message_h, fields) in nearcast_schema.messages.items():
+        types = nearcast_schema.field_types[message_h]
+        sb.append('%s(%s)'%(message_h, ','.join(
+            ['%s:%s'%(f, t) for (f, t) in zip(fields, types)])))
+    return zlib.crc32(';'.join(sb).encode('utf8'))
+
+class NearcastCodec:
+    '''
+    Encodes the message records of a typed nearcast schema to sips, and
+    decodes them back again. Get one from nearcast_schema.get_codec().
+    '''
+    def __init__(self, schema_h, d_encoders, decoders):
+        self.schema_h = schema_h
+        # message_h vs fn(record, sip, o) -> o
+        self.d_encoders = d_encoders
+        # by message id, fn(arr, o, cog_h) -> (record, o)
+        self.decoders = decoders
+    def encode(self, record, sip, o=0):
+        '''
+        Writes record into sip at offset o. Returns the offset just past
+        what it wrote.
+        '''
+        return self.d_encoders[record.message_h](record, sip, o)
+    def decode(self, sip, o=0, cog_h=None):
+        '''
+        Reads a message from sip at offset o. Returns (record, o), where o
+        is the offset just past the message. The wire format does not carry
+        the sender, so the record gets cog_h.
+        '''
+        return self.decode_bytes(
+            bb=sip.view(),
+            o=o,
+            cog_h=cog_h)
+    def decode_bytes(self, bb, o=0, cog_h=None):
+        'As decode, but from bytes or a bytearray.'
+        if o + 2 > len(bb):
+            raise Exception("No message id at offset %s."%(o))
+        (idx,) = S_U2.unpack_from(bb, o)
+        if idx >= len(self.decoders):
+            raise Exception("Unknown message id %s for schema [%s]."%(
+                idx, self.schema_h))
+        return self.decoders[idx](bb, o + 2, cog_h)
+
+def compile_nearcast_codec(nearcast_schema):
+    '''
+    Generates the encoders and decoders for a typed nearcast schema, and
+    returns a NearcastCodec for it.
+    '''
+    if not nearcast_schema.b_typed:
+        raise Exception("Nearcast schema [%s] has no field types. %s"%(
+            nearcast_schema.schema_h, 'Declare fields as "i field h t".'))
+    if len(nearcast_schema.messages) > VS_MAX:
+        raise Exception("Too many messages to encode.")
+    structs = []
+    sb = []
+    for (idx, (message_h, fields)) in enumerate(
+            nearcast_schema.messages.items()):
+        types = nearcast_schema.field_types[message_h]
+        sb.extend(_render_encoder(
+            idx=idx,
+            message_h=message_h,
+            fields=fields,
+            types=types,
+            structs=structs))
+        sb.extend(_render_decoder(
+            message_h=message_h,
+            fields=fields,
+            types=types,
+            structs=structs))
+        sb.append('d_encoders[%r] = encode_%s'%(message_h, message_h))
+        sb.append('decoders.append(decode_%s)'%(message_h))
+        sb.append('')
+    code = '\n'.join(sb)
+    namespace = {
+        'records': nearcast_schema.records,
+        'structs': structs,
+        'd_encoders': {},
+        'decoders': [],
+        'S_U2': S_U2,
+        'S_U8': S_U8,
+        'VS_MAX': VS_MAX,
+        'codec_overflow': codec_overflow,
+        'codec_underflow': codec_underflow,
+        'codec_vs_too_long': codec_vs_too_long,
+    }
+    exec(code, namespace)
+    return NearcastCodec(
+        schema_h=nearcast_schema.schema_h,
+        d_encoders=namespace['d_encoders'],
+        decoders=namespace['decoders'])
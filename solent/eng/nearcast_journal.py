@@ -0,0 +1,226 @@
+#
+# nearcast_journal
+#
+# // overview
+# A binary journal of the messages on a nearcast. JournalSnoop writes it (see
+# Orb.add_journal_snoop), nearcast_journal_read reads it back, and
+# SpinNearcastJournalReplay (solent/util) plays it into an orb.
+#
+# Unlike FileSnoop, values are stored exactly, using the schema's codec. So
+# the schema needs typed fields (see nearcast_codec.py). Messages with ref
+# fields can't be journalled: a ref points into this process.
+#
+# A journal is a series of segment files, PATH.000000, PATH.000001 and so
+# on. The snoop starts a new segment when the current one passes
+# rotate_bytes. It never writes over an existing segment: a process that
+# restarts with the same path carries on from one past the highest number
+# there, even if older segments have since been removed.
+#
+# Each segment starts with,
+#
+#   4   magic           SEGMENT_MAGIC
+#   u4  schema_crc      see nearcast_codec.nearcast_schema_crc
+#
+# and is followed by records,
+#
+#   u4  length          of the rest of the record
+#   u8  t_ns            time.time_ns() when the message was distributed
+#   vs  cog_h           u2 length, then utf8
+#   ..  message         as encoded by the codec
+#
+# Writes go through a large file buffer. An engine timer flushes it every
+# flush_seconds (if anything was written), and it is flushed when the snoop
+# rotates and when the orb closes. If the process dies,
+# the end of the last segment can be cut off part-way through a record. The
+# reader stops quietly at such a tail.
+#
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from .nearcast_codec import nearcast_schema_crc
+
+from solent import log
+from solent.base.sip import Sip
+
+import os
+import re
+import struct
+import time
+
+SEGMENT_MAGIC = b'SNJ1'
+
+S_SEGMENT_HEADER = struct.Struct('!4sI')
+S_RECORD_HEADER = struct.Struct('!IQH')
+
+DEFAULT_ROTATE_BYTES = 64 * 1024 * 1024
+DEFAULT_FLUSH_SECONDS = 1.0
+
+FILE_BUFFER = 1024 * 1024
+
+# Largest record the snoop can write. (Room for a dozen or so vs fields at
+# their largest.)
+RECORD_MAX = 1024 * 1024
+
+def journal_segment_path(path, segment_idx):
+    return '%s.%06d'%(path, segment_idx)
+
+def journal_segment_idxs(path):
+    'The numbers of the segments of the journal at path, in order.'
+    (dirname, basename) = os.path.split(path)
+    pattern = re.compile(re.escape(basename) + r'\.(\d{6,})$')
+    idxs = []
+    for name in os.listdir(dirname or '.'):
+        match = pattern.match(name)
+        if match != None:
+            idxs.append(int(match.group(1)))
+    idxs.sort()
+    return idxs
+
+def journal_segment_paths(path):
+    'The segments of the journal at path, in order.'
+    return [journal_segment_path(path, segment_idx)
+            for segment_idx in journal_segment_idxs(path)]
+
+class JournalSnoop:
+    '''
+    Appends each message seen on the nearcast to a journal. See the top of
+    this file for the format.
+    '''
+    def __init__(self, orb, nearcast_schema, path, rotate_bytes=DEFAULT_ROTATE_BYTES, flush_seconds=DEFAULT_FLUSH_SECONDS):
+        self.orb = orb
+        self.nearcast_schema = nearcast_schema
+        self.path = path
+        self.rotate_bytes = rotate_bytes
+        #
+        self.codec = nearcast_schema.get_codec()
+        for message_h in nearcast_schema.messages:
+            if 'ref' in nearcast_schema.field_types[message_h]:
+                # (refs point into this process)
+                raise Exception("Can't journal [%s], it has a ref field."%(
+                    message_h))
+        self.schema_crc = nearcast_schema_crc(
+            nearcast_schema=nearcast_schema)
+        #
+        self.scratch = Sip(
+            size=RECORD_MAX)
+        self.scratch_view = memoryview(self.scratch.arr)
+        # cog_h vs utf8
+        self.d_cog_h_bytes = {}
+        #
+        segment_idxs = journal_segment_idxs(path)
+        if segment_idxs:
+            self.segment_idx = segment_idxs[-1] + 1
+        else:
+            self.segment_idx = 0
+        self.f_ptr = None
+        self.segment_bytes = 0
+        self.b_dirty = False
+        #
+        self.count_messages = 0
+        self._open_segment()
+        self.flush_timer_h = orb.engine.call_every(
+            period=flush_seconds,
+            cb_eng_timer=self.cb_flush)
+    def orb_close(self):
+        self.orb.engine.cancel_timer(
+            timer_h=self.flush_timer_h)
+        if self.f_ptr != None:
+            self.f_ptr.close()
+            self.f_ptr = None
+    def flush(self):
+        self.f_ptr.flush()
+        self.b_dirty = False
+    def cb_flush(self, cs_eng_timer):
+        if self.b_dirty:
+            self.flush()
+    #
+    def on_nearcast_record(self, record):
+        t_ns = time.time_ns()
+        cog_h = record.cog_h
+        cog_h_bytes = self.d_cog_h_bytes.get(cog_h)
+        if cog_h_bytes == None:
+            cog_h_bytes = str(cog_h).encode('utf8')
+            self.d_cog_h_bytes[cog_h] = cog_h_bytes
+        o_message = S_RECORD_HEADER.size + len(cog_h_bytes)
+        scratch_view = self.scratch_view
+        scratch_view[S_RECORD_HEADER.size:o_message] = cog_h_bytes
+        o = self.codec.encode(
+            record=record,
+            sip=self.scratch,
+            o=o_message)
+        S_RECORD_HEADER.pack_into(
+            self.scratch.arr, 0, o - 4, t_ns, len(cog_h_bytes))
+        self.f_ptr.write(scratch_view[:o])
+        self.count_messages += 1
+        self.segment_bytes += o
+        self.b_dirty = True
+        if self.segment_bytes >= self.rotate_bytes:
+            self.f_ptr.close()
+            self.segment_idx += 1
+            self._open_segment()
+    #
+    def _open_segment(self):
+        segment_path = journal_segment_path(self.path, self.segment_idx)
+        self.f_ptr = open(segment_path, 'xb', buffering=FILE_BUFFER)
+        self.f_ptr.write(S_SEGMENT_HEADER.pack(SEGMENT_MAGIC, self.schema_crc))
+        self.segment_bytes = S_SEGMENT_HEADER.size
+        self.b_dirty = True
+        log('Journal to %s'%segment_path)
+
+def nearcast_journal_read(path, nearcast_schema):
+    '''
+    Generates (t_ns, record) for each message in the journal at path, in
+    the order they were written. record is a message record of
+    nearcast_schema (see nearcast_schema.compile_nearcast_schema), with the
+    cog_h that sent it.
+    '''
+    codec = nearcast_schema.get_codec()
+    schema_crc = nearcast_schema_crc(
+        nearcast_schema=nearcast_schema)
+    size_header = S_RECORD_HEADER.size
+    segment_paths = journal_segment_paths(path)
+    if not segment_paths:
+        raise Exception("No journal at %s."%(path))
+    for segment_path in segment_paths:
+        f_ptr = open(segment_path, 'rb')
+        bb = f_ptr.read()
+        f_ptr.close()
+        if len(bb) < S_SEGMENT_HEADER.size:
+            break
+        (magic, segment_crc) = S_SEGMENT_HEADER.unpack_from(bb, 0)
+        if magic != SEGMENT_MAGIC:
+            raise Exception("%s is not a nearcast journal."%(segment_path))
+        if segment_crc != schema_crc:
+            raise Exception("%s was written with a different schema."%(
+                segment_path))
+        o = S_SEGMENT_HEADER.size
+        len_bb = len(bb)
+        while o + size_header <= len_bb:
+            (length, t_ns, len_cog_h) = S_RECORD_HEADER.unpack_from(bb, o)
+            o_end = o + 4 + length
+            if o_end > len_bb:
+                # cut off
+                break
+            o_message = o + size_header + len_cog_h
+            cog_h = bb[o + size_header:o_message].decode('utf8')
+            (record, _) = codec.decode_bytes(
+                bb=bb,
+                o=o_message,
+                cog_h=cog_h)
+            yield (t_ns, record)
+            o = o_end
@@ -9,6 +9,29 @@
 # Nearcast schemas are defined in a dialect of interface script. There is
 # an example below, and a few examples in scenarios.py
 #
+# Fields can have types (declare them as "i field h t"). If they do, the
+# schema can give you a codec for packing its messages into sips. See
+# nearcast_codec.py for the types.
+#
+# A message can be declared conflating on one or more of its fields, with
+# conflate lines (declare them as "i conflate h"). Some messages are pure
+# updates of state, where only the latest value for a key matters. When a
+# conflating message is nearcast while a copy with the same key values is
+# still waiting in the orb's queue, the new one takes the waiting copy's
+# place, and the waiting copy is dropped. So a key that is updated faster
+# than the orb can keep up still gets delivered, with its latest value, as
+# soon as its place comes up. The flip side is that the new value can
+# arrive ahead of messages that were nearcast between the two. Only do this
+# where a later message makes the earlier one redundant. Key values need to
+# be hashable.
+#
+# Messages can be put into priority lanes. Declare the lanes first, highest
+# priority first, with "i lane h", and then put messages in them with
+# "i in_lane h". Messages that don't say go in the lane called default. It
+# comes last unless you declare it somewhere else. The orb always
+# distributes from the highest lane that has something waiting. Within a
+# lane, messages keep their order. Between lanes, they don't.
+#
 # // license
 # Copyright 2016, Free Software Foundation.
 #
@@ -27,6 +50,8 @@
 # You should have received a copy of the GNU General Public License along with
 # Solent. If not, see <http://www.gnu.org/licenses/>.
 
+from .nearcast_codec import compile_nearcast_codec
+from .nearcast_codec import FIELD_TYPES
 from .testbridge import init_testbridge_class
 
 from solent import Ns
@@ -35,6 +60,7 @@ from solent import init_interface_script_parser
 from solent import SignalConsumer
 
 from collections import OrderedDict as od
+import keyword
 
 I_NEARCAST_EXAMPLE = '''
     i message h
@@ -55,6 +81,37 @@ I_NEARCAST_EXAMPLE = '''
         field organisation_h
 '''
 
+I_NEARCAST_CONFLATE_EXAMPLE = '''
+    i message h
+        i field h
+        i conflate h
+
+    # only the latest price for each instrument matters
+    message price
+        field instrument
+        field price
+        conflate instrument
+'''
+
+I_NEARCAST_LANE_EXAMPLE = '''
+    i lane h
+    i message h
+        i field h
+        i in_lane h
+
+    # control messages jump ahead of everything else
+    lane control
+    lane default
+
+    message stop
+        in_lane control
+    message chunk
+        field data
+'''
+
+# Where messages go when they don't name a lane.
+DEFAULT_LANE = 'default'
+
 class NearcastSignalConsumer(SignalConsumer):
     '''
     User for converting interface script into a nearcast schema.
@@ -66,6 +123,12 @@ class NearcastSignalConsumer(SignalConsumer):
     def __init__(self):
         self.schema_h = None
         self.messages = od()
+        self.field_types = od()
+        self.b_typed = False
+        self.conflations = od()
+        self.lanes = []
+        self.message_lanes = od()
+        self.current_message_h = None
         self.current_message_lst = None
     def on_schema(self, h):
         self.schema_h = h
@@ -74,11 +137,51 @@ class NearcastSignalConsumer(SignalConsumer):
             raise Exception('duplicate definition for [%s]'%h)
         lst = []
         self.messages[h] = lst
+        self.field_types[h] = []
+        self.current_message_h = h
         self.current_message_lst = lst
-    def on_field(self, h):
+    def on_interface(self, iname, vfields):
+        # Fields can be declared with or without a type.
+        if iname == 'field' and vfields == ['h']:
+            return
+        if iname == 'field' and vfields == ['h', 't']:
+            self.b_typed = True
+            return
+        SignalConsumer.on_interface(self, iname, vfields)
+    def on_field(self, h, t=None):
         if None == self.current_message_lst:
             raise Exception('Need to define a message before fields.')
+        if t != None and t not in FIELD_TYPES:
+            raise Exception('Unknown type [%s] for field [%s]. (Have: %s)'%(
+                t, h, ', '.join(FIELD_TYPES)))
         self.current_message_lst.append(h)
+        self.field_types[self.current_message_h].append(t)
+    def on_conflate(self, h):
+        if None == self.current_message_h:
+            raise Exception('Need to define a message before conflate.')
+        message_h = self.current_message_h
+        if message_h not in self.conflations:
+            self.conflations[message_h] = []
+        if h in self.conflations[message_h]:
+            raise Exception('duplicate conflate [%s] on [%s]'%(h, message_h))
+        self.conflations[message_h].append(h)
+    def on_lane(self, h):
+        if None != self.current_message_h:
+            raise Exception('Declare lanes before messages. (lane [%s])'%(h))
+        if h in self.lanes:
+            raise Exception('duplicate definition for lane [%s]'%h)
+        self.lanes.append(h)
+    def on_in_lane(self, h):
+        if None == self.current_message_h:
+            raise Exception('Need to define a message before in_lane.')
+        message_h = self.current_message_h
+        if h not in self.lanes and h != DEFAULT_LANE:
+            raise Exception('No lane [%s] for [%s]. (Have: %s)'%(
+                h, message_h, ', '.join(self.lanes + [DEFAULT_LANE])))
+        if message_h in self.message_lanes:
+            raise Exception('[%s] is already in lane [%s]'%(
+                message_h, self.message_lanes[message_h]))
+        self.message_lanes[message_h] = h
 
 class NearcastSchema:
     '''
@@ -92,17 +195,49 @@ class NearcastSchema:
     Note that a nearcast schema is quite a bit simpler than the schema you'd
     use for a broadcast, or for a bespoke protocol. The reason for this: we
     don't need to serialise the message, meaning there is a bunch of type
-    information that we can dispense with.
+    information that we can dispense with. When you do want to serialise
+    the messages, give the fields types, and use get_codec.
     '''
-    def __init__(self, schema_h, d_messages):
+    def __init__(self, schema_h, d_messages, d_conflations=None, d_field_types=None, b_typed=False, lanes=None, d_message_lanes=None):
         self.schema_h = schema_h
         self.messages = d_messages
+        # message_h vs list of types, in field order. Only if b_typed.
+        self.field_types = d_field_types
+        self.b_typed = b_typed
+        # message_h vs the list of fields it conflates on
+        if d_conflations == None:
+            d_conflations = {}
+        self.conflations = d_conflations
+        # lane_h, highest priority first. There is always a default lane.
+        self.lanes = list(lanes or [])
+        if DEFAULT_LANE not in self.lanes:
+            self.lanes.append(DEFAULT_LANE)
+        # message_h vs lane_h, for messages that are not in the default lane
+        if d_message_lanes == None:
+            d_message_lanes = {}
+        self.message_lanes = d_message_lanes
+        #
+        # See compile_nearcast_schema.
+        (self.records, self.dispatcher_class) = compile_nearcast_schema(
+            nearcast_schema=self)
+        self.codec = None
     def has_message(self, name):
         return name in self.messages
     def get_args_for_message(self, message_h):
         return self.messages[message_h]
     def get_messages(self):
         return self.messages
+    def get_conflate_fields(self, message_h):
+        '''
+        Returns the key fields for a conflating message, or None.
+        '''
+        return self.conflations.get(message_h)
+    def get_lane_idx(self, message_h):
+        '''
+        Returns the position of the message's lane in self.lanes. The orb
+        keeps a queue for each lane, in the same order.
+        '''
+        return self.lanes.index(self.message_lanes.get(message_h, DEFAULT_LANE))
     def exists(self, message_h):
         if message_h in self.messages:
             return True
@@ -121,39 +256,30 @@ class NearcastSchema:
         Essentially, this gives the semantics of python functions to nearcast
         messages. Which is pretty damn cool.
 
-        The mechanism here is ugly. Unimportant. When we move to a typed
-        language, there's several ways we could handle this: inheritance, use
-        of macros.
+        The dispatcher class is generated once, along with the schema (see
+        compile_nearcast_schema). Each of its methods builds a message record
+        and queues it on the orb. Python checks the arguments against the
+        generated signature, so there is no further checking per message
+        unless the orb has debug_nearcast_on.
         '''
         if 'nearcast' in dir(cog):
             raise Exception("Cog %s already has a member 'nearcast'."%(
                 cog.cog_h))
-        sb = []
-        sb.append('class DynamicNearcastDispatcher:')
-        sb.append('    def __init__(self, orb, cog):')
-        sb.append('        self.orb = orb')
-        sb.append('        self.cog = cog')
-        for (message_h, fields) in self.messages.items():
-            if fields:
-                args = ', '.join(fields)
-                sb.append('    def %s(self, %s):'%(message_h, args))
-            else:
-                sb.append('    def %s(self):'%(message_h))
-            sb.append('        self.orb.nearcast(')
-            sb.append('            cog=self.cog,')
-            sb.append("            message_h='%s',"%message_h)
-            for field in fields:
-                sb.append('            %s=%s,'%(field, field))
-            sb.append('            )')
-        sb.append('')
-        sb.append('''globals()['DynamicNearcastDispatcher'] = DynamicNearcastDispatcher''')
-        sb.append('')
-        code = '\n'.join(sb)
-        exec(code)
-        nearcast_dispatcher = DynamicNearcastDispatcher(
+        nearcast_dispatcher = self.dispatcher_class(
             orb=orb,
             cog=cog)
         setattr(cog, 'nearcast', nearcast_dispatcher)
+    def get_record_class(self, message_h):
+        return self.records[message_h]
+    def get_codec(self):
+        '''
+        Returns a NearcastCodec for this schema (see nearcast_codec.py). The
+        fields need types.
+        '''
+        if self.codec == None:
+            self.codec = compile_nearcast_codec(
+                nearcast_schema=self)
+        return self.codec
     def init_testbridge(self, cog_h, orb, engine):
         test_class = init_testbridge_class(
             nearcast_schema=self)
@@ -161,6 +287,120 @@ class NearcastSchema:
             construct=test_class)
         return cog
 
+# A message record uses these names for itself, so messages can't have
+# fields called this.
+RESERVED_FIELD_NAMES = (
+    'cog_h', 'message_h', 'fields', 'b_conflate', 'args', 'to_dict',
+    'conflate_key', 'lane_idx')
+
+def validate_nearcast_names(nearcast_schema):
+    for (message_h, fields) in nearcast_schema.messages.items():
+        if not message_h.isidentifier() or keyword.iskeyword(message_h):
+            raise Exception("Message name [%s] is not a valid identifier."%(
+                message_h))
+        if message_h.startswith('_'):
+            raise Exception("Message name [%s] cannot start with _."%(
+                message_h))
+        if len(set(fields)) != len(fields):
+            raise Exception("Message [%s] has duplicate fields: %s"%(
+                message_h, ', '.join(fields)))
+        for field in fields:
+            if not field.isidentifier() or keyword.iskeyword(field):
+                raise Exception("Field [%s:%s] is not a valid identifier."%(
+                    message_h, field))
+            if field in RESERVED_FIELD_NAMES:
+                raise Exception("Field [%s:%s] is reserved. (%s)"%(
+                    message_h, field, ', '.join(RESERVED_FIELD_NAMES)))
+    for (message_h, key_fields) in nearcast_schema.conflations.items():
+        for field in key_fields:
+            if field not in nearcast_schema.messages[message_h]:
+                raise Exception("Message [%s] conflates on [%s], %s"%(
+                    message_h, field, 'which is not one of its fields.'))
+
+def compile_nearcast_schema(nearcast_schema):
+    '''
+    Generates code for a nearcast schema, and returns (records,
+    dispatcher_class).
+
+    records is a dict of message_h vs a record class for that message. A
+    record has __slots__ for cog_h (the sender) and each of the fields. It
+    has message_h, fields, b_conflate and lane_idx as class attributes. Its args
+    method returns the fields in schema order, which is how the orb passes
+    them to the handlers. Conflating records also have conflate_key, which
+    returns message_h and the values of the key fields.
+
+    dispatcher_class is what attach_nearcast_dispatcher_on_cog gives to
+    each cog as cog.nearcast. It has a method for each message. Conflating
+    messages go through the orb's _queue_conflating.
+
+    All the checking of names happens here, once. After this, the number
+    of arguments is enforced by the generated signatures.
+    '''
+    validate_nearcast_names(
+        nearcast_schema=nearcast_schema)
+    sb = []
+    for (message_h, fields) in nearcast_schema.messages.items():
+        cname = 'NearcastRecord_%s'%(message_h)
+        slots = ', '.join(["'%s'"%f for f in ['cog_h'] + fields])
+        sb.append('class %s:'%(cname))
+        sb.append('    __slots__ = (%s,)'%(slots))
+        sb.append("    message_h = '%s'"%(message_h))
+        sb.append('    fields = (%s)'%(
+            ''.join(["'%s', "%f for f in fields])))
+        sb.append('    lane_idx = %s'%(nearcast_schema.get_lane_idx(message_h)))
+        sb.append('    def __init__(self, %s):'%(
+            ', '.join(['cog_h'] + fields)))
+        sb.append('        self.cog_h = cog_h')
+        for field in fields:
+            sb.append('        self.%s = %s'%(field, field))
+        sb.append('    def args(self):')
+        sb.append('        return (%s)'%(
+            ''.join(['self.%s, '%f for f in fields])))
+        sb.append('    def to_dict(self):')
+        sb.append('        return {%s}'%(
+            ', '.join(["'%s': self.%s"%(f, f) for f in fields])))
+        key_fields = nearcast_schema.get_conflate_fields(message_h)
+        if key_fields:
+            sb.append('    b_conflate = True')
+            sb.append('    def conflate_key(self):')
+            sb.append("        return ('%s', %s)"%(
+                message_h, ', '.join(['self.%s'%f for f in key_fields])))
+        else:
+            sb.append('    b_conflate = False')
+        sb.append("records['%s'] = %s"%(message_h, cname))
+        sb.append('')
+    sb.append('class NearcastDispatcher:')
+    sb.append('    def __init__(self, orb, cog):')
+    sb.append('        self._orb = orb')
+    sb.append('        self._cog = cog')
+    sb.append('        self._cog_h = cog.cog_h')
+    for lane_idx in range(len(nearcast_schema.lanes)):
+        sb.append('        self._append_%s = orb.lanes[%s].append'%(
+            lane_idx, lane_idx))
+    for (message_h, fields) in nearcast_schema.messages.items():
+        sb.append('    def %s(%s):'%(
+            message_h, ', '.join(['self'] + fields)))
+        sb.append('        if self._orb.b_debug_nearcast:')
+        sb.append('            self._orb.nearcast(')
+        sb.append('                cog=self._cog,')
+        sb.append("                message_h='%s',"%(message_h))
+        for field in fields:
+            sb.append('                %s=%s,'%(field, field))
+        sb.append('                )')
+        sb.append('            return')
+        if nearcast_schema.get_conflate_fields(message_h):
+            sb.append('        self._orb._queue_conflating(')
+        else:
+            sb.append('        self._append_%s('%(
+                nearcast_schema.get_lane_idx(message_h)))
+        sb.append('            NearcastRecord_%s(%s))'%(
+            message_h, ', '.join(['self._cog_h'] + fields)))
+    sb.append('')
+    code = '\n'.join(sb)
+    namespace = {'records': {}}
+    exec(code, namespace)
+    return (namespace['records'], namespace['NearcastDispatcher'])
+
 def init_nearcast_schema(i_nearcast):
     '''
     i_nearcast: text in interface script format. It will need to match the
@@ -177,6 +417,11 @@ def init_nearcast_schema(i_nearcast):
     parser.parse(i_nearcast)
     nearcast_schema = NearcastSchema(
         schema_h=signal_consumer.schema_h,
-        d_messages=signal_consumer.messages)
+        d_messages=signal_consumer.messages,
+        d_conflations=signal_consumer.conflations,
+        d_field_types=signal_consumer.field_types,
+        b_typed=signal_consumer.b_typed,
+        lanes=signal_consumer.lanes,
+        d_message_lanes=signal_consumer.message_lanes)
     return nearcast_schema
 
@@ -47,7 +47,14 @@
 #
 
 from .activity import activity_new
+from .nearcast_journal import DEFAULT_FLUSH_SECONDS
+from .nearcast_journal import DEFAULT_ROTATE_BYTES
+from .nearcast_journal import JournalSnoop
+from .nearcast_schema import DEFAULT_LANE
 from .nearcast_schema import init_nearcast_schema
+from .worker_pool import DEFAULT_WORKERS
+from .worker_pool import get_pool_handler_mark
+from .worker_pool import WorkerPool
 
 from solent import uniq
 from solent import log
@@ -59,52 +66,160 @@ import inspect
 from pprint import pprint
 import types
 
+# FileSnoop buffers this much text before it writes.
+SNOOP_BUFFER_CHARS = 64 * 1024
+# ...or for this long, whichever comes first.
+SNOOP_FLUSH_SECONDS = 1.0
+
+class SnoopSelection:
+    '''
+    Which messages a text snoop cares about.
+
+    message_hs: only these (None for all of them)
+    exclude_message_hs: never these
+    sample_every: for each message type, take the first message and then
+        every sample_every-th one after it. 1 takes them all.
+
+    The orb asks accepts_message once per message type (see
+    Orb._build_snoop_dispatch), so filtering costs nothing per message.
+    Sampling is counted in the snoop.
+    '''
+    def __init__(self, nearcast_schema, message_hs, exclude_message_hs, sample_every):
+        for message_h in list(message_hs or []) + list(exclude_message_hs or []):
+            if message_h not in nearcast_schema:
+                raise Exception("No message [%s] in the schema."%(message_h))
+        if sample_every < 1:
+            raise Exception("sample_every must be at least 1. (got %s)"%(
+                sample_every))
+        if message_hs == None:
+            self.message_hs = None
+        else:
+            self.message_hs = set(message_hs)
+        self.exclude_message_hs = set(exclude_message_hs or [])
+        self.sample_every = sample_every
+        #
+        # message_h vs count seen
+        self.d_sample_count = {}
+    def accepts_message(self, message_h):
+        if self.message_hs != None and message_h not in self.message_hs:
+            return False
+        return message_h not in self.exclude_message_hs
+    def sample(self, message_h):
+        'Returns True if this message is one to keep.'
+        sample_every = self.sample_every
+        if sample_every == 1:
+            return True
+        count = self.d_sample_count.get(message_h, 0)
+        self.d_sample_count[message_h] = count + 1
+        return count % sample_every == 0
+
+def snoop_format(prefix, fields):
+    '''
+    A %-format for one message type. It takes cog_h and then the field
+    values. prefix can use {cog_h}.
+    '''
+    sb = [prefix.replace('%', '%%').replace('{cog_h}', '%s')]
+    sb.append(', '.join(['%s:%%s'%(field) for field in fields]))
+    return ''.join(sb)
+
 class FileSnoop:
-    def __init__(self, orb, nearcast_schema, filename):
+    '''
+    Writes messages seen on the nearcast to a file, one per line. Lines are
+    buffered, and written when the buffer passes buffer_chars, every
+    flush_seconds (from an engine timer), and when the orb closes. See
+    SnoopSelection for the other arguments.
+    '''
+    def __init__(self, orb, nearcast_schema, filename, message_hs=None, exclude_message_hs=None, sample_every=1, buffer_chars=SNOOP_BUFFER_CHARS, flush_seconds=SNOOP_FLUSH_SECONDS):
         self.orb = orb
         self.nearcast_schema = nearcast_schema
         self.filename = filename
+        self.buffer_chars = buffer_chars
+        #
+        self.selection = SnoopSelection(
+            nearcast_schema=nearcast_schema,
+            message_hs=message_hs,
+            exclude_message_hs=exclude_message_hs,
+            sample_every=sample_every)
+        self.accepts_message = self.selection.accepts_message
+        # message_h vs (format, fields). Built as each type turns up.
+        self.d_format = {}
+        #
+        self.buffer = []
+        self.buffer_size = 0
         #
         self.f_ptr = open(filename, 'w+')
         log('Logging to %s'%filename)
+        self.flush_timer_h = orb.engine.call_every(
+            period=flush_seconds,
+            cb_eng_timer=self.cb_flush)
     def orb_close(self):
+        self.orb.engine.cancel_timer(
+            timer_h=self.flush_timer_h)
+        self.flush()
         self.f_ptr.close()
+    def flush(self):
+        if self.buffer:
+            self.f_ptr.write(''.join(self.buffer))
+            self.buffer.clear()
+            self.buffer_size = 0
+        self.f_ptr.flush()
+    def cb_flush(self, cs_eng_timer):
+        if self.buffer:
+            self.flush()
     #
     def on_nearcast_message(self, cog_h, message_h, d_fields):
-        def format_message():
-            sb = []
-            sb.append('%s/%s '%(cog_h, message_h))
-            for idx, key in enumerate(self.nearcast_schema[message_h]):
-                if idx > 0:
-                    sb.append(', ')
-                sb.append('%s:%s'%(key, d_fields[key]))
-            sb.append('\n')
-            return ''.join(sb)
-        nice = format_message()
-        self.f_ptr.write(nice)
-        self.f_ptr.flush()
+        if not self.selection.sample(message_h):
+            return
+        entry = self.d_format.get(message_h)
+        if entry == None:
+            fields = self.nearcast_schema[message_h]
+            entry = (
+                snoop_format(
+                    prefix='{cog_h}/%s '%(message_h),
+                    fields=fields) + '\n',
+                fields)
+            self.d_format[message_h] = entry
+        (fmt, fields) = entry
+        line = fmt%((cog_h,) + tuple([d_fields[f] for f in fields]))
+        self.buffer.append(line)
+        self.buffer_size += len(line)
+        if self.buffer_size >= self.buffer_chars:
+            self.flush()
 
 class LogSnoop:
     '''
-    Logs any message seen on the associated nearcast.
+    Logs any message seen on the associated nearcast. See SnoopSelection
+    for the arguments.
     '''
-    def __init__(self, orb, nearcast_schema):
+    def __init__(self, orb, nearcast_schema, message_hs=None, exclude_message_hs=None, sample_every=1):
         self.orb = orb
         self.nearcast_schema = nearcast_schema
+        #
+        self.selection = SnoopSelection(
+            nearcast_schema=nearcast_schema,
+            message_hs=message_hs,
+            exclude_message_hs=exclude_message_hs,
+            sample_every=sample_every)
+        self.accepts_message = self.selection.accepts_message
+        # message_h vs (format, fields)
+        self.d_format = {}
     def orb_close(self):
         pass
     #
     def on_nearcast_message(self, cog_h, message_h, d_fields):
-        def format_message():
-            sb = []
-            sb.append('[%s/%s/%s] '%(self.orb.schema_h, cog_h, message_h))
-            for idx, key in enumerate(self.nearcast_schema[message_h]):
-                if idx > 0:
-                    sb.append(', ')
-                sb.append('%s:%s'%(key, d_fields[key]))
-            return ''.join(sb)
-        nice = format_message()
-        log(nice)
+        if not self.selection.sample(message_h):
+            return
+        entry = self.d_format.get(message_h)
+        if entry == None:
+            fields = self.nearcast_schema[message_h]
+            entry = (
+                snoop_format(
+                    prefix='[%s/{cog_h}/%s] '%(self.orb.schema_h, message_h),
+                    fields=fields),
+                fields)
+            self.d_format[message_h] = entry
+        (fmt, fields) = entry
+        log(fmt%((cog_h,) + tuple([d_fields[f] for f in fields])))
 
 class BridgeFoundation:
     def __init__(self, cog_h, orb, engine):
@@ -141,6 +256,10 @@ def attach_bridge_nc_method_to_cog(cog, mname, fnames):
 
 ORB_METADATA_H = '_orb_metadata_ns'
 
+# Most messages an orb distributes in one engine turn (see
+# Orb.set_nearcast_budget).
+NEARCAST_BUDGET = 4096
+
 class OrbMetadata:
     def __init__(self):
         self.has_orb_turn = False
@@ -181,21 +300,50 @@ class Orb:
         self.snoops = []
         self.tracks = {} # construct vs instance
         self.cogs = []
-        self.ready_to_nearcast = deque()
+        self.cogs_with_orb_turn = []
+        # Message records (see nearcast_schema.compile_nearcast_schema), in
+        # a queue for each lane of the schema, highest priority first.
+        # ready_to_nearcast is the default lane. (For a schema without
+        # lanes, that is the only one.)
+        self.lanes = [deque() for lane_h in self.nearcast_schema.lanes]
+        self.ready_to_nearcast = self.lanes[
+            self.nearcast_schema.lanes.index(DEFAULT_LANE)]
+        self.nearcast_budget = NEARCAST_BUDGET
+        self.b_debug_nearcast = False
+        #
+        # For conflating messages: conflate_key vs the newest record for
+        # that key. Only the first record for a key goes in its lane. When
+        # distribute reaches it, it sends the newest in its place.
+        self.d_conflate = {}
+        # records that were folded into one already waiting
+        self.count_conflated = 0
+        #
+        # message_h vs list of (handler, kind, name). Built on demand by
+        # _build_dispatch, and thrown away whenever a track or cog is added.
+        # kind and name are there for the error message if a handler fails.
+        self.d_dispatch = None
+        #
+        # message_h vs list of snoops that want it. Built on demand by
+        # _build_snoop_dispatch, and thrown away whenever a snoop is added.
+        self.d_snoop_dispatch = None
+        #
+        # For handlers marked with pool_handler. See worker_pool.py.
+        self.worker_pool = None
     def eng_turn(self, activity):
         #
-        if self.ready_to_nearcast:
+        if self.get_queue_depth():
             activity.mark(
                 l=self,
                 s='orb messages')
-            self.distribute()
+            self.distribute(
+                budget=self.nearcast_budget)
         #
-        for cog in self.cogs:
-            orb_md = getattr(cog, ORB_METADATA_H)
-            if orb_md.has_orb_turn:
-                cog.orb_turn(
-                    activity=activity)
+        for cog in self.cogs_with_orb_turn:
+            cog.orb_turn(
+                activity=activity)
     def eng_close(self):
+        if self.worker_pool != None:
+            self.worker_pool.close()
         for snoop in self.snoops:
             snoop.orb_close()
         for cog in self.cogs:
@@ -205,17 +353,110 @@ class Orb:
     #
     def set_spin_h(self, spin_h):
         self.spin_h = spin_h
-    def add_file_snoop(self, filename):
+    def set_nearcast_budget(self, value):
+        '''
+        Maximum number of messages the orb will distribute in a single
+        engine turn, counting those that handlers nearcast along the way.
+        Whatever is left waits for the next turn, and the engine does not
+        sleep in between. This keeps a busy orb from holding the engine
+        away from its sockets. None for no limit.
+        '''
+        if value != None and value < 1:
+            raise Exception("Nearcast budget must be at least 1. (got %s)"%(
+                value))
+        self.nearcast_budget = value
+    def init_worker_pool(self, workers=DEFAULT_WORKERS, b_processes=False):
+        '''
+        Sets up the pool that runs handlers marked with pool_handler (see
+        worker_pool.py). You only need to call this if you want something
+        other than the thread pool that the orb would make for itself.
+        '''
+        if self.worker_pool != None:
+            raise Exception("Orb %s already has a worker pool."%(
+                self.spin_h))
+        self.worker_pool = WorkerPool(
+            orb=self,
+            engine=self.engine,
+            workers=workers,
+            b_processes=b_processes)
+        return self.worker_pool
+    def get_queue_depth(self):
+        '''
+        Number of messages waiting to be distributed, in all lanes.
+        '''
+        lanes = self.lanes
+        if len(lanes) == 1:
+            return len(lanes[0])
+        return sum([len(lane) for lane in lanes])
+    def get_lane_depths(self):
+        '''
+        Returns an ordered dict of lane_h vs the number of messages waiting
+        in it, highest priority first.
+        '''
+        return od( [ (lane_h, len(lane))
+                     for (lane_h, lane)
+                     in zip(self.nearcast_schema.lanes, self.lanes) ] )
+    def add_file_snoop(self, filename, message_hs=None, exclude_message_hs=None, sample_every=1, buffer_chars=SNOOP_BUFFER_CHARS, flush_seconds=SNOOP_FLUSH_SECONDS):
+        '''
+        Writes messages to a text file. See FileSnoop and SnoopSelection.
+        '''
         snoop = FileSnoop(
             orb=self,
             nearcast_schema=self.nearcast_schema,
-            filename=filename)
-        self.snoops.append(snoop)
-    def add_log_snoop(self):
+            filename=filename,
+            message_hs=message_hs,
+            exclude_message_hs=exclude_message_hs,
+            sample_every=sample_every,
+            buffer_chars=buffer_chars,
+            flush_seconds=flush_seconds)
+        self.add_snoop(
+            snoop=snoop)
+        return snoop
+    def add_journal_snoop(self, path, rotate_bytes=DEFAULT_ROTATE_BYTES, flush_seconds=DEFAULT_FLUSH_SECONDS):
+        '''
+        Records every message to a binary journal. The schema needs typed
+        fields. See nearcast_journal.py.
+        '''
+        snoop = JournalSnoop(
+            orb=self,
+            nearcast_schema=self.nearcast_schema,
+            path=path,
+            rotate_bytes=rotate_bytes,
+            flush_seconds=flush_seconds)
+        self.add_snoop(
+            snoop=snoop)
+        return snoop
+    def add_log_snoop(self, message_hs=None, exclude_message_hs=None, sample_every=1):
+        '''
+        Logs messages. See SnoopSelection.
+        '''
         snoop = LogSnoop(
             orb=self,
-            nearcast_schema=self.nearcast_schema)
+            nearcast_schema=self.nearcast_schema,
+            message_hs=message_hs,
+            exclude_message_hs=exclude_message_hs,
+            sample_every=sample_every)
+        self.add_snoop(
+            snoop=snoop)
+        return snoop
+    def add_snoop(self, snoop):
+        '''
+        snoop needs on_nearcast_message(cog_h, message_h, d_fields) and
+        orb_close(). See LogSnoop.
+
+        Instead of on_nearcast_message, a snoop can have
+        on_nearcast_record(record), which gets the message record itself
+        (see nearcast_schema.get_record_class). This spares building
+        d_fields for snoops that would only turn it back into a record,
+        such as the bridges. Do not change the record: the other snoops and
+        the handlers see it after you.
+
+        If snoop has accepts_message(message_h), the orb only passes it the
+        message types for which that returns True. It asks once per type,
+        so the answer must not change.
+        '''
         self.snoops.append(snoop)
+        self.d_snoop_dispatch = None
     def init_cog(self, construct):
         cog = construct(
             cog_h=construct.__name__,
@@ -262,7 +503,7 @@ class Orb:
         if not inspect.isclass(tclass):
             raise Exception("Supply a class, not an instance of it.")
         #
-        argspec = tuple(inspect.getargspec(tclass.__init__)[0])
+        argspec = tuple(inspect.getfullargspec(tclass.__init__)[0])
         if argspec != ('self', 'orb'):
             raise Exception("Argspec of %s.__init__ needs to be self, orb."%(
                 tclass.__name__))
@@ -274,7 +515,7 @@ class Orb:
         on_methods = [m for m in dir(track_inst) if m.startswith('on_')]
         for om_name in on_methods:
             method = getattr(track_inst, om_name)
-            args = inspect.getargspec(method).args
+            args = inspect.getfullargspec(method).args
             if args[0] != 'self':
                 raise Exception("track method %s should have arg 'self'."%(
                     om_name))
@@ -305,73 +546,130 @@ class Orb:
         install_orb_metadata(track_inst)
         #
         self.tracks[tclass] = track_inst
+        self.d_dispatch = None
         return track_inst
     def nearcast(self, cog, message_h, **d_fields):
         '''
         You probably don't need to call this directly. When cogs are
         initiatlised, they have a nearcast sender injected into them.
         Use that. (self.nearcast.MESSAGE_NAME(args))
+
+        The checks on cog and fields only run when debug_nearcast_on. In
+        normal running, a bad field shows up as a TypeError from the message
+        record.
         '''
-        if 'cog_h' not in dir(cog):
-            raise Exception("Looks like an invalid cog arg. Has no cog_h. %s"%(
-                str(cog)))
-        elif None == cog:
-            cog_h = 'None'
-        else:
-            cog_h = cog.cog_h
-        if message_h not in self.nearcast_schema:
+        if self.b_debug_nearcast:
+            if 'cog_h' not in dir(cog):
+                raise Exception(
+                    "Looks like an invalid cog arg. Has no cog_h. %s"%(
+                        str(cog)))
+            if message_h not in self.nearcast_schema:
+                raise Exception("Unknown message type, [%s]"%(message_h))
+            mfields = self.nearcast_schema[message_h]
+            if sorted(d_fields.keys()) != sorted(mfields):
+                raise Exception('inconsistent fields. need %s. got %s'%(
+                    str(mfields), str(d_fields.keys())))
+        if message_h not in self.nearcast_schema.records:
             raise Exception("Unknown message type, [%s]"%(message_h))
-        mfields = self.nearcast_schema[message_h]
-        if sorted(d_fields.keys()) != sorted(mfields):
-            raise Exception('inconsistent fields. need %s. got %s'%(
-                str(mfields), str(d_fields.keys())))
+        record = self.nearcast_schema.records[message_h](
+            cog_h=cog.cog_h,
+            **d_fields)
+        self.nearcast_record(
+            record=record)
+    def nearcast_record(self, record):
+        '''
+        Queues a message record (see nearcast_schema.get_record_class). This
+        is for things that bring messages in from outside the orb, such as
+        SpinNearcastBridge. record.cog_h should say where it came from.
+        '''
         #
         # It is important that we buffer all the messages to be sequenced, and
         # then actually send them out later on in distribute. Otherwise we can
         # end up in a situation where actors have hijacked activity away from
         # the event loop, and a starvation scenario.
-        self.ready_to_nearcast.append( (cog_h, message_h, d_fields) )
-    def distribute(self):
+        if record.b_conflate:
+            self._queue_conflating(
+                record=record)
+        else:
+            self.lanes[record.lane_idx].append(record)
+    def debug_nearcast_on(self):
+        '''
+        Checks every message against the schema as it is nearcast, including
+        those sent through cog.nearcast. This is slow.
+        '''
+        self.b_debug_nearcast = True
+    def debug_nearcast_off(self):
+        self.b_debug_nearcast = False
+    def distribute(self, budget=None):
         '''
         The engine event loop will call this. Messages which have been
-        buffered to be nearcast are sent out to the cogs.
+        buffered to be nearcast are sent out to the cogs, highest lane
+        first. Stops after budget messages, if you give one. Returns the
+        number of messages sent out.
         '''
-        while self.ready_to_nearcast:
-            (cog_h, message_h, d_fields) = self.ready_to_nearcast.popleft()
-            rname = 'on_%s'%message_h
-            for snoop in self.snoops:
-                snoop.on_nearcast_message(
-                    cog_h=cog_h,
-                    message_h=message_h,
-                    d_fields=d_fields)
-            for (construct, track) in self.tracks.items():
-                orb_md = getattr(track, ORB_METADATA_H)
-                if message_h in orb_md.consumes:
-                    fn = getattr(track, rname)
-                    try:
-                        fn(**d_fields)
-                    except SolentQuitException:
-                        raise
-                    except:
-                        log('')
-                        log('!! breaking in orb [%s], track, %s:%s'%(
-                            self.spin_h, track.__class__.__name__, rname))
-                        log('')
-                        raise
-            for cog in self.cogs:
-                orb_md = getattr(cog, ORB_METADATA_H)
-                if message_h in orb_md.consumes:
-                    fn = getattr(cog, rname)
-                    try:
-                        fn(**d_fields)
-                    except SolentQuitException:
-                        raise
-                    except:
-                        log('')
-                        log('!! breaking in orb[%s], cog, %s:%s'%(
-                            self.spin_h, cog.cog_h, rname))
-                        log('')
-                        raise
+        lanes = self.lanes
+        ready_to_nearcast = self.ready_to_nearcast
+        b_one_lane = len(lanes) == 1
+        count = 0
+        while budget == None or count < budget:
+            if b_one_lane:
+                if not ready_to_nearcast:
+                    break
+                record = ready_to_nearcast.popleft()
+            else:
+                # (Checked for each message. A handler may have nearcast
+                # something more urgent.)
+                record = None
+                for lane in lanes:
+                    if lane:
+                        record = lane.popleft()
+                        break
+                if record == None:
+                    break
+            if record.b_conflate:
+                # (The newest for this key goes out at the first one's place.)
+                record = self.d_conflate.pop(record.conflate_key())
+            count += 1
+            message_h = record.message_h
+            if self.snoops:
+                d_snoop_dispatch = self.d_snoop_dispatch
+                if d_snoop_dispatch == None:
+                    d_snoop_dispatch = self._build_snoop_dispatch()
+                snoops = d_snoop_dispatch[message_h]
+            else:
+                snoops = None
+            if snoops:
+                d_fields = None
+                for (fn, b_record) in snoops:
+                    if b_record:
+                        fn(
+                            record=record)
+                        continue
+                    if d_fields == None:
+                        d_fields = record.to_dict()
+                    fn(
+                        cog_h=record.cog_h,
+                        message_h=message_h,
+                        d_fields=d_fields)
+            # (A handler may add a cog, so we check this for each message.)
+            d_dispatch = self.d_dispatch
+            if d_dispatch == None:
+                d_dispatch = self._build_dispatch()
+            if message_h not in d_dispatch:
+                continue
+            args = record.args()
+            for (fn, kind, name) in d_dispatch[message_h]:
+                try:
+                    fn(*args)
+                except SolentQuitException:
+                    raise
+                except:
+                    log('')
+                    log('!! breaking in orb [%s], %s, %s:on_%s'%(
+                        self.spin_h, kind, name, message_h))
+                    log('')
+                    raise
+        return count
     def cycle(self, max_turns=20):
         '''
         This is useful for testing. It keeps calling orb_turn until there
@@ -396,6 +694,94 @@ class Orb:
                 break
             turn_counter += 1
     #
+    def _build_dispatch(self):
+        '''
+        Works out, for each message, which handlers want it. Tracks go
+        first, then cogs, each in the order they were added. This is the
+        order in which distribute has always called them.
+        '''
+        d_dispatch = {}
+        for track in self.tracks.values():
+            orb_md = getattr(track, ORB_METADATA_H)
+            for message_h in orb_md.consumes:
+                if message_h not in d_dispatch:
+                    d_dispatch[message_h] = []
+                d_dispatch[message_h].append( (
+                    getattr(track, 'on_%s'%message_h),
+                    'track',
+                    track.__class__.__name__) )
+        for cog in self.cogs:
+            orb_md = getattr(cog, ORB_METADATA_H)
+            for message_h in orb_md.consumes:
+                if message_h not in d_dispatch:
+                    d_dispatch[message_h] = []
+                fn = getattr(cog, 'on_%s'%message_h)
+                pool_handler_mark = get_pool_handler_mark(fn)
+                if pool_handler_mark != None:
+                    fn = self._pool_submitter(
+                        cog_h=cog.cog_h,
+                        message_h=message_h,
+                        fn=fn,
+                        reply=pool_handler_mark.reply)
+                d_dispatch[message_h].append( (
+                    fn,
+                    'cog',
+                    cog.cog_h) )
+        self.d_dispatch = d_dispatch
+        return d_dispatch
+    def _pool_submitter(self, cog_h, message_h, fn, reply):
+        '''
+        Returns a handler that passes the message to the worker pool, in
+        place of fn.
+        '''
+        if self.worker_pool == None:
+            self.init_worker_pool()
+        submit = self.worker_pool.submit
+        def submit_to_pool(*args):
+            submit(
+                cog_h=cog_h,
+                message_h=message_h,
+                fn=fn,
+                reply=reply,
+                args=args)
+        return submit_to_pool
+    def _build_snoop_dispatch(self):
+        '''
+        Works out, for each message, which snoops want it (see add_snoop).
+        Entries are (fn, b_record), where b_record says that fn takes the
+        record rather than d_fields.
+        '''
+        d_snoop_dispatch = {}
+        for message_h in self.nearcast_schema.messages:
+            snoops = []
+            for snoop in self.snoops:
+                accepts_message = getattr(snoop, 'accepts_message', None)
+                if accepts_message != None and not accepts_message(message_h):
+                    continue
+                on_nearcast_record = getattr(snoop, 'on_nearcast_record', None)
+                if on_nearcast_record != None:
+                    snoops.append( (on_nearcast_record, True) )
+                else:
+                    snoops.append( (snoop.on_nearcast_message, False) )
+            d_snoop_dispatch[message_h] = snoops
+        self.d_snoop_dispatch = d_snoop_dispatch
+        return d_snoop_dispatch
+    def _queue_conflating(self, record):
+        '''
+        Queues a record for a conflating message. If a record with the same
+        key is already waiting, the new one replaces it there, and does not
+        go on the end of the queue. So each key has at most one place in the
+        queue, and a key that is updated all the time still reaches the
+        front.
+        '''
+        key = record.conflate_key()
+        d_conflate = self.d_conflate
+        if key in d_conflate:
+            d_conflate[key] = record
+            self.count_conflated += 1
+            return
+        d_conflate[key] = record
+        self.lanes[record.lane_idx].append(record)
     def _add_cog(self, cog):
         if cog in self.cogs:
             try:
@@ -409,11 +795,20 @@ class Orb:
         on_methods = [m for m in dir(cog) if m.startswith('on_')]
         for om_name in on_methods:
             method = getattr(cog, om_name)
-            args = inspect.getargspec(method).args
-            if args[0] != 'self':
-                raise Exception("cog method %s should have arg 'self'."%(
-                    om_name))
-            args = args[1:]
+            args = inspect.getfullargspec(method).args
+            pool_handler_mark = get_pool_handler_mark(method)
+            if pool_handler_mark != None:
+                # (Pool handlers have no self. See worker_pool.py.)
+                reply = pool_handler_mark.reply
+                if reply != None and not self.nearcast_schema.has_message(
+                        reply):
+                    raise Exception("%s:%s replies with %s, %s"%(
+                        cog_h, om_name, reply, 'which is not in the schema.'))
+            else:
+                if not args or args[0] != 'self':
+                    raise Exception(
+                        "cog method %s should have arg 'self'."%(om_name))
+                args = args[1:]
             message_h = om_name[3:]
             if not self.nearcast_schema.has_message(message_h):
                 m = "Cog has %s but there is no message %s in schema."%(
@@ -443,4 +838,7 @@ class Orb:
             orb=self,
             cog=cog)
         self.cogs.append(cog)
+        if getattr(cog, ORB_METADATA_H).has_orb_turn:
+            self.cogs_with_orb_turn.append(cog)
+        self.d_dispatch = None
 
@@ -0,0 +1,241 @@
+#
+# poller
+#
+# // overview
+# Readiness backends for the engine. Each of these wraps an operating-system
+# mechanism for asking "which of these file descriptors can I act on?"
+#
+#   epoll   Linux. Registrations live in the kernel, so the cost of a wait is
+#           proportional to the number of ready descriptors, not the number
+#           of registered descriptors. No FD_SETSIZE limit.
+#
+#   poll    Most unix. Registrations live in this process, but there is no
+#           FD_SETSIZE limit.
+#
+#   select  Everywhere, including Windows. Limited to FD_SETSIZE (usually
+#           1024) descriptors on unix.
+#
+# All three present the same interface. The engine registers a descriptor
+# once, and then modifies its interest only when the state of the metasock
+# changes (for example, when its send buffer goes from empty to non-empty).
+# This avoids rebuilding the interest lists on every turn of the event loop.
+#
+# Events are returned as a list of tuples,
+#
+#   (fd, b_readable, b_writable, b_exceptional)
+#
+# The flags follow select semantics. In particular, an error or hangup on a
+# descriptor is reported as readable and/or writable (depending on the
+# interest that was registered), so that the metasock discovers the problem
+# from its recv or send call, as it would under select. Where an error occurs
+# on a descriptor with no interest registered, it is reported as exceptional.
+# (Otherwise, a level-triggered backend would report it forever.)
+#
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+import math
+import select
+
+POLLER_H_EPOLL = 'epoll'
+POLLER_H_POLL = 'poll'
+POLLER_H_SELECT = 'select'
+
+class SelectPoller:
+    '''
+    Portable backend. Every registered descriptor goes into the exception
+    list, which matches the behaviour of the engine before pluggable
+    backends were introduced.
+    '''
+    def __init__(self):
+        self.poller_h = POLLER_H_SELECT
+        self.rset = set()
+        self.wset = set()
+        self.xset = set()
+    def is_empty(self):
+        return 0 == len(self.xset)
+    def register(self, fd, b_read, b_write):
+        if fd in self.xset:
+            raise Exception("fd %s is already registered."%(fd))
+        self.xset.add(fd)
+        self.modify(
+            fd=fd,
+            b_read=b_read,
+            b_write=b_write)
+    def modify(self, fd, b_read, b_write):
+        if b_read:
+            self.rset.add(fd)
+        else:
+            self.rset.discard(fd)
+        if b_write:
+            self.wset.add(fd)
+        else:
+            self.wset.discard(fd)
+    def unregister(self, fd):
+        self.rset.discard(fd)
+        self.wset.discard(fd)
+        self.xset.discard(fd)
+    def poll(self, timeout):
+        (rlist, wlist, xlist) = select.select(
+            list(self.rset),
+            list(self.wset),
+            list(self.xset),
+            timeout)
+        if not (rlist or wlist or xlist):
+            return []
+        d = {}
+        for fd in rlist:
+            d[fd] = [True, False, False]
+        for fd in wlist:
+            if fd in d:
+                d[fd][1] = True
+            else:
+                d[fd] = [False, True, False]
+        for fd in xlist:
+            if fd in d:
+                d[fd][2] = True
+            else:
+                d[fd] = [False, False, True]
+        return [(fd, r, w, x) for (fd, (r, w, x)) in d.items()]
+    def close(self):
+        self.rset.clear()
+        self.wset.clear()
+        self.xset.clear()
+
+class _MaskPoller:
+    '''
+    Shared logic for the backends that work with event masks (poll and
+    epoll). Subclasses supply the flag values and the kernel object, and
+    _wait(timeout), which returns the kernel's (fd, event mask) pairs.
+    '''
+    def __init__(self, poller_h, kernel, f_in, f_out, f_pri, f_fail):
+        self.poller_h = poller_h
+        self.kernel = kernel
+        self.f_in = f_in
+        self.f_out = f_out
+        self.f_pri = f_pri
+        self.f_fail = f_fail
+        #
+        # fd vs mask
+        self.d_mask = {}
+    def is_empty(self):
+        return 0 == len(self.d_mask)
+    def _mask(self, b_read, b_write):
+        mask = self.f_pri
+        if b_read:
+            mask |= self.f_in
+        if b_write:
+            mask |= self.f_out
+        return mask
+    def register(self, fd, b_read, b_write):
+        if fd in self.d_mask:
+            raise Exception("fd %s is already registered."%(fd))
+        mask = self._mask(b_read, b_write)
+        self.kernel.register(fd, mask)
+        self.d_mask[fd] = mask
+    def modify(self, fd, b_read, b_write):
+        mask = self._mask(b_read, b_write)
+        if mask == self.d_mask[fd]:
+            return
+        self.kernel.modify(fd, mask)
+        self.d_mask[fd] = mask
+    def unregister(self, fd):
+        if fd not in self.d_mask:
+            return
+        del self.d_mask[fd]
+        try:
+            self.kernel.unregister(fd)
+        except (KeyError, OSError, ValueError):
+            # The descriptor may already have been closed, in which case
+            # the kernel has already forgotten it.
+            pass
+    def poll(self, timeout):
+        f_in = self.f_in
+        f_out = self.f_out
+        f_pri = self.f_pri
+        f_fail = self.f_fail
+        events = []
+        for (fd, ev) in self._wait(timeout):
+            if fd not in self.d_mask:
+                continue
+            mask = self.d_mask[fd]
+            b_fail = bool(ev & f_fail)
+            b_read = bool(ev & f_in) or (b_fail and bool(mask & f_in))
+            b_write = bool(ev & f_out) or (b_fail and bool(mask & f_out))
+            b_except = bool(ev & f_pri) or (
+                b_fail and not (mask & (f_in|f_out)))
+            events.append( (fd, b_read, b_write, b_except) )
+        return events
+    def close(self):
+        self.d_mask.clear()
+
+class PollPoller(_MaskPoller):
+    def __init__(self):
+        _MaskPoller.__init__(
+            self,
+            poller_h=POLLER_H_POLL,
+            kernel=select.poll(),
+            f_in=select.POLLIN,
+            f_out=select.POLLOUT,
+            f_pri=select.POLLPRI,
+            f_fail=select.POLLERR|select.POLLHUP|select.POLLNVAL)
+    def _wait(self, timeout):
+        # poll takes milliseconds. Round up: truncating would turn a wait
+        # of under a millisecond into no wait at all, and the engine would
+        # spin until its next timer was due. None or negative waits
+        # forever.
+        if timeout == None or timeout < 0:
+            return self.kernel.poll(None)
+        return self.kernel.poll(math.ceil(timeout * 1000))
+
+class EpollPoller(_MaskPoller):
+    def __init__(self):
+        _MaskPoller.__init__(
+            self,
+            poller_h=POLLER_H_EPOLL,
+            kernel=select.epoll(),
+            f_in=select.EPOLLIN,
+            f_out=select.EPOLLOUT,
+            f_pri=select.EPOLLPRI,
+            f_fail=select.EPOLLERR|select.EPOLLHUP)
+    def _wait(self, timeout):
+        return self.kernel.poll(timeout)
+    def close(self):
+        _MaskPoller.close(self)
+        self.kernel.close()
+
+def poller_new(poller_h=None):
+    '''
+    poller_h: one of POLLER_H_EPOLL, POLLER_H_POLL, POLLER_H_SELECT. If you
+    supply None, you get the best backend available on this platform.
+    '''
+    if poller_h == None:
+        if hasattr(select, 'epoll'):
+            poller_h = POLLER_H_EPOLL
+        elif hasattr(select, 'poll'):
+            poller_h = POLLER_H_POLL
+        else:
+            poller_h = POLLER_H_SELECT
+    if poller_h == POLLER_H_EPOLL:
+        return EpollPoller()
+    elif poller_h == POLLER_H_POLL:
+        return PollPoller()
+    elif poller_h == POLLER_H_SELECT:
+        return SelectPoller()
+    else:
+        raise Exception("Unknown poller_h [%s]"%(poller_h))
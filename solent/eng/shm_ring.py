@@ -0,0 +1,335 @@
+#
+# shm_ring
+#
+# // overview
+# A single-producer, single-consumer ring buffer in shared memory, for
+# passing records between processes on the same host without going through
+# the network stack.
+#
+# One process creates the ring (shm_ring_create). This process owns it, and
+# unlinks it when it closes. Another process attaches by name
+# (shm_ring_attach). Either end can be the producer, but there must be only
+# one producer and one consumer.
+#
+# Layout of the shared memory,
+#
+#   0       head        u8, bytes ever written. Only the producer writes it.
+#   64      tail        u8, bytes ever read. Only the consumer writes it.
+#   192     capacity    u8
+#   200     tag         u8, set by the creator. Whatever the two ends need
+#                       to agree on (the shm bridge puts its schema crc
+#                       here).
+#   256     data
+#
+# (head and tail sit on different cache lines, so the two processes are not
+# fighting over one.)
+#
+# Each record in the data area is a u4 length and then the payload, padded
+# to a multiple of eight bytes. A record never wraps. If there is not room
+# before the end of the data area, the producer writes a length of WRAP
+# there, and the record goes at the start. Records are cheap, but not free:
+# if you have many small messages, pack several into each record.
+#
+# Each ring has two fifos next to the shared memory,
+#
+#   wakeup  producer to consumer: there are new records. The producer
+#           writes a byte after a run of pushes (notify). The consumer
+#           gives fileno() to Engine.add_custom_fd_read.
+#
+#   space   consumer to producer: records have been taken off. The
+#           consumer writes a byte after each drain that took anything. A
+#           producer that is waiting for room gives space_fileno() to the
+#           engine.
+#
+# The fifos also order the shared memory. The consumer only reads head
+# just after it has emptied the wakeup fifo, and then reads no further than
+# that head until it empties the fifo again. The producer writes to the
+# fifo after it has stored head. The kernel's locking around the fifo puts
+# the producer's stores before the consumer's loads. So we do not depend on
+# how the CPU orders plain stores and loads (which python says nothing
+# about). The same goes for tail, through the space fifo. The counters are
+# accessed through a memoryview cast to native u8, so each access is a
+# single aligned eight-byte load or store.
+#
+# When a fifo is already full of bytes, a write to it is skipped. The other
+# end has plenty to read in that case, so it is never left asleep.
+#
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent import uniq
+
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+import os
+import struct
+import tempfile
+
+HEADER_SIZE = 256
+
+# Indexes into the header, as a u8 array.
+IDX_HEAD = 0
+IDX_TAIL = 8
+IDX_CAPACITY = 24
+IDX_TAG = 25
+
+ALIGN = 8
+
+WRAP = 0xffffffff
+
+S_LEN = struct.Struct('=I')
+
+DEFAULT_CAPACITY = 4 * 1024 * 1024
+
+# Names of the rings this process (or a parent we forked from) created.
+# See attach_untracked_shared_memory.
+created_names = set()
+
+def fifo_path_for(name):
+    return os.sep.join( [tempfile.gettempdir(), '%s.wakeup'%(name)] )
+
+def space_fifo_path_for(name):
+    return os.sep.join( [tempfile.gettempdir(), '%s.space'%(name)] )
+
+def fifo_poke(fd):
+    try:
+        os.write(fd, b'.')
+    except BlockingIOError:
+        # The fifo is full of bytes already.
+        pass
+
+def fifo_empty(fd):
+    while True:
+        try:
+            if not os.read(fd, 4096):
+                break
+        except BlockingIOError:
+            break
+
+class ShmRing:
+    def __init__(self, name, shm, capacity, b_owner):
+        self.name = name
+        self.shm = shm
+        self.capacity = capacity
+        self.b_owner = b_owner
+        #
+        self.buf = shm.buf
+        self.counters = shm.buf[0:HEADER_SIZE].cast('Q')
+        self.data = shm.buf[HEADER_SIZE:HEADER_SIZE + capacity]
+        self.fifo_path = fifo_path_for(name)
+        self.space_fifo_path = space_fifo_path_for(name)
+        # Both ends open the fifos read-write. (On linux, that means neither
+        # open blocks waiting for the other end.)
+        self.fd = os.open(self.fifo_path, os.O_RDWR | os.O_NONBLOCK)
+        self.fd_space = os.open(
+            self.space_fifo_path, os.O_RDWR | os.O_NONBLOCK)
+        #
+        # What each end has seen of the other's counter. See the top of
+        # this file for when they are read.
+        self.head_seen = self.counters[IDX_HEAD]
+        self.tail_seen = self.counters[IDX_TAIL]
+    def fileno(self):
+        'Consumer. Readable when there may be new records.'
+        return self.fd
+    def space_fileno(self):
+        'Producer. Readable when there may be new room.'
+        return self.fd_space
+    def close(self):
+        if self.fd == None:
+            return
+        os.close(self.fd)
+        os.close(self.fd_space)
+        self.fd = None
+        self.fd_space = None
+        self.data.release()
+        self.counters.release()
+        self.buf = None
+        self.shm.close()
+        if self.b_owner:
+            self.shm.unlink()
+            os.unlink(self.fifo_path)
+            os.unlink(self.space_fifo_path)
+            created_names.discard(self.name)
+    def get_tag(self):
+        'The tag that shm_ring_create was given.'
+        return self.counters[IDX_TAG]
+    def get_used(self):
+        return self.counters[IDX_HEAD] - self.counters[IDX_TAIL]
+    def get_record_max(self):
+        'Largest payload that push will take.'
+        return ((self.capacity // 2) & ~(ALIGN - 1)) - 4
+    def is_empty(self):
+        return self.counters[IDX_HEAD] == self.counters[IDX_TAIL]
+    #
+    def push(self, bb):
+        '''
+        Producer. Returns False, and writes nothing, if there is not room
+        for bb. The consumer does not hear about the record until you call
+        notify. (So a run of pushes costs one syscall.)
+
+        A record can be at most half the capacity. (Otherwise, there are
+        places in the ring where it could never fit.)
+        '''
+        capacity = self.capacity
+        counters = self.counters
+        head = counters[IDX_HEAD]
+        n = len(bb)
+        size = (4 + n + ALIGN - 1) & ~(ALIGN - 1)
+        if size > capacity // 2:
+            raise Exception("Record of %s bytes is too large for ring %s."%(
+                n, capacity))
+        o = head % capacity
+        room_to_end = capacity - o
+        if room_to_end < size:
+            needed = room_to_end + size
+        else:
+            needed = size
+        if needed > capacity - (head - self.tail_seen):
+            self.refresh_space()
+            if needed > capacity - (head - self.tail_seen):
+                return False
+        data = self.data
+        if room_to_end < size:
+            S_LEN.pack_into(data, o, WRAP)
+            head += room_to_end
+            o = 0
+        S_LEN.pack_into(data, o, n)
+        data[o + 4:o + 4 + n] = bb
+        counters[IDX_HEAD] = head + size
+        return True
+    def notify(self):
+        'Producer. Tells the consumer that there are new records.'
+        fifo_poke(self.fd)
+    def refresh_space(self):
+        '''
+        Producer. Empties the space fifo, and then looks at how far the
+        consumer has got. push calls this when it looks full. Call it
+        yourself when the engine says that space_fileno is readable.
+        '''
+        fifo_empty(self.fd_space)
+        self.tail_seen = self.counters[IDX_TAIL]
+    #
+    def drain(self, cb_record, limit=None):
+        '''
+        Consumer. Calls cb_record(view) for each record, oldest first. view
+        is a memoryview onto the ring, and is only good until cb_record
+        returns. Stops after limit records, if you give one. Returns the
+        number of records.
+        '''
+        capacity = self.capacity
+        counters = self.counters
+        data = self.data
+        tail = counters[IDX_TAIL]
+        count = 0
+        while True:
+            if self.head_seen == tail:
+                self.clear_wakeups()
+                if self.head_seen == tail:
+                    break
+            if limit != None and count >= limit:
+                break
+            o = tail % capacity
+            (n,) = S_LEN.unpack_from(data, o)
+            if n == WRAP:
+                tail += capacity - o
+                counters[IDX_TAIL] = tail
+                continue
+            view = data[o + 4:o + 4 + n]
+            try:
+                cb_record(view)
+            finally:
+                view.release()
+            tail += (4 + n + ALIGN - 1) & ~(ALIGN - 1)
+            counters[IDX_TAIL] = tail
+            count += 1
+        if count:
+            fifo_poke(self.fd_space)
+        return count
+    def has_seen_records(self):
+        '''
+        Consumer. True if there are records that drain can take without
+        hearing from the producer again. (This happens when drain stops at
+        its limit.)
+        '''
+        return self.head_seen != self.counters[IDX_TAIL]
+    def clear_wakeups(self):
+        '''
+        Consumer. Empties the wakeup fifo, and then looks at how far the
+        producer has got. drain calls this when it runs out of records.
+        '''
+        fifo_empty(self.fd)
+        self.head_seen = self.counters[IDX_HEAD]
+
+def shm_ring_create(capacity=DEFAULT_CAPACITY, name=None, tag=0):
+    '''
+    Creates a ring. capacity is in bytes, and is rounded up to a multiple of
+    eight. tag is a u8 that the attaching end can read with get_tag. This
+    process owns the ring, and close will unlink it.
+    '''
+    if name == None:
+        name = 'solent_ring_%s_%s'%(os.getpid(), uniq())
+    capacity = (capacity + ALIGN - 1) & ~(ALIGN - 1)
+    shm = shared_memory.SharedMemory(
+        name=name,
+        create=True,
+        size=HEADER_SIZE + capacity)
+    counters = shm.buf[0:HEADER_SIZE].cast('Q')
+    counters[IDX_HEAD] = 0
+    counters[IDX_TAIL] = 0
+    counters[IDX_CAPACITY] = capacity
+    counters[IDX_TAG] = tag
+    counters.release()
+    os.mkfifo(fifo_path_for(name))
+    os.mkfifo(space_fifo_path_for(name))
+    created_names.add(name)
+    return ShmRing(
+        name=name,
+        shm=shm,
+        capacity=capacity,
+        b_owner=True)
+
+def attach_untracked_shared_memory(name):
+    # If python's resource tracker knew about this attachment, it would
+    # unlink the memory when this process exits, under the owner's feet.
+    # From python 3.13 we can say so. Before that, we attach as usual and
+    # then take it back off the tracker's list. (Unless we created it: the
+    # tracker has just the one entry for the name, and that is the owner's.)
+    try:
+        return shared_memory.SharedMemory(
+            name=name,
+            track=False)
+    except TypeError:
+        pass
+    shm = shared_memory.SharedMemory(
+        name=name)
+    if name not in created_names:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+def shm_ring_attach(name):
+    'Attaches to a ring that another process created.'
+    shm = attach_untracked_shared_memory(
+        name=name)
+    counters = shm.buf[0:HEADER_SIZE].cast('Q')
+    capacity = counters[IDX_CAPACITY]
+    counters.release()
+    return ShmRing(
+        name=name,
+        shm=shm,
+        capacity=capacity,
+        b_owner=False)
@@ -0,0 +1,370 @@
+#
+# supervisor
+#
+# // overview
+# An engine is single-threaded, so a solent server uses one core. This
+# module runs several copies of a server, each in its own process, so that
+# it can use several.
+#
+# The supervisor forks count_workers worker processes. Each worker creates
+# its own Engine and hands it to fn_worker_init, which should build the orbs
+# and cogs for the server in the usual way. The worker then runs the event
+# loop.
+#
+# Worker engines have reuseport enabled (see engine.enable_reuseport). So,
+# when each worker opens a tcp server on the same port, the kernel spreads
+# incoming connections between them. There is no shared listening socket,
+# and no lock around accept.
+#
+# The supervisor runs an engine of its own, which it uses to,
+#
+#   * Collect stats. Each worker writes a line of json to a pipe every
+#     stats_period seconds. See get_worker_stats.
+#
+#   * Restart workers that exit unexpectedly, after restart_delay.
+#
+#   * Shut down gracefully on SIGTERM or SIGINT. Workers get SIGTERM, and
+#     then SIGKILL if they have not exited within shutdown_grace.
+#
+# Usage,
+#
+#   def fn_worker_init(engine, worker_idx):
+#       orb = engine.init_orb(
+#           i_nearcast=I_NEARCAST)
+#       ...
+#
+#   supervisor = supervisor_new(
+#       fn_worker_init=fn_worker_init,
+#       count_workers=os.cpu_count(),
+#       mtu=MTU)
+#   supervisor.run()
+#
+# This is unix-only. It relies on fork, and on SO_REUSEPORT.
+#
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from .engine import Engine
+from .metasock import MS_TYPE_TCP_ACCEPT
+
+from solent import log
+from solent import SolentQuitException
+
+import json
+import os
+import signal
+import time
+import traceback
+
+STATS_PERIOD = 1.0
+RESTART_DELAY = 1.0
+SHUTDOWN_GRACE = 5.0
+
+# How often the supervisor checks for workers that have exited.
+REAP_PERIOD = 0.2
+
+class SupervisorWorker:
+    def __init__(self, worker_idx):
+        self.worker_idx = worker_idx
+        #
+        self.pid = None
+        self.fd_stats = None
+        self.sb_stats = bytearray()
+        self.count_starts = 0
+        self.restart_timer_h = None
+
+class Supervisor:
+    def __init__(self, fn_worker_init, count_workers, mtu, stats_period, restart_delay, shutdown_grace):
+        self.fn_worker_init = fn_worker_init
+        self.count_workers = count_workers
+        self.mtu = mtu
+        self.stats_period = stats_period
+        self.restart_delay = restart_delay
+        self.shutdown_grace = shutdown_grace
+        #
+        self.engine = None
+        self.workers = [SupervisorWorker(worker_idx=idx)
+                        for idx in range(count_workers)]
+        self.d_pid = {} # pid vs worker
+        self.d_worker_stats = {} # worker_idx vs dict
+        self.b_stopping = False
+        self.reap_timer_h = None
+    def run(self):
+        '''
+        Starts the workers, and supervises them until we get SIGTERM or
+        SIGINT. Returns once every worker has exited.
+        '''
+        prev_sigterm = signal.signal(signal.SIGTERM, self._on_signal)
+        prev_sigint = signal.signal(signal.SIGINT, self._on_signal)
+        try:
+            self.start()
+            timeout = 0
+            while not self.b_stopping:
+                timeout = self.turn(
+                    timeout=timeout)
+        finally:
+            self.stop()
+            signal.signal(signal.SIGTERM, prev_sigterm)
+            signal.signal(signal.SIGINT, prev_sigint)
+    def start(self):
+        self.engine = Engine(
+            mtu=self.mtu)
+        for worker in self.workers:
+            self._spawn(worker)
+        self.reap_timer_h = self.engine.call_every(
+            period=REAP_PERIOD,
+            cb_eng_timer=self.cb_reap_timer)
+    def turn(self, timeout):
+        return self.engine.turn(
+            timeout=timeout)
+    def stop(self):
+        '''
+        Asks the workers to exit, and waits for them. Any that are still
+        running after shutdown_grace are killed.
+        '''
+        if self.engine == None:
+            return
+        self.b_stopping = True
+        for worker in self.workers:
+            if worker.restart_timer_h != None:
+                self.engine.cancel_timer(
+                    timer_h=worker.restart_timer_h)
+                worker.restart_timer_h = None
+        self._signal_workers(signal.SIGTERM)
+        t_deadline = time.time() + self.shutdown_grace
+        while self.d_pid and time.time() < t_deadline:
+            self.engine.turn(
+                timeout=REAP_PERIOD)
+        if self.d_pid:
+            log('supervisor: killing %s worker(s) that did not exit'%(
+                len(self.d_pid)))
+            self._signal_workers(signal.SIGKILL)
+            self._reap(
+                b_block=True)
+        for worker in self.workers:
+            self._close_stats_pipe(worker)
+        self.engine.close()
+        self.engine = None
+    def get_worker_stats(self):
+        '''
+        Returns a dict of worker_idx vs the most recent stats we received
+        from that worker. (See _worker_write_stats for the fields.)
+        '''
+        return self.d_worker_stats
+    def get_worker_pids(self):
+        return [worker.pid for worker in self.workers]
+    #
+    def _on_signal(self, signum, frame):
+        self.b_stopping = True
+    def _signal_workers(self, signum):
+        for pid in list(self.d_pid.keys()):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+    def _spawn(self, worker):
+        (fd_r, fd_w) = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(fd_r)
+            self._worker_main(
+                worker_idx=worker.worker_idx,
+                fd_stats=fd_w)
+            # (does not return)
+        os.close(fd_w)
+        os.set_blocking(fd_r, False)
+        worker.pid = pid
+        worker.fd_stats = fd_r
+        worker.count_starts += 1
+        self.d_pid[pid] = worker
+        self.engine.add_custom_fd_read(
+            cfd_h=worker.worker_idx,
+            fd=fd_r,
+            cb_eng_custom_fd_read=self.cb_eng_custom_fd_read)
+        log('supervisor: started worker %s [pid %s]'%(
+            worker.worker_idx, pid))
+    def _close_stats_pipe(self, worker):
+        if worker.fd_stats == None:
+            return
+        self.engine.del_custom_fd_read(
+            fd=worker.fd_stats)
+        os.close(worker.fd_stats)
+        worker.fd_stats = None
+        worker.sb_stats.clear()
+    def _reap(self, b_block):
+        # We wait on our own pids, rather than on -1, so that we leave alone
+        # any other children the host process may have.
+        for pid in list(self.d_pid.keys()):
+            try:
+                (got_pid, status) = os.waitpid(
+                    pid, 0 if b_block else os.WNOHANG)
+            except ChildProcessError:
+                (got_pid, status) = (pid, None)
+            if got_pid == 0:
+                # Still running
+                continue
+            worker = self.d_pid.pop(pid)
+            self._on_worker_exit(
+                worker=worker,
+                status=status)
+    def _on_worker_exit(self, worker, status):
+        log('supervisor: worker %s [pid %s] exited [status %s]'%(
+            worker.worker_idx, worker.pid, status))
+        worker.pid = None
+        if self.b_stopping:
+            return
+        worker.restart_timer_h = self.engine.call_later(
+            delay=self.restart_delay,
+            cb_eng_timer=self.cb_restart_timer)
+    #
+    def cb_reap_timer(self, cs_eng_timer):
+        self._reap(
+            b_block=False)
+    def cb_restart_timer(self, cs_eng_timer):
+        timer_h = cs_eng_timer.timer_h
+        for worker in self.workers:
+            if worker.restart_timer_h != timer_h:
+                continue
+            worker.restart_timer_h = None
+            if self.b_stopping:
+                return
+            # The pipe from the previous process has hit EOF by now, or
+            # will do shortly. Either way, we are done with it.
+            self._close_stats_pipe(worker)
+            self._spawn(worker)
+            return
+    def cb_eng_custom_fd_read(self, cs_eng_custom_fd_read):
+        worker = self.workers[cs_eng_custom_fd_read.cfd_h]
+        try:
+            bb = os.read(worker.fd_stats, 4096)
+        except BlockingIOError:
+            return
+        if not bb:
+            # The worker has gone. We will hear about that from waitpid.
+            self._close_stats_pipe(worker)
+            return
+        worker.sb_stats.extend(bb)
+        while True:
+            idx = worker.sb_stats.find(b'\n')
+            if idx < 0:
+                break
+            line = bytes(worker.sb_stats[:idx])
+            del worker.sb_stats[:idx+1]
+            try:
+                d = json.loads(line.decode('utf8'))
+            except ValueError:
+                log('supervisor: bad stats line from worker %s'%(
+                    worker.worker_idx))
+                continue
+            self.d_worker_stats[worker.worker_idx] = d
+    #
+    def _worker_main(self, worker_idx, fd_stats):
+        '''
+        Runs in the child process. Never returns.
+        '''
+        status = 0
+        engine = None
+        try:
+            # The supervisor coordinates shutdown. A Ctrl-C at the terminal
+            # goes to the whole process group, so we leave it to the
+            # supervisor.
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, _worker_on_sigterm)
+            for worker in self.workers:
+                if worker.fd_stats != None:
+                    os.close(worker.fd_stats)
+            # Our copy of the supervisor's engine is of no use here.
+            self.engine.poller.close()
+            os.set_blocking(fd_stats, False)
+            #
+            engine = Engine(
+                mtu=self.mtu)
+            engine.enable_reuseport()
+            self.fn_worker_init(
+                engine=engine,
+                worker_idx=worker_idx)
+            t_start = time.time()
+            def cb_stats_timer(cs_eng_timer):
+                _worker_write_stats(
+                    engine=engine,
+                    worker_idx=worker_idx,
+                    t_start=t_start,
+                    fd_stats=fd_stats)
+            engine.call_every(
+                period=self.stats_period,
+                cb_eng_timer=cb_stats_timer)
+            cb_stats_timer(None)
+            engine.event_loop()
+        except SolentQuitException:
+            pass
+        except:
+            traceback.print_exc()
+            status = 1
+        finally:
+            if engine != None:
+                try:
+                    engine.close()
+                except:
+                    traceback.print_exc()
+            os._exit(status)
+
+def _worker_on_sigterm(signum, frame):
+    raise SolentQuitException()
+
+def _worker_write_stats(engine, worker_idx, t_start, fd_stats):
+    count_accept = 0
+    send_queue_bytes = 0
+    for ms in engine.sid_to_metasock.values():
+        if ms.ms_type == MS_TYPE_TCP_ACCEPT:
+            count_accept += 1
+        send_queue_bytes += ms.send_buf_bytes
+    d = {
+        'worker_idx': worker_idx,
+        'pid': os.getpid(),
+        'uptime': time.time() - t_start,
+        'count_sockets': len(engine.sid_to_metasock),
+        'count_accept': count_accept,
+        'send_queue_bytes': send_queue_bytes,
+        'mempool_sips': engine.mempool.ltotal,
+        'mempool_allocs': engine.mempool.get_count_alloc(),
+        'mempool_retained_bytes': engine.mempool.get_retained_bytes(),
+    }
+    line = json.dumps(d) + '\n'
+    try:
+        os.write(fd_stats, line.encode('utf8'))
+    except (BlockingIOError, BrokenPipeError):
+        # The supervisor is behind or gone. Stats are not worth blocking
+        # for.
+        pass
+
+def supervisor_new(fn_worker_init, count_workers, mtu, stats_period=STATS_PERIOD, restart_delay=RESTART_DELAY, shutdown_grace=SHUTDOWN_GRACE):
+    '''
+    fn_worker_init: called in each worker process as
+    fn_worker_init(engine, worker_idx). It should set up the orbs for the
+    server against engine. The worker runs the event loop once it returns.
+    '''
+    if count_workers < 1:
+        raise Exception("Need at least one worker. (got %s)"%(count_workers))
+    ob = Supervisor(
+        fn_worker_init=fn_worker_init,
+        count_workers=count_workers,
+        mtu=mtu,
+        stats_period=stats_period,
+        restart_delay=restart_delay,
+        shutdown_grace=shutdown_grace)
+    return ob
@@ -46,16 +46,16 @@
 #
 # See testing/lconsole/spin_line_console.py for an example of this being
 # used in anger.
+#
+# The class is compiled in memory, and cached against the messages and
+# fields of the schema. Orbs with the same schema share it.
 
 from solent import Ns
 from solent import log
 
-import os
-import random
+import hashlib
+import linecache
 from string import Template
-import shutil
-import sys
-import time
 
 T_HEADING = Template('''#
 # (!) this file is generated by testbridge.py
@@ -87,9 +87,7 @@ T_FUNCTIONS_FOR_MESSAGES_WITH_FIELDS = Template('''    #
     def on_$mname(self, $csep_fields):
         self.acc_$mname.append( ($csep_fields,) )
     def nc_$mname(self, $csep_fields):
-        self.orb.nearcast(
-            cog=self,
-            message_h='$mname',
+        self.nearcast.$mname(
 $equals_bits)
         self.orb.cycle()''')
 
@@ -106,39 +104,32 @@ T_FUNCTIONS_FOR_MESSAGES_WITH_NO_FIELDS = Template('''    #
         for l in self.acc_$mname:
             log(l)
     def nc_$mname(self):
-        self.orb.nearcast(
-            cog=self,
-            message_h='$mname')
+        self.nearcast.$mname()
         self.orb.cycle()''')
 
-def create_code_file_and_then_dynamically_import_class(code):
-    dname = '/tmp/solent.testing.%s.%s'%(
-        str(time.time()), str(random.random()))
-    if os.path.exists(dname):
-        # paranoid, because there is a shutil.rmtree below
-        raise Exception("very weird")
-    else:
-        os.mkdir(dname)
-    fname = os.sep.join( [dname, 'dyn_receiver_cog.py'] )
-    f_ptr = open(fname, 'w+')
-    f_ptr.write(code)
-    f_ptr.close()
-    #
-    # import
-    sys.path.append(dname)
-    import dyn_receiver_cog
-    TestBridgeCog = dyn_receiver_cog.TestBridgeCog
-    #
-    # cleanup
-    sys.path.pop()
-    del dyn_receiver_cog
-    os.remove(fname)
-    shutil.rmtree(dname)
-    #
-    # here it is
-    return TestBridgeCog
+# schema hash vs TestBridgeCog
+TESTBRIDGE_CLASS_CACHE = {}
+
+def testbridge_schema_hash(nearcast_schema):
+    sb = []
+    for (mname, fields) in nearcast_schema.messages.items():
+        sb.append('%s(%s)'%(mname, ','.join(fields)))
+    return hashlib.sha1(';'.join(sb).encode('utf8')).hexdigest()
+
+def compile_testbridge_class(code, schema_hash):
+    filename = '<testbridge %s>'%(schema_hash)
+    # (So that tracebacks can show the generated lines.)
+    linecache.cache[filename] = (
+        len(code), None, code.splitlines(True), filename)
+    namespace = {}
+    exec(compile(code, filename, 'exec'), namespace)
+    return namespace['TestBridgeCog']
 
 def init_testbridge_class(nearcast_schema):
+    schema_hash = testbridge_schema_hash(
+        nearcast_schema=nearcast_schema)
+    if schema_hash in TESTBRIDGE_CLASS_CACHE:
+        return TESTBRIDGE_CLASS_CACHE[schema_hash]
     #
     # Harvest the nearcast schema to synthesise a class with listeners
     # for its messages, and ability to nearcast to it.
@@ -165,9 +156,9 @@ def init_testbridge_class(nearcast_schema):
     code = T_HEADING.substitute(
         declare_acc_variables='\n'.join(acc_lines),
         function_lines='\n'.join(rendered_function_blocks))
-    #
-    # I found exec to be fiddly. Instead, we are going to create a file with
-    # the code in, and dynamically import it.
-    TestBridgeCog = create_code_file_and_then_dynamically_import_class(code)
+    TestBridgeCog = compile_testbridge_class(
+        code=code,
+        schema_hash=schema_hash)
+    TESTBRIDGE_CLASS_CACHE[schema_hash] = TestBridgeCog
     return TestBridgeCog
 
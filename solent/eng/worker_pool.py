@@ -0,0 +1,186 @@
+#
+# worker_pool
+#
+# // overview
+# Runs expensive cog handlers off the event loop, in a concurrent.futures
+# thread or process pool, so that they do not hold up the engine and its
+# sockets.
+#
+# Mark a handler with the pool_handler decorator. A pool handler is a plain
+# function of the message fields. It has no self: it runs in another thread
+# or process, where the cog's state and the orb are off limits. If you give
+# reply, the handler returns a dict of fields for that message (or None to
+# send nothing), and the orb nearcasts it from the cog. To put a whole cog
+# in the pool, mark each of its handlers.
+#
+#   class CogThumbnailer:
+#       def __init__(self, cog_h, orb, engine):
+#           ...
+#       @pool_handler(reply='thumbnail_done')
+#       def on_thumbnail_request(image_h, data):
+#           return {'image_h': image_h, 'thumbnail': shrink(data)}
+#
+# The orb makes a thread pool the first time it meets a pool handler. Call
+# Orb.init_worker_pool first if you want a process pool, or a different
+# number of workers. (For a process pool, the cog class needs to be defined
+# at the top level of a module, so that the handler can be pickled.)
+#
+# Ordering. The other cogs see every message in the same order as ever. The
+# pool handler's message is handed over at its place in that order, but its
+# reply arrives later, after whatever was distributed in the meantime.
+# Replies are nearcast in the order in which their messages were handed to
+# the pool, not the order in which the workers finish. So a slow job holds
+# up the replies behind it.
+#
+# When a job finishes, the worker writes a byte to a pipe that the engine
+# is watching (see Engine.add_custom_fd_read). On the loop, the pool takes
+# finished jobs off the front of its queue. If a handler raised, the
+# exception is raised again there, as it would be for a handler on the
+# loop.
+#
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent import log
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+# Name of the attribute that pool_handler puts on a handler.
+POOL_HANDLER_H = '_pool_handler_ns'
+
+DEFAULT_WORKERS = 4
+
+class PoolHandlerMark:
+    def __init__(self, reply):
+        # message_h for the handler's result, or None
+        self.reply = reply
+
+def pool_handler(reply=None):
+    '''
+    Decorator for a cog's on_ method. See the top of this file.
+    '''
+    def decorate(fn):
+        setattr(fn, POOL_HANDLER_H, PoolHandlerMark(
+            reply=reply))
+        return staticmethod(fn)
+    return decorate
+
+def get_pool_handler_mark(fn):
+    'Returns the PoolHandlerMark for a handler, or None.'
+    return getattr(fn, POOL_HANDLER_H, None)
+
+class PoolJob:
+    def __init__(self, future, cog_h, message_h, reply):
+        self.future = future
+        self.cog_h = cog_h
+        self.message_h = message_h
+        self.reply = reply
+
+class WorkerPool:
+    def __init__(self, orb, engine, workers, b_processes):
+        self.orb = orb
+        self.engine = engine
+        self.workers = workers
+        self.b_processes = b_processes
+        #
+        if b_processes:
+            self.executor = ProcessPoolExecutor(
+                max_workers=workers)
+        else:
+            self.executor = ThreadPoolExecutor(
+                max_workers=workers,
+                thread_name_prefix='%s_pool'%(orb.spin_h))
+        # PoolJob, in the order they were submitted
+        self.jobs = deque()
+        #
+        (self.fd_wake_read, self.fd_wake_write) = os.pipe()
+        os.set_blocking(self.fd_wake_read, False)
+        os.set_blocking(self.fd_wake_write, False)
+        engine.add_custom_fd_read(
+            cfd_h='%s/worker_pool'%(orb.spin_h),
+            fd=self.fd_wake_read,
+            cb_eng_custom_fd_read=self.cb_eng_custom_fd_read)
+        #
+        self.count_submitted = 0
+        self.count_completed = 0
+    def close(self):
+        if self.executor == None:
+            return
+        self.executor.shutdown(
+            wait=True,
+            cancel_futures=True)
+        self.executor = None
+        self.engine.del_custom_fd_read(
+            fd=self.fd_wake_read)
+        os.close(self.fd_wake_read)
+        os.close(self.fd_wake_write)
+        self.jobs.clear()
+    def get_depth(self):
+        'Number of jobs that have not been harvested yet.'
+        return len(self.jobs)
+    def submit(self, cog_h, message_h, fn, reply, args):
+        future = self.executor.submit(fn, *args)
+        self.jobs.append(PoolJob(
+            future=future,
+            cog_h=cog_h,
+            message_h=message_h,
+            reply=reply))
+        self.count_submitted += 1
+        future.add_done_callback(self._wake)
+    #
+    def cb_eng_custom_fd_read(self, cs_eng_custom_fd_read):
+        try:
+            while os.read(self.fd_wake_read, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        self.harvest()
+    def harvest(self):
+        '''
+        Nearcasts the replies of finished jobs at the front of the queue.
+        '''
+        jobs = self.jobs
+        records = self.orb.nearcast_schema.records
+        while jobs and jobs[0].future.done():
+            job = jobs.popleft()
+            self.count_completed += 1
+            error = job.future.exception()
+            if error != None:
+                log('')
+                log('!! breaking in orb [%s], pool, %s:on_%s'%(
+                    self.orb.spin_h, job.cog_h, job.message_h))
+                log('')
+                raise error
+            result = job.future.result()
+            if job.reply == None or result == None:
+                continue
+            self.orb.nearcast_record(
+                record=records[job.reply](
+                    cog_h=job.cog_h,
+                    **result))
+    #
+    def _wake(self, future):
+        # (Called on a worker thread, or on the executor's own thread.)
+        try:
+            os.write(self.fd_wake_write, b'.')
+        except (BlockingIOError, OSError):
+            # Already plenty of wakeups in the pipe, or we are closing.
+            pass
@@ -164,6 +164,8 @@ class CogNetwork:
         self.client_sid = None
         self.active_finished = False
         self.active_tpl = None
+        self.active_f_ptr = None
+        self.b_paused = False
 
     def on_init(self):
         pass
@@ -198,7 +200,25 @@ class CogNetwork:
             port=self.track_prime.bulk_port,
             cb_tcp_client_connect=self.cb_tcp_client_connect,
             cb_tcp_client_condrop=self.cb_tcp_client_condrop,
-            cb_tcp_client_recv=self.cb_tcp_client_recv)
+            cb_tcp_client_recv=self.cb_tcp_client_recv,
+            cb_tcp_client_pause=self.cb_tcp_client_pause,
+            cb_tcp_client_resume=self.cb_tcp_client_resume)
+
+    def __pump_file(self):
+        # We read the file a chunk at a time, and stop when the engine tells
+        # us that the send queue is full. It will tell us when to carry on.
+        # That way, memory use does not grow with the size of the file.
+        while not self.b_paused:
+            bb = self.active_f_ptr.read(CHUNK_SIZE)
+            if not bb:
+                self.active_f_ptr.close()
+                self.active_f_ptr = None
+                self.active_finished = True
+                log("Content is queued engine.")
+                return
+            self.engine.send(
+                sid=self.client_sid,
+                bb=bb)
 
     def cb_tcp_client_connect(self, cs_tcp_client_connect):
         engine = cs_tcp_client_connect.engine
@@ -210,37 +230,27 @@ class CogNetwork:
 
         (enqueue_h, filename) = self.active_tpl
 
-        # For large files, this will jam the event loop. But this process is
-        # not doing much else, so I figure that is fine.
-        f_ptr = open(filename, 'rb')
-        bb_file = f_ptr.read()
-        f_ptr.close()
+        self.active_f_ptr = open(filename, 'rb')
+        self.b_paused = False
 
         # In the protocol for this bulk transfer method, the first eight
         # bytes are a uint64 that tell the other side how much data we
         # will be sending.
         leading_uint64 = bytearray(8)
-        struct.pack_into('!Q', leading_uint64, 0, len(bb_file))
+        struct.pack_into('!Q', leading_uint64, 0, os.path.getsize(filename))
         self.engine.send(
             sid=client_sid,
             bb=leading_uint64)
 
-        blen = len(bb_file)
-        offset = 0
-        while True:
-            nail = offset
-            peri = offset+engine.mtu
-            bb = bb_file[nail:peri]
-
-            self.engine.send(
-                sid=client_sid,
-                bb=bb)
-            offset = peri
+        self.__pump_file()
 
-            if offset >= blen:
-                break
+    def cb_tcp_client_pause(self, cs_tcp_client_pause):
+        self.b_paused = True
 
-        log("Content is queued engine.")
+    def cb_tcp_client_resume(self, cs_tcp_client_resume):
+        self.b_paused = False
+        if self.active_f_ptr != None:
+            self.__pump_file()
 
     def cb_tcp_client_condrop(self, cs_tcp_client_condrop):
         engine = cs_tcp_client_condrop.engine
@@ -250,6 +260,9 @@ class CogNetwork:
         log('[tcp client condrop]')
 
         self.client_sid = None
+        if self.active_f_ptr != None:
+            self.active_f_ptr.close()
+            self.active_f_ptr = None
 
         self.__maybe_start_send()
 
@@ -289,6 +302,9 @@ CONS_PORT = 7999
 
 MTU = 1500
 
+# Size of the reads we make from the file being sent.
+CHUNK_SIZE = 64 * 1024
+
 def main():
     (_cmd, bulk_addr, bulk_port) = sys.argv
     bulk_port = int(bulk_port)
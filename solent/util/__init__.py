@@ -20,6 +20,9 @@ from .rail_bytesetter import RailBytesetter
 from .rail_line_console import RailLineConsole
 from .rail_linetalk import RailLinetalk
 from .rail_wire_doc_unpack import RailWireDocUnpack
+from .spin_nearcast_bridge import SpinNearcastBridge
+from .spin_nearcast_journal_replay import SpinNearcastJournalReplay
+from .spin_nearcast_shm_bridge import SpinNearcastShmBridge
 from .spin_selection_ui import SpinSelectionUi
 from .spin_rough_alarm import SpinRoughAlarm
 
@@ -0,0 +1,287 @@
+#
+# spin_nearcast_bridge
+#
+# // overview
+# Carries nearcast messages between orbs in different processes, or on
+# different hosts, over udp (unicast or multicast).
+#
+# On the sending side, the bridge watches its orb for the messages named in
+# send_message_hs. It encodes them with the schema's codec (so the schema
+# needs typed fields, see nearcast_codec.py) and packs as many as will fit
+# into each datagram. A datagram goes out when it is full, or at the end of
+# the turn.
+#
+# On the receiving side, it decodes datagrams and nearcasts the messages
+# named in recv_message_hs onto its orb. These arrive with the bridge's
+# spin_h as their cog_h. The bridge does not send those on again, so two
+# bridges can listen to each other without making a loop.
+#
+# A datagram looks like this,
+#
+#   u8  sender_id       random, per bridge
+#   u8  seq             counts up from 0, per sender
+#   u4  schema_crc      both ends need to have the same schema
+#   u2  count           number of messages
+#   ..  messages        as encoded by the codec
+#
+# The receiver follows seq for each sender. If a datagram goes missing, it
+# counts the gap, and calls cb_bridge_gap if you gave one. Udp does not
+# redeliver, so what you do about the gap is up to the application. Late or
+# repeated datagrams are dropped. So are datagrams from this bridge (you
+# will see these if the pub and sub are on the same multicast group).
+#
+# Example,
+#
+#   bridge = engine.init_spin(
+#       construct=SpinNearcastBridge,
+#       orb=orb,
+#       send_message_hs=['price'],
+#       recv_message_hs=['order'])
+#   bridge.open_pub(
+#       addr='239.0.0.1',
+#       port=5001)
+#   bridge.open_sub(
+#       addr='239.0.0.1',
+#       port=5002)
+#
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent import log
+from solent.eng.nearcast_codec import nearcast_schema_crc
+from solent.eng.nearcast_codec import NearcastCodecOverflow
+
+import os
+import struct
+
+S_HEADER = struct.Struct('!QQIH')
+
+class CsBridgeGap:
+    def __init__(self):
+        self.spin_h = None
+        self.sender_id = None
+        self.expected_seq = None
+        self.seq = None
+        self.count_missed = None
+
+class SpinNearcastBridge:
+    def __init__(self, spin_h, engine, orb, send_message_hs, recv_message_hs, cb_bridge_gap=None):
+        self.spin_h = spin_h
+        self.engine = engine
+        self.orb = orb
+        self.send_message_hs = set(send_message_hs)
+        self.recv_message_hs = set(recv_message_hs)
+        self.cb_bridge_gap = cb_bridge_gap
+        #
+        nearcast_schema = orb.nearcast_schema
+        for message_h in self.send_message_hs | self.recv_message_hs:
+            if message_h not in nearcast_schema:
+                raise Exception("No message [%s] in the schema."%(
+                    message_h))
+            if 'ref' in nearcast_schema.field_types[message_h]:
+                # (refs point into this process)
+                raise Exception("Can't bridge [%s], it has a ref field."%(
+                    message_h))
+        self.codec = nearcast_schema.get_codec()
+        self.schema_crc = nearcast_schema_crc(
+            nearcast_schema=nearcast_schema)
+        #
+        self.cs_bridge_gap = CsBridgeGap()
+        #
+        (self.sender_id,) = struct.unpack('!Q', os.urandom(8))
+        self.pub_sid = None
+        self.sub_sid = None
+        #
+        # The datagram being assembled. Messages are encoded straight into
+        # it. It comes from the engine's mempool, and is handed to the
+        # engine with send_sip when it goes out.
+        self.mtu = engine.mtu
+        self.batch = engine.mempool.alloc(
+            size=self.mtu)
+        self.batch_o = S_HEADER.size
+        self.batch_count = 0
+        self.seq = 0
+        #
+        # sender_id vs the seq we expect next
+        self.d_expected_seq = {}
+        #
+        self.count_sent_messages = 0
+        self.count_sent_datagrams = 0
+        self.count_recv_messages = 0
+        self.count_recv_datagrams = 0
+        self.count_missed_datagrams = 0
+        self.count_dropped_datagrams = 0
+        #
+        orb.add_snoop(
+            snoop=self)
+    def eng_turn(self, activity):
+        if self.batch_count:
+            activity.mark(
+                l=self,
+                s='nearcast bridge send')
+            self._flush()
+    def eng_close(self):
+        if self.batch != None:
+            self.engine.mempool.free(
+                sip=self.batch)
+            self.batch = None
+        if self.pub_sid != None:
+            self.engine.close_pub(
+                pub_sid=self.pub_sid)
+        if self.sub_sid != None:
+            self.engine.close_sub(
+                sub_sid=self.sub_sid)
+    #
+    def open_pub(self, addr, port):
+        self.engine.open_pub(
+            addr=addr,
+            port=port,
+            cb_pub_start=self.cb_pub_start,
+            cb_pub_stop=self.cb_pub_stop)
+    def open_sub(self, addr, port):
+        self.engine.open_sub(
+            addr=addr,
+            port=port,
+            cb_sub_start=self.cb_sub_start,
+            cb_sub_stop=self.cb_sub_stop,
+            cb_sub_recv=self.cb_sub_recv)
+    def get_sub_port(self):
+        'Useful if you opened the sub on port 0.'
+        ms = self.engine._get_ms_for_sid(self.sub_sid)
+        return ms.sock.getsockname()[1]
+    #
+    def cb_pub_start(self, cs_pub_start):
+        self.pub_sid = cs_pub_start.pub_sid
+    def cb_pub_stop(self, cs_pub_stop):
+        self.pub_sid = None
+    def cb_sub_start(self, cs_sub_start):
+        self.sub_sid = cs_sub_start.sub_sid
+    def cb_sub_stop(self, cs_sub_stop):
+        self.sub_sid = None
+    def cb_sub_recv(self, cs_sub_recv):
+        bb = cs_sub_recv.bb
+        #
+        if len(bb) < S_HEADER.size:
+            log('%s: dropping short datagram (%s bytes)'%(
+                self.spin_h, len(bb)))
+            self.count_dropped_datagrams += 1
+            return
+        (sender_id, seq, schema_crc, count) = S_HEADER.unpack_from(bb, 0)
+        if sender_id == self.sender_id:
+            return
+        if schema_crc != self.schema_crc:
+            log('%s: dropping datagram for another schema (%s)'%(
+                self.spin_h, schema_crc))
+            self.count_dropped_datagrams += 1
+            return
+        expected_seq = self.d_expected_seq.get(sender_id, seq)
+        if seq < expected_seq:
+            self.count_dropped_datagrams += 1
+            return
+        self.d_expected_seq[sender_id] = seq + 1
+        if seq > expected_seq:
+            self.count_missed_datagrams += seq - expected_seq
+            if self.cb_bridge_gap != None:
+                self.cs_bridge_gap.spin_h = self.spin_h
+                self.cs_bridge_gap.sender_id = sender_id
+                self.cs_bridge_gap.expected_seq = expected_seq
+                self.cs_bridge_gap.seq = seq
+                self.cs_bridge_gap.count_missed = seq - expected_seq
+                self.cb_bridge_gap(
+                    cs_bridge_gap=self.cs_bridge_gap)
+        self.count_recv_datagrams += 1
+        #
+        records = []
+        o = S_HEADER.size
+        try:
+            for idx in range(count):
+                (record, o) = self.codec.decode_bytes(
+                    bb=bb,
+                    o=o,
+                    cog_h=self.spin_h)
+                records.append(record)
+        except Exception as e:
+            log('%s: dropping bad datagram (%s)'%(self.spin_h, e))
+            self.count_dropped_datagrams += 1
+            return
+        for record in records:
+            if record.message_h not in self.recv_message_hs:
+                continue
+            self.count_recv_messages += 1
+            self.orb.nearcast_record(
+                record=record)
+    #
+    def accepts_message(self, message_h):
+        # (We are a snoop on the orb. This spares it calling us for messages
+        # we do not send.)
+        return message_h in self.send_message_hs
+    def on_nearcast_record(self, record):
+        if record.message_h not in self.send_message_hs:
+            return
+        if record.cog_h == self.spin_h:
+            # came in over the bridge
+            return
+        if self.pub_sid == None or self.batch == None:
+            return
+        try:
+            o = self.codec.encode(
+                record=record,
+                sip=self.batch,
+                o=self.batch_o)
+        except NearcastCodecOverflow:
+            if not self.batch_count:
+                raise Exception("Message [%s] is too large for the mtu (%s)."%(
+                    record.message_h, self.mtu))
+            # (The codec writes nothing when it overflows.)
+            self._flush()
+            self.on_nearcast_record(
+                record=record)
+            return
+        self.batch_o = o
+        self.batch_count += 1
+        self.count_sent_messages += 1
+    def orb_close(self):
+        pass
+    #
+    def _flush(self):
+        if not self.batch_count:
+            return
+        if self.pub_sid == None:
+            # The pub has gone since these were batched.
+            self.batch_o = S_HEADER.size
+            self.batch_count = 0
+            return
+        batch = self.batch
+        S_HEADER.pack_into(
+            batch.arr,
+            0,
+            self.sender_id,
+            self.seq,
+            self.schema_crc,
+            self.batch_count)
+        batch.size = self.batch_o
+        # (The engine owns the sip now, and frees it once it is sent.)
+        self.engine.send_sip(
+            sid=self.pub_sid,
+            sip=batch)
+        self.batch = self.engine.mempool.alloc(
+            size=self.mtu)
+        self.seq += 1
+        self.count_sent_datagrams += 1
+        self.batch_o = S_HEADER.size
+        self.batch_count = 0
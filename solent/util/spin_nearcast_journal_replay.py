@@ -0,0 +1,138 @@
+#
+# spin_nearcast_journal_replay
+#
+# // overview
+# Plays a nearcast journal (see solent/eng/nearcast_journal.py) into an orb.
+# Use it for load tests on real traffic, and to reproduce incidents.
+#
+# A journal holds everything that was on the nearcast, including what the
+# cogs said in reply. If you replay into an orb that has the same cogs,
+# they will say it all again. So you will usually want to pass message_hs,
+# naming the messages that came in from outside (from gateways, bridges and
+# so on), and let the cogs do the rest.
+#
+# With b_paced off, the spin nearcasts up to batch messages per turn, as fast
+# as the orb takes them. With it on, it keeps the gaps between messages as
+# they were recorded, counting from the first, and sleeps on an engine timer
+# in between.
+#
+# Messages keep the cog_h they were recorded with. b_done goes True when
+# the journal runs out.
+#
+# Example,
+#
+#   orb.init_cog(CogUnderTest)
+#   replay = engine.init_spin(
+#       construct=SpinNearcastJournalReplay,
+#       orb=orb,
+#       path='/tmp/prod.journal',
+#       message_hs=['order_received'])
+#   while not replay.b_done:
+#       engine.turn(
+#           timeout=0.1)
+#
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent.eng.nearcast_journal import journal_segment_paths
+from solent.eng.nearcast_journal import nearcast_journal_read
+
+REPLAY_BATCH = 1024
+
+class SpinNearcastJournalReplay:
+    def __init__(self, spin_h, engine, orb, path, message_hs=None, b_paced=False, batch=REPLAY_BATCH):
+        self.spin_h = spin_h
+        self.engine = engine
+        self.orb = orb
+        self.path = path
+        self.b_paced = b_paced
+        self.batch = batch
+        #
+        nearcast_schema = orb.nearcast_schema
+        if message_hs == None:
+            self.message_hs = None
+        else:
+            self.message_hs = set(message_hs)
+            for message_h in self.message_hs:
+                if message_h not in nearcast_schema:
+                    raise Exception("No message [%s] in the schema."%(
+                        message_h))
+        if not journal_segment_paths(path):
+            raise Exception("No journal at %s."%(path))
+        self.journal = nearcast_journal_read(
+            path=path,
+            nearcast_schema=nearcast_schema)
+        self.clock = engine.get_clock()
+        #
+        # (t_ns, record) that was read, but was not due yet
+        self.upcoming = None
+        self.t_first_ns = None
+        self.t_start = None
+        self.timer_h = None
+        #
+        self.b_done = False
+        self.count_replayed = 0
+    def eng_turn(self, activity):
+        if self.b_done:
+            return
+        if self.timer_h != None:
+            return
+        message_hs = self.message_hs
+        nearcast_record = self.orb.nearcast_record
+        now = self.clock.now()
+        count = 0
+        # (Messages we skip count towards batch, so that a long run of them
+        # does not hold up the engine either.)
+        for _ in range(self.batch):
+            item = self.upcoming
+            if item == None:
+                item = next(self.journal, None)
+                if item == None:
+                    self.b_done = True
+                    break
+            (t_ns, record) = item
+            if self.b_paced:
+                if self.t_first_ns == None:
+                    self.t_first_ns = t_ns
+                    self.t_start = now
+                at_t = self.t_start + (t_ns - self.t_first_ns) / 1e9
+                if at_t > now:
+                    self.upcoming = item
+                    self.timer_h = self.engine.call_at(
+                        at_t=at_t,
+                        cb_eng_timer=self.cb_eng_timer)
+                    break
+            self.upcoming = None
+            if message_hs != None and record.message_h not in message_hs:
+                continue
+            nearcast_record(record)
+            count += 1
+        if count or self.upcoming == None:
+            self.count_replayed += count
+            activity.mark(
+                l=self,
+                s='nearcast journal replay')
+    def eng_close(self):
+        if self.timer_h != None:
+            self.engine.cancel_timer(
+                timer_h=self.timer_h)
+            self.timer_h = None
+    #
+    def cb_eng_timer(self, cs_eng_timer):
+        # (The next message is due. eng_turn sends it.)
+        self.timer_h = None
@@ -0,0 +1,283 @@
+#
+# spin_nearcast_shm_bridge
+#
+# // overview
+# Carries nearcast messages between orbs in different processes on the same
+# host, through shared-memory rings (see solent/eng/shm_ring.py). This is
+# the same idea as SpinNearcastBridge, but without the network stack: no
+# syscall per message, and nothing is lost.
+#
+# Each ring goes one way. The receiving process calls open_recv, which
+# creates a ring and returns its name. The sending process passes that name
+# to open_send. For traffic in both directions, do both on each side.
+#
+# On the sending side, the bridge watches its orb for the messages named in
+# send_message_hs, and encodes them with the schema's codec (the schema
+# needs typed fields, see nearcast_codec.py) straight into a batch. At the
+# end of the turn, or when the batch is full, it pushes the batch into the
+# ring as one record, and wakes the other side.
+#
+# If the ring is full, batches wait in the bridge, in order, and the bridge
+# sleeps on the ring's space fifo until the other side makes room. Waiting
+# batches are limited to pending_max bytes. Past that, the bridge raises:
+# the other side is not keeping up. Use get_pending_bytes if you want to
+# slow down before that happens.
+#
+# On the receiving side, it decodes records and nearcasts the messages named
+# in recv_message_hs onto its orb, with the bridge's spin_h as their cog_h.
+# It does not send those on again. A record that does not decode is logged,
+# counted and dropped as a whole.
+#
+# The two processes must use the same schema. open_recv writes the schema's
+# crc into the ring (as its tag), and open_send refuses a ring with a
+# different one.
+#
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent import log
+from solent.base.sip import Sip
+from solent.eng.nearcast_codec import nearcast_schema_crc
+from solent.eng.nearcast_codec import NearcastCodecOverflow
+from solent.eng.shm_ring import DEFAULT_CAPACITY
+from solent.eng.shm_ring import shm_ring_attach
+from solent.eng.shm_ring import shm_ring_create
+
+from collections import deque
+
+# Most records we will take off the ring in one turn. Beyond this, we let
+# the rest of the engine have a go.
+DRAIN_LIMIT = 4096
+
+# Largest batch we send as one record. (Smaller if the ring is small.)
+BATCH_MAX = 64 * 1024
+
+# Default for the most bytes of batches that can wait for room in the ring.
+PENDING_MAX = 16 * 1024 * 1024
+
+class SpinNearcastShmBridge:
+    def __init__(self, spin_h, engine, orb, send_message_hs, recv_message_hs, pending_max=PENDING_MAX):
+        self.spin_h = spin_h
+        self.engine = engine
+        self.orb = orb
+        self.send_message_hs = set(send_message_hs)
+        self.recv_message_hs = set(recv_message_hs)
+        self.pending_max = pending_max
+        #
+        nearcast_schema = orb.nearcast_schema
+        for message_h in self.send_message_hs | self.recv_message_hs:
+            if message_h not in nearcast_schema:
+                raise Exception("No message [%s] in the schema."%(
+                    message_h))
+            if 'ref' in nearcast_schema.field_types[message_h]:
+                # (refs point into this process)
+                raise Exception("Can't bridge [%s], it has a ref field."%(
+                    message_h))
+        self.codec = nearcast_schema.get_codec()
+        self.schema_crc = nearcast_schema_crc(
+            nearcast_schema=nearcast_schema)
+        #
+        self.ring_send = None
+        self.ring_recv = None
+        #
+        # The batch being assembled. Made in open_send, when we know how
+        # large a record the ring takes.
+        self.batch = None
+        self.batch_view = None
+        self.batch_o = 0
+        self.batch_count = 0
+        # Batches (as bytes) that did not fit in ring_send, oldest first.
+        self.pending = deque()
+        self.pending_bytes = 0
+        # Whether the engine is watching the ring's space fifo for us.
+        self.b_waiting_for_space = False
+        #
+        self.count_sent_messages = 0
+        self.count_sent_batches = 0
+        self.count_recv_messages = 0
+        self.count_dropped_records = 0
+        #
+        orb.add_snoop(
+            snoop=self)
+    def eng_turn(self, activity):
+        if self.batch_count:
+            activity.mark(
+                l=self,
+                s='nearcast shm bridge send')
+            self._flush()
+        ring_recv = self.ring_recv
+        if ring_recv != None and ring_recv.has_seen_records():
+            # (drain stopped at its limit last time.)
+            activity.mark(
+                l=self,
+                s='nearcast shm bridge recv')
+            ring_recv.drain(
+                cb_record=self.cb_record,
+                limit=DRAIN_LIMIT)
+    def eng_close(self):
+        if self.ring_send != None:
+            if self.b_waiting_for_space:
+                self.engine.del_custom_fd_read(
+                    fd=self.ring_send.space_fileno())
+                self.b_waiting_for_space = False
+            self.ring_send.close()
+            self.ring_send = None
+        if self.ring_recv != None:
+            self.engine.del_custom_fd_read(
+                fd=self.ring_recv.fileno())
+            self.ring_recv.close()
+            self.ring_recv = None
+    #
+    def get_pending_bytes(self):
+        'Bytes of batches waiting for room in the ring.'
+        return self.pending_bytes
+    def open_recv(self, capacity=DEFAULT_CAPACITY):
+        '''
+        Creates a ring for messages coming in. Returns its name, which the
+        sending process needs for open_send.
+        '''
+        if self.ring_recv != None:
+            raise Exception("Already have a recv ring.")
+        self.ring_recv = shm_ring_create(
+            capacity=capacity,
+            tag=self.schema_crc)
+        self.engine.add_custom_fd_read(
+            cfd_h=self.spin_h,
+            fd=self.ring_recv.fileno(),
+            cb_eng_custom_fd_read=self.cb_eng_custom_fd_read)
+        return self.ring_recv.name
+    def open_send(self, name):
+        if self.ring_send != None:
+            raise Exception("Already have a send ring.")
+        ring_send = shm_ring_attach(
+            name=name)
+        schema_crc = ring_send.get_tag()
+        if schema_crc != self.schema_crc:
+            ring_send.close()
+            raise Exception("Ring %s is for another schema (%s, not %s)."%(
+                name, schema_crc, self.schema_crc))
+        self.ring_send = ring_send
+        self.batch = Sip(
+            size=min(BATCH_MAX, self.ring_send.get_record_max()))
+        self.batch_view = memoryview(self.batch.arr)
+    #
+    def cb_eng_custom_fd_read(self, cs_eng_custom_fd_read):
+        self.ring_recv.drain(
+            cb_record=self.cb_record,
+            limit=DRAIN_LIMIT)
+    def cb_eng_space_fd_read(self, cs_eng_custom_fd_read):
+        self.ring_send.refresh_space()
+        self._push_pending()
+    def cb_record(self, view):
+        codec = self.codec
+        recv_message_hs = self.recv_message_hs
+        nearcast_record = self.orb.nearcast_record
+        spin_h = self.spin_h
+        len_view = len(view)
+        records = []
+        o = 0
+        try:
+            while o < len_view:
+                (record, o) = codec.decode_bytes(
+                    bb=view,
+                    o=o,
+                    cog_h=spin_h)
+                records.append(record)
+        except Exception as e:
+            log('%s: dropping bad record (%s)'%(spin_h, e))
+            self.count_dropped_records += 1
+            return
+        for record in records:
+            if record.message_h not in recv_message_hs:
+                continue
+            self.count_recv_messages += 1
+            nearcast_record(
+                record=record)
+    #
+    def accepts_message(self, message_h):
+        # (We are a snoop on the orb. This spares it calling us for messages
+        # we do not send.)
+        return message_h in self.send_message_hs
+    def on_nearcast_record(self, record):
+        if record.message_h not in self.send_message_hs:
+            return
+        if record.cog_h == self.spin_h:
+            # came in over the bridge
+            return
+        if self.ring_send == None:
+            return
+        try:
+            o = self.codec.encode(
+                record=record,
+                sip=self.batch,
+                o=self.batch_o)
+        except NearcastCodecOverflow:
+            if not self.batch_count:
+                raise Exception("Message [%s] is too large for the ring."%(
+                    record.message_h))
+            # (The codec writes nothing when it overflows.)
+            self._flush()
+            self.on_nearcast_record(
+                record=record)
+            return
+        self.batch_o = o
+        self.batch_count += 1
+        self.count_sent_messages += 1
+    def orb_close(self):
+        pass
+    #
+    def _flush(self):
+        if not self.batch_count:
+            return
+        ring_send = self.ring_send
+        view = self.batch_view[:self.batch_o]
+        if self.pending or not ring_send.push(view):
+            if self.pending_bytes + self.batch_o > self.pending_max:
+                raise Exception("%s: ring is full, and %s bytes are waiting."%(
+                    self.spin_h, self.pending_bytes))
+            self.pending.append(bytes(view))
+            self.pending_bytes += self.batch_o
+            self._wait_for_space()
+        else:
+            ring_send.notify()
+        self.count_sent_batches += 1
+        self.batch_o = 0
+        self.batch_count = 0
+    def _push_pending(self):
+        ring_send = self.ring_send
+        pending = self.pending
+        count = 0
+        while pending:
+            if not ring_send.push(pending[0]):
+                break
+            self.pending_bytes -= len(pending.popleft())
+            count += 1
+        if count:
+            ring_send.notify()
+        if not pending and self.b_waiting_for_space:
+            self.engine.del_custom_fd_read(
+                fd=ring_send.space_fileno())
+            self.b_waiting_for_space = False
+    def _wait_for_space(self):
+        if self.b_waiting_for_space:
+            return
+        self.engine.add_custom_fd_read(
+            cfd_h='%s/space'%(self.spin_h),
+            fd=self.ring_send.space_fileno(),
+            cb_eng_custom_fd_read=self.cb_eng_space_fd_read)
+        self.b_waiting_for_space = True
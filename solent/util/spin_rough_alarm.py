@@ -27,9 +27,9 @@ class RailAlarmBooking:
         self.at_t = at_t
 
 class SpinRoughAlarm:
-    # In issues #119 and #121 we will be implementing various alarms in the
-    # engine. Here, I make no claim to do a good job of this. But I need an
-    # alarm
+    # Bookings are held as engine timers (see Engine.call_at). The engine
+    # keeps them in a heap and uses the next deadline to set its poll
+    # timeout, so this spin has nothing to do on each turn.
     def __init__(self, spin_h, engine):
         self.spin_h = spin_h
         self.engine = engine
@@ -37,8 +37,8 @@ class SpinRoughAlarm:
         self.cs_alarm_event = Ns()
         #
         self.pool_alarm_booking = pool_rail_class(RailAlarmBooking)
-        self.work = []
-        self.buffer = []
+        # timer_h vs rail_alarm_booking
+        self.work = {}
     def call_alarm_event(self, cb_alarm_event, zero_h, value, at_t):
         self.cs_alarm_event.zero_h = zero_h
         self.cs_alarm_event.value = value
@@ -46,28 +46,12 @@ class SpinRoughAlarm:
         cb_alarm_event(
             cs_alarm_event=self.cs_alarm_event)
     def eng_turn(self, activity):
-        now = self.engine.clock.now()
-        #
-        self.buffer.clear()
-        for (idx, rail_alarm_booking) in enumerate(self.work):
-            if rail_alarm_booking.at_t <= now:
-                self.buffer.append(idx)
-        #
-        idx_reduce = 0
-        for original_idx in self.buffer:
-            idx = original_idx - idx_reduce
-            idx_reduce += 1
-            #
-            rail_alarm_booking = self.work[idx]
-            self.call_alarm_event(
-                cb_alarm_event=rail_alarm_booking.cb_alarm_event,
-                zero_h=self.spin_h,
-                value=rail_alarm_booking.value,
-                at_t=rail_alarm_booking.at_t)
-            del self.work[idx]
-            self.pool_alarm_booking.put(rail_alarm_booking)
-    def eng_close(self):
         pass
+    def eng_close(self):
+        for timer_h in list(self.work.keys()):
+            self.engine.cancel_timer(
+                timer_h=timer_h)
+            self.pool_alarm_booking.put(self.work.pop(timer_h))
     def book_time(self, cb_alarm_event, value, at_t):
         rail_h = '%s/alarm_booking'%(self.spin_h)
         rail_alarm_booking = self.pool_alarm_booking.get(
@@ -75,5 +59,18 @@ class SpinRoughAlarm:
             cb_alarm_event=cb_alarm_event,
             value=value,
             at_t=at_t)
-        self.work.append(rail_alarm_booking)
-
+        timer_h = self.engine.call_at(
+            at_t=at_t,
+            cb_eng_timer=self.cb_eng_timer)
+        self.work[timer_h] = rail_alarm_booking
+    #
+    def cb_eng_timer(self, cs_eng_timer):
+        timer_h = cs_eng_timer.timer_h
+        #
+        rail_alarm_booking = self.work.pop(timer_h)
+        self.call_alarm_event(
+            cb_alarm_event=rail_alarm_booking.cb_alarm_event,
+            zero_h=self.spin_h,
+            value=rail_alarm_booking.value,
+            at_t=rail_alarm_booking.at_t)
+        self.pool_alarm_booking.put(rail_alarm_booking)
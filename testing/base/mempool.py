@@ -54,15 +54,154 @@ def should_get_and_return():
     mempool.free(
         sip=sip_b)
     assert 0 == mempool.ltotal
-    assert 2 == len(mempool.pool[101])
+    # (101 rounds up to the 128 class)
+    assert 2 == len(mempool.pool[128])
     #
     # check that it is issuing from the pool, not making unnecessary
     # allocations
     sip_c = mempool.alloc(101)
-    assert 1 == len(mempool.pool[101])
+    assert 1 == len(mempool.pool[128])
     #
     return True
 
+@test
+def should_share_size_classes_and_keep_size_apart_from_capacity():
+    mempool = Mempool()
+    sip_a = mempool.alloc(100)
+    assert (100, 128, 128) == (sip_a.size, sip_a.capacity, len(sip_a.arr))
+    assert 100 == len(sip_a)
+    assert 100 == len(sip_a.view())
+    mempool.free(
+        sip=sip_a)
+    # A different length in the same class reuses the same sip.
+    sip_b = mempool.alloc(70)
+    assert sip_b is sip_a
+    assert (70, 128) == (sip_b.size, sip_b.capacity)
+    mempool.free(
+        sip=sip_b)
+    #
+    # Larger than any class: exact, and not kept.
+    sip_c = mempool.alloc(100000)
+    assert 100000 == sip_c.capacity
+    mempool.free(
+        sip=sip_c)
+    assert 1 == mempool.count_oversize
+    assert 128 == mempool.get_retained_bytes()
+    assert 0 == mempool.ltotal
+    return True
+
+@test
+def should_cap_free_lists_and_trim():
+    mempool = Mempool(
+        size_classes=[16, 256],
+        free_cap=3)
+    sips = [mempool.alloc(10) for idx in range(5)]
+    for sip in sips:
+        mempool.free(
+            sip=sip)
+    assert 3 == len(mempool.pool[16])
+    assert 2 == mempool.count_dropped
+    #
+    sips = [mempool.alloc(200) for idx in range(3)]
+    for sip in sips:
+        mempool.free(
+            sip=sip)
+    assert 3 * 16 + 3 * 256 == mempool.get_retained_bytes()
+    #
+    # Since the start, up to 5 of class 16 and 3 of class 256 were lent at
+    # once, so trim_idle keeps everything. In the next period, only one
+    # 256 is needed.
+    assert 0 == mempool.trim_idle()
+    mempool.free(
+        sip=mempool.alloc(200))
+    assert 2 * 256 + 3 * 16 == mempool.trim_idle()
+    assert 1 == len(mempool.pool[256])
+    assert 0 == len(mempool.pool[16])
+    #
+    assert 256 == mempool.trim()
+    assert 0 == mempool.get_retained_bytes()
+    return True
+
+@test
+def should_count_allocs_and_frees_by_class():
+    mempool = Mempool(
+        size_classes=[16, 256])
+    sips = [mempool.alloc(10) for idx in range(4)]
+    big = mempool.alloc(100)
+    for sip in sips[:3]:
+        mempool.free(
+            sip=sip)
+    mempool.trim_idle()
+    # After trim_idle, peak still remembers the earlier high.
+    mempool.free(
+        sip=mempool.alloc(1000))
+    #
+    stats = mempool.get_stats()
+    assert 2 == stats['outstanding']
+    assert 6 == stats['allocs']
+    assert 4 == stats['frees']
+    assert 0 == stats['oversize_outstanding']
+    assert 1 == stats['oversize_allocs']
+    d_class = stats['classes'][16]
+    assert 1 == d_class['outstanding']
+    assert 4 == d_class['peak']
+    assert 3 == d_class['free']
+    assert (4, 3) == (d_class['allocs'], d_class['frees'])
+    assert (1, 1, 0) == (stats['classes'][256]['outstanding'],
+                         stats['classes'][256]['allocs'],
+                         stats['classes'][256]['frees'])
+    #
+    (alloc_rate, free_rate) = mempool.get_rates(
+        now=mempool.t_rates + 2.0)
+    assert (3.0, 2.0) == (alloc_rate, free_rate)
+    mempool.free(
+        sip=big)
+    (alloc_rate, free_rate) = mempool.get_rates(
+        now=mempool.t_rates + 1.0)
+    assert (0.0, 1.0) == (alloc_rate, free_rate)
+    return True
+
+def leaky_alloc(mempool):
+    return mempool.alloc(100)
+
+def tidy_clone(mempool, sip):
+    return mempool.clone(
+        sip=sip)
+
+@test
+def should_report_outstanding_sips_by_call_site():
+    mempool = Mempool()
+    # Not tracked: allocated before tracking was on.
+    early = mempool.alloc(10)
+    mempool.set_track_sites(True)
+    leaked = [leaky_alloc(mempool) for idx in range(3)]
+    copy = tidy_clone(mempool, leaked[0])
+    mempool.free(
+        sip=copy)
+    mempool.free(
+        sip=early)
+    held = mempool.alloc(20000)
+    #
+    report = mempool.get_leak_report()
+    assert 2 == len(report)
+    (entry_leaky, entry_held) = report
+    assert (3, 300) == (entry_leaky['count'], entry_leaky['bytes'])
+    assert 'leaky_alloc' in entry_leaky['site'][0]
+    assert (1, 20000) == (entry_held['count'], entry_held['bytes'])
+    assert 'should_report_outstanding' in entry_held['site'][0]
+    assert [] == mempool.get_leak_report(
+        min_age=60)
+    mempool.log_leak_report()
+    #
+    for sip in leaked:
+        mempool.free(
+            sip=sip)
+    mempool.free(
+        sip=held)
+    assert [] == mempool.get_leak_report()
+    assert 0 == mempool.ltotal
+    return True
+
 if __name__ == '__main__':
     run_tests()
 
@@ -0,0 +1,80 @@
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent.bench.suite import compare
+from solent.bench.suite import run_suite
+
+from solent import run_tests
+from solent import test
+
+def suite_of(d_results):
+    return {
+        'meta': {},
+        'results': d_results,
+    }
+
+@test
+def should_flag_regressions_in_the_direction_that_matters():
+    d_baseline = suite_of({
+        'echo': {
+            'round_trips_per_second': 1000.0,
+            'latency_p99': 0.001,
+            'mb_per_second': 100.0 },
+        'mempool': {
+            'ops_per_second': 1000.0 },
+    })
+    d_now = suite_of({
+        'echo': {
+            # slower: a regression
+            'round_trips_per_second': 800.0,
+            # higher latency: a regression
+            'latency_p99': 0.002,
+            # within the threshold
+            'mb_per_second': 95.0 },
+        # faster: fine
+        'mempool': {
+            'ops_per_second': 2000.0 },
+        # not in the baseline: skipped
+        'cgrid': {
+            'frames_per_second': 1.0 },
+    })
+    regressions = compare(
+        d_suite=d_now,
+        d_baseline=d_baseline,
+        threshold=0.1)
+    assert [ ('echo', 'latency_p99')
+           , ('echo', 'round_trips_per_second')
+           ] == [(name, metric) for (name, metric, _, _, _) in regressions]
+    (_, _, baseline_value, value, change) = regressions[1]
+    assert 1000.0 == baseline_value
+    assert 800.0 == value
+    assert -0.2 == round(change, 6)
+    return True
+
+@test
+def should_run_a_quick_suite():
+    d_suite = run_suite(
+        names=['mempool', 'cgrid'],
+        b_quick=True)
+    assert d_suite['meta']['b_quick']
+    assert set(['mempool', 'cgrid']) == set(d_suite['results'].keys())
+    assert d_suite['results']['mempool']['ops_per_second'] > 0
+    return True
+
+if __name__ == '__main__':
+    run_tests()
@@ -0,0 +1,606 @@
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent import Engine
+from solent import log
+from solent import run_tests
+from solent import test
+
+import socket
+import time
+
+MTU = 1500
+
+class SpinIdleServer:
+    def __init__(self, spin_h, engine):
+        self.spin_h = spin_h
+        self.engine = engine
+        #
+        self.server_sid = None
+        self.port = None
+        self.accept_sids = []
+    def eng_turn(self, activity):
+        pass
+    def eng_close(self):
+        pass
+    #
+    def start(self, addr, port, backlog=128):
+        self.engine.open_tcp_server(
+            addr=addr,
+            port=port,
+            cb_tcp_server_start=self.cb_tcp_server_start,
+            cb_tcp_server_stop=self.cb_tcp_server_stop,
+            cb_tcp_accept_connect=self.cb_tcp_accept_connect,
+            cb_tcp_accept_condrop=self.cb_tcp_accept_condrop,
+            cb_tcp_accept_recv=self.cb_tcp_accept_recv,
+            backlog=backlog)
+    #
+    def cb_tcp_server_start(self, cs_tcp_server_start):
+        self.server_sid = cs_tcp_server_start.server_sid
+        ms = self.engine._get_ms_for_sid(self.server_sid)
+        self.port = ms.sock.getsockname()[1]
+    def cb_tcp_server_stop(self, cs_tcp_server_stop):
+        self.server_sid = None
+    def cb_tcp_accept_connect(self, cs_tcp_accept_connect):
+        self.accept_sids.append(cs_tcp_accept_connect.accept_sid)
+    def cb_tcp_accept_condrop(self, cs_tcp_accept_condrop):
+        pass
+    def cb_tcp_accept_recv(self, cs_tcp_accept_recv):
+        pass
+
+@test
+def should_sleep_when_idle_with_listening_server():
+    '''
+    Regression benchmark. A listening server with no clients must leave the
+    engine idle: it should wait in the poller for default_timeout on each
+    turn, rather than spinning.
+    '''
+    engine = Engine(
+        mtu=MTU)
+    engine.set_default_timeout(0.1)
+    spin = engine.init_spin(
+        construct=SpinIdleServer)
+    spin.start(
+        addr='localhost',
+        port=0)
+    engine.cycle()
+    assert spin.server_sid != None
+    #
+    wall_duration = 0.6
+    turns = 0
+    timeout = 0
+    t_wall = time.time()
+    t_cpu = time.process_time()
+    while time.time() - t_wall < wall_duration:
+        timeout = engine.turn(
+            timeout=timeout)
+        turns += 1
+    cpu_used = time.process_time() - t_cpu
+    #
+    log('idle: %s turns, %.4fs cpu in %.2fs'%(turns, cpu_used, wall_duration))
+    assert turns < 20
+    assert cpu_used < wall_duration * 0.1
+    #
+    engine.close()
+    return True
+
+def connect_clients(port, count):
+    lst = []
+    for i in range(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.connect( ('127.0.0.1', port) )
+        lst.append(sock)
+    return lst
+
+@test
+def should_drain_accept_backlog_within_budget():
+    engine = Engine(
+        mtu=MTU)
+    engine.set_accept_budget(4)
+    spin = engine.init_spin(
+        construct=SpinIdleServer)
+    spin.start(
+        addr='127.0.0.1',
+        port=0,
+        backlog=16)
+    engine.cycle()
+    #
+    clients = connect_clients(
+        port=spin.port,
+        count=10)
+    #
+    # The first turn takes a full budget, and the rest follow.
+    engine.turn(
+        timeout=0.1)
+    assert 4 == len(spin.accept_sids)
+    engine.cycle()
+    assert 10 == len(spin.accept_sids)
+    #
+    for sock in clients:
+        sock.close()
+    engine.close()
+    return True
+
+class TimerReceiver:
+    def __init__(self):
+        self.fired = []
+    def cb_eng_timer(self, cs_eng_timer):
+        self.fired.append( (cs_eng_timer.timer_h, time.time()) )
+
+@test
+def should_fire_one_shot_timers_in_deadline_order():
+    engine = Engine(
+        mtu=MTU)
+    receiver = TimerReceiver()
+    now = engine.clock.now()
+    timer_b = engine.call_at(
+        at_t=now+0.02,
+        cb_eng_timer=receiver.cb_eng_timer)
+    timer_a = engine.call_at(
+        at_t=now+0.01,
+        cb_eng_timer=receiver.cb_eng_timer)
+    timer_c = engine.call_later(
+        delay=0.03,
+        cb_eng_timer=receiver.cb_eng_timer)
+    engine.cancel_timer(
+        timer_h=timer_c)
+    #
+    timeout = 0
+    while time.time() - now < 0.1:
+        timeout = engine.turn(
+            timeout=timeout)
+    assert [timer_a, timer_b] == [tpl[0] for tpl in receiver.fired]
+    assert None == engine.get_next_timer_deadline()
+    #
+    engine.close()
+    return True
+
+@test
+def should_wake_for_timers_without_polling():
+    engine = Engine(
+        mtu=MTU)
+    # If the timer did not drive the poll timeout, we would sleep for this
+    # long before noticing that it was due.
+    engine.set_default_timeout(5.0)
+    receiver = TimerReceiver()
+    timer_h = engine.call_every(
+        period=0.05,
+        cb_eng_timer=receiver.cb_eng_timer)
+    #
+    t_start = time.time()
+    turns = 0
+    timeout = 0
+    while len(receiver.fired) < 4:
+        timeout = engine.turn(
+            timeout=timeout)
+        turns += 1
+    duration = time.time() - t_start
+    assert duration < 0.5
+    assert turns < 20
+    #
+    engine.cancel_timer(
+        timer_h=timer_h)
+    assert None == engine.get_next_timer_deadline()
+    #
+    engine.close()
+    return True
+
+@test
+def should_keep_due_timers_when_a_timer_callback_raises():
+    engine = Engine(
+        mtu=MTU)
+    receiver = TimerReceiver()
+    def cb_raise(cs_eng_timer):
+        raise Exception('timer callback failed')
+    now = engine.clock.now()
+    timer_a = engine.call_at(
+        at_t=now-0.03,
+        cb_eng_timer=receiver.cb_eng_timer)
+    engine.call_at(
+        at_t=now-0.02,
+        cb_eng_timer=cb_raise)
+    timer_c = engine.call_at(
+        at_t=now-0.01,
+        cb_eng_timer=receiver.cb_eng_timer)
+    timer_d = engine.call_at(
+        at_t=now-0.01,
+        cb_eng_timer=receiver.cb_eng_timer)
+    b_raised = False
+    try:
+        engine.turn(
+            timeout=0)
+    except Exception:
+        b_raised = True
+    assert b_raised
+    assert [timer_a] == [tpl[0] for tpl in receiver.fired]
+    #
+    # The timers behind the failure are still booked. One can be
+    # cancelled, and the other fires on the next turn.
+    engine.cancel_timer(
+        timer_h=timer_d)
+    assert 1 == engine.timer_count_dead
+    engine.turn(
+        timeout=0)
+    assert [timer_a, timer_c] == [tpl[0] for tpl in receiver.fired]
+    assert None == engine.get_next_timer_deadline()
+    assert 0 == engine.timer_count_dead
+    #
+    engine.close()
+    return True
+
+@test
+def should_count_dead_timers_when_a_callback_cancels_due_timers():
+    engine = Engine(
+        mtu=MTU)
+    receiver = TimerReceiver()
+    now = engine.clock.now()
+    timer_hs = []
+    def cb_cancel_the_rest(cs_eng_timer):
+        for timer_h in timer_hs:
+            engine.cancel_timer(
+                timer_h=timer_h)
+    engine.call_at(
+        at_t=now-0.01,
+        cb_eng_timer=cb_cancel_the_rest)
+    # Enough that cancelling them would trigger compaction, if they were
+    # counted as dead entries in the heap.
+    for idx in range(100):
+        timer_hs.append(engine.call_at(
+            at_t=now,
+            cb_eng_timer=receiver.cb_eng_timer))
+    # One that is not due yet, so the heap is not empty.
+    timer_later = engine.call_later(
+        delay=60,
+        cb_eng_timer=receiver.cb_eng_timer)
+    engine.turn(
+        timeout=0)
+    assert [] == receiver.fired
+    assert 0 == engine.timer_count_dead
+    assert 1 == len(engine.timer_heap)
+    #
+    engine.cancel_timer(
+        timer_h=timer_later)
+    assert 1 == engine.timer_count_dead
+    assert None == engine.get_next_timer_deadline()
+    assert 0 == engine.timer_count_dead
+    #
+    engine.close()
+    return True
+
+class SpinLoopbackPair:
+    def __init__(self, spin_h, engine):
+        self.spin_h = spin_h
+        self.engine = engine
+        #
+        self.server_sid = None
+        self.port = None
+        self.accept_sid = None
+        self.client_sid = None
+        self.recv = []
+        self.recv_types = set()
+        self.backpressure = []
+    def eng_turn(self, activity):
+        pass
+    def eng_close(self):
+        pass
+    #
+    def start(self):
+        self.engine.open_tcp_server(
+            addr='127.0.0.1',
+            port=0,
+            cb_tcp_server_start=self.cb_tcp_server_start,
+            cb_tcp_server_stop=self.cb_tcp_server_stop,
+            cb_tcp_accept_connect=self.cb_tcp_accept_connect,
+            cb_tcp_accept_condrop=self.cb_tcp_accept_condrop,
+            cb_tcp_accept_recv=self.cb_tcp_accept_recv,
+            cb_tcp_accept_pause=self.cb_tcp_accept_pause,
+            cb_tcp_accept_resume=self.cb_tcp_accept_resume)
+        self.engine.open_tcp_client(
+            addr='127.0.0.1',
+            port=self.port,
+            cb_tcp_client_connect=self.cb_tcp_client_connect,
+            cb_tcp_client_condrop=self.cb_tcp_client_condrop,
+            cb_tcp_client_recv=self.cb_tcp_client_recv,
+            cb_tcp_client_pause=self.cb_tcp_client_pause,
+            cb_tcp_client_resume=self.cb_tcp_client_resume)
+        while self.client_sid == None or self.accept_sid == None:
+            self.engine.turn(
+                timeout=0.05)
+    def recv_len(self):
+        return sum([len(bb) for bb in self.recv])
+    #
+    def cb_tcp_server_start(self, cs_tcp_server_start):
+        self.server_sid = cs_tcp_server_start.server_sid
+        ms = self.engine._get_ms_for_sid(self.server_sid)
+        self.port = ms.sock.getsockname()[1]
+    def cb_tcp_server_stop(self, cs_tcp_server_stop):
+        self.server_sid = None
+    def cb_tcp_accept_connect(self, cs_tcp_accept_connect):
+        self.accept_sid = cs_tcp_accept_connect.accept_sid
+    def cb_tcp_accept_condrop(self, cs_tcp_accept_condrop):
+        self.accept_sid = None
+    def cb_tcp_accept_recv(self, cs_tcp_accept_recv):
+        bb = cs_tcp_accept_recv.bb
+        #
+        self.recv_types.add(type(bb))
+        self.recv.append(bytes(bb))
+    def cb_tcp_accept_pause(self, cs_tcp_accept_pause):
+        self.backpressure.append(
+            ('accept_pause', cs_tcp_accept_pause.send_queue_bytes))
+    def cb_tcp_accept_resume(self, cs_tcp_accept_resume):
+        self.backpressure.append(
+            ('accept_resume', cs_tcp_accept_resume.send_queue_bytes))
+    def cb_tcp_client_pause(self, cs_tcp_client_pause):
+        self.backpressure.append(
+            ('client_pause', cs_tcp_client_pause.send_queue_bytes))
+    def cb_tcp_client_resume(self, cs_tcp_client_resume):
+        self.backpressure.append(
+            ('client_resume', cs_tcp_client_resume.send_queue_bytes))
+    def cb_tcp_client_connect(self, cs_tcp_client_connect):
+        self.client_sid = cs_tcp_client_connect.client_sid
+    def cb_tcp_client_condrop(self, cs_tcp_client_condrop):
+        self.client_sid = None
+    def cb_tcp_client_recv(self, cs_tcp_client_recv):
+        pass
+
+@test
+def should_stream_queued_sends_intact_through_partial_writes():
+    engine = Engine(
+        mtu=MTU)
+    spin = engine.init_spin(
+        construct=SpinLoopbackPair)
+    spin.start()
+    #
+    # Queue far more than the kernel will take in one go, so that the
+    # client sees short writes. Each message is distinct so that we would
+    # notice if anything were dropped, duplicated or reordered.
+    sb = []
+    for i in range(4000):
+        bb = bytes('%08d'%i, 'ascii') * 125
+        sb.append(bb)
+        engine.send(
+            sid=spin.client_sid,
+            bb=bb)
+    expected = b''.join(sb)
+    #
+    while spin.recv_len() < len(expected):
+        engine.turn(
+            timeout=0.1)
+    assert expected == b''.join(spin.recv)
+    ms = engine._get_ms_for_sid(spin.client_sid)
+    assert 0 == len(ms.send_buf)
+    assert 0 == ms.send_offset
+    #
+    engine.close()
+    return True
+
+@test
+def should_deliver_recv_views_within_budget():
+    engine = Engine(
+        mtu=MTU)
+    engine.enable_recv_views()
+    engine.set_recv_budget(4 * MTU)
+    spin = engine.init_spin(
+        construct=SpinLoopbackPair)
+    spin.start()
+    #
+    bb = bytes(MTU)
+    for i in range(20):
+        engine.send(
+            sid=spin.client_sid,
+            bb=bb)
+    # Let the client flush everything, without the accept side reading.
+    client_ms = engine._get_ms_for_sid(spin.client_sid)
+    while client_ms.send_buf:
+        client_ms.manage_writable()
+    time.sleep(0.05)
+    #
+    # One read pass on the accept side takes no more than its budget.
+    accept_ms = engine._get_ms_for_sid(spin.accept_sid)
+    accept_ms.manage_readable()
+    assert 4 * MTU == spin.recv_len()
+    assert set([memoryview]) == spin.recv_types
+    #
+    while spin.recv_len() < 20 * MTU:
+        engine.turn(
+            timeout=0.1)
+    #
+    engine.close()
+    return True
+
+@test
+def should_send_sips_and_views_without_copying():
+    engine = Engine(
+        mtu=MTU)
+    spin = engine.init_spin(
+        construct=SpinLoopbackPair)
+    spin.start()
+    #
+    sip = engine.mempool.alloc(
+        size=3)
+    sip.arr[:3] = b'abc'
+    engine.send_sip(
+        sid=spin.client_sid,
+        sip=sip)
+    engine.send_view(
+        sid=spin.client_sid,
+        mv=b'def')
+    engine.send_view(
+        sid=spin.client_sid,
+        mv=memoryview(bytearray(b'--ghi--'))[2:5])
+    #
+    # Ownership of the sip has passed to the engine, and no copies of it
+    # were made.
+    ms = engine._get_ms_for_sid(spin.client_sid)
+    assert ms.send_buf[0][0].obj is sip.arr
+    assert 1 == engine.mempool.ltotal
+    #
+    while spin.recv_len() < 9:
+        engine.turn(
+            timeout=0.1)
+    assert b'abcdefghi' == b''.join(spin.recv)
+    #
+    # The engine has returned the sip to the pool
+    assert 0 == engine.mempool.ltotal
+    #
+    engine.close()
+    return True
+
+@test
+def should_send_payloads_larger_than_mtu_on_streams():
+    engine = Engine(
+        mtu=MTU)
+    spin = engine.init_spin(
+        construct=SpinLoopbackPair)
+    spin.start()
+    #
+    # One immutable payload, and one mutable one that we scribble over
+    # after handing it to send.
+    bb_large = bytes(range(256)) * 16000
+    arr_large = bytearray(b'x' * (MTU * 3 + 7))
+    engine.send(
+        sid=spin.client_sid,
+        bb=bb_large)
+    engine.send(
+        sid=spin.client_sid,
+        bb=arr_large)
+    arr_large[:] = b'y' * len(arr_large)
+    #
+    # Neither of these should have gone through the mempool.
+    assert 0 == engine.mempool.ltotal
+    #
+    expected = bb_large + b'x' * (MTU * 3 + 7)
+    while spin.recv_len() < len(expected):
+        engine.turn(
+            timeout=0.1)
+    assert expected == b''.join(spin.recv)
+    #
+    engine.close()
+    return True
+
+@test
+def should_signal_pause_and_resume_at_send_watermarks():
+    engine = Engine(
+        mtu=MTU)
+    engine.set_send_watermarks(
+        high=8 * MTU,
+        low=2 * MTU)
+    spin = engine.init_spin(
+        construct=SpinLoopbackPair)
+    spin.start()
+    #
+    # A producer that stops when it is told to.
+    bb = bytes(MTU)
+    count_sent = 0
+    while not spin.backpressure:
+        engine.send(
+            sid=spin.client_sid,
+            bb=bb)
+        count_sent += 1
+    assert [('client_pause', 8 * MTU)] == spin.backpressure
+    assert 8 == count_sent
+    assert 8 * MTU == engine.get_send_queue_bytes(spin.client_sid)
+    #
+    # Once the queue drains, it is told to resume.
+    while len(spin.backpressure) < 2:
+        engine.turn(
+            timeout=0.1)
+    (name, send_queue_bytes) = spin.backpressure[1]
+    assert 'client_resume' == name
+    assert send_queue_bytes <= 2 * MTU
+    #
+    # Accepted connections get the same treatment, with per-sid settings.
+    engine.set_sid_send_watermarks(
+        sid=spin.accept_sid,
+        high=3 * MTU,
+        low=MTU)
+    for i in range(3):
+        engine.send(
+            sid=spin.accept_sid,
+            bb=bb)
+    assert ('accept_pause', 3 * MTU) == spin.backpressure[2]
+    while len(spin.backpressure) < 4:
+        engine.turn(
+            timeout=0.1)
+    assert 'accept_resume' == spin.backpressure[3][0]
+    assert 0 == engine.get_send_queue_bytes(spin.accept_sid)
+    #
+    engine.close()
+    return True
+
+@test
+def should_record_turn_phases_when_instrumented():
+    engine = Engine(
+        mtu=MTU)
+    engine.enable_instrumentation()
+    spin = engine.init_spin(
+        construct=SpinLoopbackPair)
+    spin.start()
+    engine.call_later(
+        delay=0,
+        cb_eng_timer=TimerReceiver().cb_eng_timer)
+    engine.send(
+        sid=spin.client_sid,
+        bb=b'abc')
+    while spin.recv_len() < 3:
+        engine.turn(
+            timeout=0.1)
+    #
+    d = engine.get_instrumentation_snapshot(
+        b_reset=True)
+    for name in [ 'phase/turn', 'phase/timers', 'phase/spins', 'phase/poll'
+                , 'phase/rlist', 'phase/wlist', 'spin/%s'%(spin.spin_h)
+                , 'readable/tcp_accept', 'writable/tcp_client'
+                , 'callback/timer'
+                ]:
+        assert name in d, name
+        assert d[name]['count'] > 0, name
+    assert d['phase/turn']['max'] >= d['phase/poll']['max']
+    #
+    # The reset cleared the counts
+    d = engine.get_instrumentation_snapshot()
+    assert 0 == d['phase/turn']['count']
+    #
+    engine.close()
+    return True
+
+@test
+def should_trim_the_mempool_on_a_timer():
+    engine = Engine(
+        mtu=MTU)
+    mempool = engine.mempool
+    sips = [mempool.alloc(size=100) for idx in range(10)]
+    for sip in sips:
+        mempool.free(
+            sip=sip)
+    assert 10 * 128 == mempool.get_retained_bytes()
+    engine.set_mempool_trim_period(0.02)
+    # The first period saw all ten lent at once, so keeps them. The second
+    # did not need any.
+    t_give_up = time.time() + 2
+    while mempool.get_retained_bytes() and time.time() < t_give_up:
+        engine.turn(
+            timeout=0.01)
+    assert 0 == mempool.get_retained_bytes()
+    engine.set_mempool_trim_period(None)
+    assert None == engine.get_next_timer_deadline()
+    engine.close()
+    return True
+
+if __name__ == '__main__':
+    run_tests()
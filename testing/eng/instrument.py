@@ -0,0 +1,79 @@
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent.eng.instrument import COUNT_BUCKETS
+from solent.eng.instrument import Histogram
+from solent.eng.instrument import instrument_new
+from solent.eng.instrument import sample_percentile
+
+from solent import run_tests
+from solent import test
+
+@test
+def should_bucket_durations_by_power_of_two():
+    histogram = Histogram()
+    histogram.record(0.0000005) # under 1us
+    histogram.record(0.000003)  # 3us: [2us, 4us)
+    histogram.record(0.000003)
+    histogram.record(1000.0)    # beyond the last bucket
+    #
+    assert 1 == histogram.buckets[0]
+    assert 2 == histogram.buckets[2]
+    assert 1 == histogram.buckets[COUNT_BUCKETS-1]
+    assert 4 == histogram.count
+    assert 1000.0 == histogram.max
+    #
+    d = histogram.snapshot()
+    assert 4 == d['count']
+    assert 0.000004 == d['p50']
+    assert 1000.0 == d['p999']
+    assert [ [0.000001, 1], [0.000004, 2], [(1<<(COUNT_BUCKETS-1))/1e6, 1] ] \
+        == d['buckets']
+    #
+    histogram.reset()
+    assert 0 == histogram.count
+    assert 0.0 == histogram.snapshot()['p99']
+    return True
+
+@test
+def should_snapshot_and_reset_by_name():
+    instrument = instrument_new()
+    instrument.record(('phase', 'poll'), 0.01)
+    instrument.record(('spin', 'alpha'), 0.001)
+    instrument.record(('spin', 'alpha'), 0.002)
+    #
+    d = instrument.snapshot()
+    assert set(['phase/poll', 'spin/alpha']) == set(d.keys())
+    assert 2 == d['spin/alpha']['count']
+    #
+    instrument.reset()
+    d = instrument.snapshot()
+    assert 0 == d['spin/alpha']['count']
+    return True
+
+@test
+def should_take_exact_percentiles_from_samples():
+    samples = sorted([0.000130, 0.000100, 0.000120, 0.000110, 0.000900])
+    assert 0.000120 == sample_percentile(samples, 0.5)
+    assert 0.000900 == sample_percentile(samples, 0.99)
+    assert 0.000100 == sample_percentile(samples, 0.0)
+    assert 0.0 == sample_percentile([], 0.5)
+    return True
+
+if __name__ == '__main__':
+    run_tests()
@@ -0,0 +1,180 @@
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent import Mempool
+from solent import ref_create
+from solent import ref_lookup
+from solent import run_tests
+from solent import test
+from solent.base.sip import Sip
+from solent.eng.nearcast_schema import init_nearcast_schema
+
+I_NEARCAST_TYPED = '''
+    i message h
+        i field h t
+
+    message init
+    message person
+        field h vs
+        field age u1
+        field height u2
+        field visits u4
+        field balance u8
+        field photo bytes
+        field doc_ref ref
+    message tick
+        field n u4
+'''
+
+I_NEARCAST_UNTYPED = '''
+    i message h
+        i field h
+
+    message tick
+        field n
+'''
+
+@test
+def should_round_trip_typed_messages():
+    schema = init_nearcast_schema(
+        i_nearcast=I_NEARCAST_TYPED)
+    codec = schema.get_codec()
+    sip = Sip(
+        size=200)
+    doc_ref = ref_create(b'document')
+    #
+    rec_person = schema.get_record_class('person')(
+        cog_h='cog_a',
+        h='pé',
+        age=200,
+        height=65000,
+        visits=4000000000,
+        balance=2**64 - 1,
+        photo=b'\x00\x01\xff',
+        doc_ref=doc_ref)
+    rec_init = schema.get_record_class('init')(
+        cog_h='cog_a')
+    o = codec.encode(
+        record=rec_person,
+        sip=sip)
+    # id 2, h 2+3, age 1, height 2, visits 4, balance 8, photo 2+3, ref 8
+    assert o == 35
+    o = codec.encode(
+        record=rec_init,
+        sip=sip,
+        o=o)
+    assert o == 37
+    #
+    (record, o) = codec.decode(
+        sip=sip,
+        cog_h='cog_b')
+    assert record.message_h == 'person'
+    assert record.cog_h == 'cog_b'
+    assert record.args() == rec_person.args()
+    assert ref_lookup(record.doc_ref) == b'document'
+    (record, o) = codec.decode_bytes(
+        bb=bytes(sip.arr[:37]),
+        o=o)
+    assert record.message_h == 'init'
+    assert o == 37
+    return True
+
+@test
+def should_refuse_to_overflow_or_underflow():
+    schema = init_nearcast_schema(
+        i_nearcast=I_NEARCAST_TYPED)
+    codec = schema.get_codec()
+    sip = Sip(
+        size=8)
+    rec_tick = schema.get_record_class('tick')(
+        cog_h='cog_a',
+        n=7)
+    b_error = False
+    try:
+        codec.encode(
+            record=rec_tick,
+            sip=sip,
+            o=4)
+    except Exception as e:
+        b_error = 'needs 6 bytes' in str(e)
+    assert b_error
+    #
+    codec.encode(
+        record=rec_tick,
+        sip=sip)
+    b_error = False
+    try:
+        codec.decode_bytes(
+            bb=bytes(sip.arr[:4]))
+    except Exception as e:
+        b_error = 'Decoding [tick]' in str(e)
+    assert b_error
+    return True
+
+@test
+def should_decode_only_the_used_part_of_a_pooled_sip():
+    schema = init_nearcast_schema(
+        i_nearcast=I_NEARCAST_TYPED)
+    codec = schema.get_codec()
+    mempool = Mempool()
+    sip = mempool.alloc(
+        size=64)
+    rec_tick = schema.get_record_class('tick')(
+        cog_h='cog_a',
+        n=7)
+    codec.encode(
+        record=rec_tick,
+        sip=sip,
+        o=2)
+    mempool.free(sip)
+    # The same buffer comes back, with the old message still past size.
+    sip = mempool.alloc(
+        size=4)
+    assert (4, 64) == (sip.size, sip.capacity)
+    b_error = False
+    try:
+        codec.decode(
+            sip=sip,
+            o=2)
+    except Exception as e:
+        b_error = 'Decoding [tick]' in str(e)
+    assert b_error
+    return True
+
+@test
+def should_need_types_for_a_codec():
+    schema = init_nearcast_schema(
+        i_nearcast=I_NEARCAST_UNTYPED)
+    b_error = False
+    try:
+        schema.get_codec()
+    except Exception as e:
+        b_error = 'no field types' in str(e)
+    assert b_error
+    #
+    b_error = False
+    try:
+        init_nearcast_schema(
+            i_nearcast=I_NEARCAST_TYPED.replace('u4', 'u3'))
+    except Exception as e:
+        b_error = 'Unknown type [u3]' in str(e)
+    assert b_error
+    return True
+
+if __name__ == '__main__':
+    run_tests()
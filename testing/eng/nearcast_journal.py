@@ -0,0 +1,241 @@
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent.eng.nearcast_journal import journal_segment_paths
+from solent.eng.nearcast_journal import nearcast_journal_read
+
+from solent import Engine
+from solent import run_tests
+from solent import test
+
+import os
+import shutil
+import tempfile
+import time
+
+MTU = 1500
+
+I_NEARCAST = '''
+    i message h
+        i field h t
+
+    message greet
+        field name vs
+        field count u8
+    message tick
+        field n u4
+'''
+
+class CogGreeter:
+    def __init__(self, cog_h, orb, engine):
+        self.cog_h = cog_h
+        self.orb = orb
+        self.engine = engine
+    def on_tick(self, n):
+        if n % 10 == 0:
+            self.nearcast.greet(
+                name='tick %s é'%(n),
+                count=2**40 + n)
+
+def write_journal(path, count_ticks, rotate_bytes):
+    engine = Engine(
+        mtu=MTU)
+    orb = engine.init_orb(
+        i_nearcast=I_NEARCAST)
+    orb.init_cog(CogGreeter)
+    bridge = orb.init_autobridge()
+    snoop = orb.add_journal_snoop(
+        path=path,
+        rotate_bytes=rotate_bytes)
+    for n in range(count_ticks):
+        bridge.nc_tick(
+            n=n)
+    engine.cycle()
+    engine.close()
+    return snoop
+
+@test
+def should_journal_exact_values_across_rotated_segments():
+    tdir = tempfile.mkdtemp()
+    try:
+        path = os.sep.join( [tdir, 'nc.journal'] )
+        snoop = write_journal(
+            path=path,
+            count_ticks=100,
+            rotate_bytes=512)
+        assert 110 == snoop.count_messages
+        assert len(journal_segment_paths(path)) > 2
+        #
+        engine = Engine(
+            mtu=MTU)
+        orb = engine.init_orb(
+            i_nearcast=I_NEARCAST)
+        lst = list(nearcast_journal_read(
+            path=path,
+            nearcast_schema=orb.nearcast_schema))
+        engine.close()
+        assert 110 == len(lst)
+        (t_ns, record) = lst[0]
+        assert ('tick', 'BridgeFoundation', (0,)) == (
+            record.message_h, record.cog_h, record.args())
+        # (The ticks were all queued before the first greet.)
+        (t_ns, record) = lst[100]
+        assert ('greet', 'CogGreeter', ('tick 0 é', 2**40)) == (
+            record.message_h, record.cog_h, record.args())
+        times = [t_ns for (t_ns, _) in lst]
+        assert times == sorted(times)
+    finally:
+        shutil.rmtree(tdir)
+    return True
+
+@test
+def should_continue_after_a_restart_and_stop_at_a_cut_off_tail():
+    tdir = tempfile.mkdtemp()
+    try:
+        path = os.sep.join( [tdir, 'nc.journal'] )
+        write_journal(
+            path=path,
+            count_ticks=5,
+            rotate_bytes=10**6)
+        write_journal(
+            path=path,
+            count_ticks=5,
+            rotate_bytes=10**6)
+        segment_paths = journal_segment_paths(path)
+        assert 2 == len(segment_paths)
+        # As if the process had died part-way through a write.
+        f_ptr = open(segment_paths[-1], 'ab')
+        f_ptr.write(b'\x00\x00\x00\x40\x00\x00')
+        f_ptr.close()
+        #
+        engine = Engine(
+            mtu=MTU)
+        orb = engine.init_orb(
+            i_nearcast=I_NEARCAST)
+        lst = list(nearcast_journal_read(
+            path=path,
+            nearcast_schema=orb.nearcast_schema))
+        engine.close()
+        assert 12 == len(lst)
+    finally:
+        shutil.rmtree(tdir)
+    return True
+
+@test
+def should_not_reuse_a_segment_number_after_old_segments_go():
+    tdir = tempfile.mkdtemp()
+    try:
+        path = os.sep.join( [tdir, 'nc.journal'] )
+        for n in range(3):
+            write_journal(
+                path=path,
+                count_ticks=5,
+                rotate_bytes=10**6)
+        # As if old segments had been cleared away.
+        segment_paths = journal_segment_paths(path)
+        os.remove(segment_paths[0])
+        os.remove(segment_paths[1])
+        write_journal(
+            path=path,
+            count_ticks=10,
+            rotate_bytes=10**6)
+        assert ['nc.journal.000002', 'nc.journal.000003'] == [
+            os.path.basename(p) for p in journal_segment_paths(path)]
+        #
+        engine = Engine(
+            mtu=MTU)
+        orb = engine.init_orb(
+            i_nearcast=I_NEARCAST)
+        lst = list(nearcast_journal_read(
+            path=path,
+            nearcast_schema=orb.nearcast_schema))
+        engine.close()
+        assert 6 + 11 == len(lst)
+        times = [t_ns for (t_ns, _) in lst]
+        assert times == sorted(times)
+    finally:
+        shutil.rmtree(tdir)
+    return True
+
+@test
+def should_flush_an_idle_journal_from_a_timer():
+    tdir = tempfile.mkdtemp()
+    try:
+        path = os.sep.join( [tdir, 'nc.journal'] )
+        engine = Engine(
+            mtu=MTU)
+        orb = engine.init_orb(
+            i_nearcast=I_NEARCAST)
+        bridge = orb.init_autobridge()
+        orb.add_journal_snoop(
+            path=path,
+            flush_seconds=0.05)
+        bridge.nc_tick(
+            n=1)
+        engine.cycle()
+        (segment_path,) = journal_segment_paths(path)
+        # Still in the file buffer.
+        assert 0 == os.path.getsize(segment_path)
+        #
+        # No more messages arrive, but the timer flushes it.
+        t_start = time.time()
+        timeout = 0
+        while time.time() - t_start < 0.2:
+            timeout = engine.turn(
+                timeout=timeout)
+        assert 0 < os.path.getsize(segment_path)
+        lst = list(nearcast_journal_read(
+            path=path,
+            nearcast_schema=orb.nearcast_schema))
+        assert 1 == len(lst)
+        #
+        engine.close()
+        assert None == engine.get_next_timer_deadline()
+    finally:
+        shutil.rmtree(tdir)
+    return True
+
+@test
+def should_refuse_to_journal_ref_fields():
+    engine = Engine(
+        mtu=MTU)
+    orb = engine.init_orb(
+        i_nearcast='''
+            i message h
+                i field h t
+
+            message blob
+                field r ref
+        ''')
+    tdir = tempfile.mkdtemp()
+    try:
+        path = os.sep.join( [tdir, 'nc.journal'] )
+        try:
+            orb.add_journal_snoop(
+                path=path)
+            raise Exception("Should have refused.")
+        except Exception as e:
+            assert 'ref field' in str(e)
+        assert [] == journal_segment_paths(path)
+    finally:
+        shutil.rmtree(tdir)
+        engine.close()
+    return True
+
+if __name__ == '__main__':
+    run_tests()
@@ -16,11 +16,17 @@
 # You should have received a copy of the GNU General Public License along with
 # Solent. If not, see <http://www.gnu.org/licenses/>.
 
+from solent.eng.activity import activity_new
+
 from solent import run_tests
 from solent import test
 
 from fake import FakeEngine
 
+import os
+import shutil
+import tempfile
+
 I_NEARCAST_EXAMPLE = '''
     i message h
         i field h
@@ -48,6 +54,465 @@ def should_construct():
     #
     return True
 
+class TrackOrganisations:
+    def __init__(self, orb):
+        self.orb = orb
+        #
+        self.received = []
+    def on_organisation(self, h, name, address):
+        self.received.append( ('track', h) )
+
+def make_cog_class(name, received, message_hs):
+    'Cog class that records the named messages into received.'
+    def fn_init(self, cog_h, orb, engine):
+        self.cog_h = cog_h
+        self.orb = orb
+        self.engine = engine
+    d = {'__init__': fn_init}
+    if 'organisation' in message_hs:
+        def on_organisation(self, h, name, address):
+            received.append( (self.cog_h, h) )
+        d['on_organisation'] = on_organisation
+    if 'person' in message_hs:
+        def on_person(self, h, firstname, lastname, age, organisation_h):
+            received.append( (self.cog_h, h) )
+        d['on_person'] = on_person
+    return type(name, (object,), d)
+
+@test
+def should_dispatch_only_to_interested_handlers_in_order():
+    engine = FakeEngine()
+    orb = engine.init_orb(
+        i_nearcast=I_NEARCAST_EXAMPLE)
+    received = []
+    orb.init_cog(make_cog_class('CogA', received, ['organisation']))
+    orb.init_cog(make_cog_class('CogB', received, ['person']))
+    track = orb.track(TrackOrganisations)
+    track.received = received
+    bridge = orb.init_autobridge()
+    #
+    bridge.nc_organisation(
+        h='o1',
+        name='n',
+        address='a')
+    bridge.nc_person(
+        h='p1',
+        firstname='f',
+        lastname='l',
+        age=1,
+        organisation_h='o1')
+    orb.distribute()
+    # Tracks come before cogs.
+    assert [('track', 'o1'), ('CogA', 'o1'), ('CogB', 'p1')] == received
+    #
+    # A cog added later is wired in from the next message on.
+    del received[:]
+    orb.init_cog(make_cog_class('CogC', received, ['organisation', 'person']))
+    bridge.nc_organisation(
+        h='o2',
+        name='n',
+        address='a')
+    orb.distribute()
+    assert [('track', 'o2'), ('CogA', 'o2'), ('CogC', 'o2')] == received
+    return True
+
+@test
+def should_queue_slotted_records_and_validate_only_in_debug():
+    engine = FakeEngine()
+    orb = engine.init_orb(
+        i_nearcast=I_NEARCAST_EXAMPLE)
+    received = []
+    orb.init_cog(make_cog_class('CogA', received, ['organisation']))
+    bridge = orb.init_autobridge()
+    #
+    bridge.nc_organisation(
+        h='o1',
+        name='n',
+        address='a')
+    record = orb.ready_to_nearcast[0]
+    assert record.message_h == 'organisation'
+    assert record.cog_h == 'BridgeFoundation'
+    assert record.args() == ('o1', 'n', 'a')
+    assert record.to_dict() == {'h': 'o1', 'name': 'n', 'address': 'a'}
+    assert not hasattr(record, '__dict__')
+    orb.distribute()
+    assert [('CogA', 'o1')] == received
+    #
+    # Arity is enforced by the generated signature.
+    b_error = False
+    try:
+        bridge.nearcast.organisation('o2', 'n')
+    except TypeError:
+        b_error = True
+    assert b_error
+    #
+    # The direct route checks the fields in full only in debug.
+    b_error = False
+    try:
+        orb.nearcast(bridge, 'organisation', h='o3', name='n', addr='a')
+    except TypeError:
+        b_error = True
+    assert b_error
+    orb.debug_nearcast_on()
+    b_error = False
+    try:
+        orb.nearcast(bridge, 'organisation', h='o3', name='n', addr='a')
+    except Exception as e:
+        b_error = 'inconsistent fields' in str(e)
+    assert b_error
+    bridge.nc_organisation(
+        h='o4',
+        name='n',
+        address='a')
+    orb.distribute()
+    assert [('CogA', 'o1'), ('CogA', 'o4')] == received
+    return True
+
+@test
+def should_reject_reserved_field_names():
+    engine = FakeEngine()
+    b_error = False
+    try:
+        engine.init_orb(
+            i_nearcast='''
+                i message h
+                i field h
+                message bad
+                    field cog_h
+            ''')
+    except Exception as e:
+        b_error = 'reserved' in str(e)
+    assert b_error
+    return True
+
+I_NEARCAST_CONFLATE = '''
+    i message h
+        i field h
+        i conflate h
+
+    message price
+        field instrument
+        field value
+        conflate instrument
+    message trade
+        field instrument
+'''
+
+class CogPriceWatcher:
+    def __init__(self, cog_h, orb, engine):
+        self.cog_h = cog_h
+        self.orb = orb
+        self.engine = engine
+        #
+        self.received = []
+    def on_price(self, instrument, value):
+        self.received.append( ('price', instrument, value) )
+    def on_trade(self, instrument):
+        self.received.append( ('trade', instrument) )
+
+@test
+def should_deliver_only_latest_conflated_message_per_key():
+    engine = FakeEngine()
+    orb = engine.init_orb(
+        i_nearcast=I_NEARCAST_CONFLATE)
+    cog = orb.init_cog(CogPriceWatcher)
+    bridge = orb.init_autobridge()
+    #
+    bridge.nc_price(
+        instrument='a',
+        value=1)
+    bridge.nc_price(
+        instrument='b',
+        value=2)
+    bridge.nc_trade(
+        instrument='a')
+    bridge.nc_price(
+        instrument='a',
+        value=3)
+    orb.distribute()
+    # The newest price for a takes the place of the one that was waiting,
+    # so it comes before the trade.
+    assert [ ('price', 'a', 3)
+           , ('price', 'b', 2)
+           , ('trade', 'a')
+           ] == cog.received
+    assert 1 == orb.count_conflated
+    #
+    # A burst on one key takes one place in the queue.
+    for idx in range(1000):
+        bridge.nc_price(
+            instrument='a',
+            value=idx)
+    assert 1 == len(orb.ready_to_nearcast)
+    del cog.received[:]
+    orb.distribute()
+    assert [('price', 'a', 999)] == cog.received
+    return True
+
+@test
+def should_not_starve_a_key_that_is_updated_every_turn():
+    engine = FakeEngine()
+    orb = engine.init_orb(
+        i_nearcast=I_NEARCAST_CONFLATE)
+    cog = orb.init_cog(CogPriceWatcher)
+    bridge = orb.init_autobridge()
+    # Each turn, more trades arrive than the budget lets through, and the
+    # price for a is updated. The backlog never clears.
+    budget = 10
+    for turn in range(20):
+        for idx in range(budget + 2):
+            bridge.nc_trade(
+                instrument='b')
+        bridge.nc_price(
+            instrument='a',
+            value=turn)
+        orb.distribute(
+            budget=budget)
+    prices = [tpl[2] for tpl in cog.received if tpl[0] == 'price']
+    # Each price waits only for what was queued ahead of its place (the
+    # queue depth, over the budget, in turns), and goes out with the value
+    # that is current by then. The backlog grows, so the waits do too.
+    assert [1, 3, 6, 9, 13, 18] == prices
+    return True
+
+class SnoopRecorder:
+    def __init__(self, message_hs):
+        self.message_hs = message_hs
+        #
+        self.asked = []
+        self.seen = []
+    def accepts_message(self, message_h):
+        self.asked.append(message_h)
+        return message_h in self.message_hs
+    def on_nearcast_message(self, cog_h, message_h, d_fields):
+        self.seen.append( (message_h, d_fields['instrument']) )
+    def orb_close(self):
+        pass
+
+@test
+def should_pass_snoops_only_the_messages_they_accept():
+    engine = FakeEngine()
+    orb = engine.init_orb(
+        i_nearcast=I_NEARCAST_CONFLATE)
+    bridge = orb.init_autobridge()
+    snoop = SnoopRecorder(
+        message_hs=['trade'])
+    orb.add_snoop(
+        snoop=snoop)
+    for idx in range(3):
+        bridge.nc_price(
+            instrument='a',
+            value=idx)
+        bridge.nc_trade(
+            instrument='t%s'%idx)
+        orb.distribute()
+    assert [('trade', 't0'), ('trade', 't1'), ('trade', 't2')] == snoop.seen
+    # once per message type
+    assert ['price', 'trade'] == sorted(snoop.asked)
+    return True
+
+@test
+def should_filter_sample_and_buffer_a_file_snoop():
+    engine = FakeEngine()
+    orb = engine.init_orb(
+        i_nearcast=I_NEARCAST_CONFLATE)
+    bridge = orb.init_autobridge()
+    tdir = tempfile.mkdtemp()
+    try:
+        filename = os.sep.join( [tdir, 'snoop.txt'] )
+        snoop = orb.add_file_snoop(
+            filename=filename,
+            exclude_message_hs=['price'],
+            sample_every=3,
+            flush_seconds=60)
+        for idx in range(7):
+            bridge.nc_price(
+                instrument='a',
+                value=idx)
+            bridge.nc_trade(
+                instrument='t%s'%idx)
+            orb.distribute()
+        # (Still in the buffer.)
+        assert '' == open(filename).read()
+        snoop.flush()
+        assert [ 'BridgeFoundation/trade instrument:t0'
+               , 'BridgeFoundation/trade instrument:t3'
+               , 'BridgeFoundation/trade instrument:t6'
+               ] == open(filename).read().splitlines()
+        orb.eng_close()
+    finally:
+        shutil.rmtree(tdir)
+    return True
+
+@test
+def should_flush_an_idle_file_snoop_from_a_timer():
+    engine = FakeEngine()
+    orb = engine.init_orb(
+        i_nearcast=I_NEARCAST_CONFLATE)
+    bridge = orb.init_autobridge()
+    tdir = tempfile.mkdtemp()
+    try:
+        filename = os.sep.join( [tdir, 'snoop.txt'] )
+        snoop = orb.add_file_snoop(
+            filename=filename,
+            flush_seconds=5)
+        bridge.nc_trade(
+            instrument='t0')
+        orb.distribute()
+        engine.clock.add(4)
+        engine.simulate_timers()
+        assert '' == open(filename).read()
+        # Nothing more arrives, but the timer flushes what is buffered.
+        engine.clock.add(1)
+        engine.simulate_timers()
+        assert [ 'BridgeFoundation/trade instrument:t0'
+               ] == open(filename).read().splitlines()
+        orb.eng_close()
+        assert {} == engine.timers
+    finally:
+        shutil.rmtree(tdir)
+    return True
+
+I_NEARCAST_LANES = '''
+    i lane h
+    i message h
+        i field h
+        i conflate h
+        i in_lane h
+
+    lane control
+    lane default
+    lane bulk
+
+    message stop
+        in_lane control
+    message status
+        field source
+        conflate source
+        in_lane control
+    message request
+        field n
+    message chunk
+        field n
+        in_lane bulk
+'''
+
+class CogLaneWatcher:
+    def __init__(self, cog_h, orb, engine):
+        self.cog_h = cog_h
+        self.orb = orb
+        self.engine = engine
+        #
+        self.received = []
+    def on_stop(self):
+        self.received.append('stop')
+    def on_status(self, source):
+        self.received.append('status %s'%(source))
+    def on_request(self, n):
+        self.received.append('request %s'%(n))
+        if n == 0:
+            # jumps ahead of what is already waiting
+            self.nearcast.stop()
+    def on_chunk(self, n):
+        self.received.append('chunk %s'%(n))
+
+@test
+def should_distribute_from_the_highest_lane_first():
+    engine = FakeEngine()
+    orb = engine.init_orb(
+        i_nearcast=I_NEARCAST_LANES)
+    assert ['control', 'default', 'bulk'] == orb.nearcast_schema.lanes
+    cog = orb.init_cog(CogLaneWatcher)
+    bridge = orb.init_autobridge()
+    bridge.nc_chunk(
+        n=0)
+    bridge.nc_request(
+        n=0)
+    bridge.nc_request(
+        n=1)
+    bridge.nc_status(
+        source='a')
+    bridge.nc_status(
+        source='a')
+    # (The second status for a takes the place of the first.)
+    assert 4 == orb.get_queue_depth()
+    assert [ ('control', 1)
+           , ('default', 2)
+           , ('bulk', 1)
+           ] == list(orb.get_lane_depths().items())
+    orb.distribute()
+    assert [ 'status a'
+           , 'request 0'
+           , 'stop'
+           , 'request 1'
+           , 'chunk 0'
+           ] == cog.received
+    assert 0 == orb.get_queue_depth()
+    return True
+
+@test
+def should_reject_lanes_that_are_not_declared_first():
+    for i_nearcast in [
+            '''
+                i lane h
+                i message h
+                    i in_lane h
+                message stop
+                    in_lane control
+            ''',
+            '''
+                i lane h
+                i message h
+                message stop
+                lane control
+            ''' ]:
+        b_error = False
+        try:
+            FakeEngine().init_orb(
+                i_nearcast=i_nearcast)
+        except Exception:
+            b_error = True
+        assert b_error
+    return True
+
+class CogChatty:
+    def __init__(self, cog_h, orb, engine):
+        self.cog_h = cog_h
+        self.orb = orb
+        self.engine = engine
+        #
+        self.count = 0
+    def on_request(self, n):
+        self.count += 1
+        if n > 0:
+            self.nearcast.request(
+                n=n - 1)
+
+@test
+def should_stop_each_turn_at_the_nearcast_budget():
+    engine = FakeEngine()
+    orb = engine.init_orb(
+        i_nearcast=I_NEARCAST_LANES)
+    cog = orb.init_cog(CogChatty)
+    bridge = orb.init_autobridge()
+    orb.set_nearcast_budget(100)
+    bridge.nc_request(
+        n=249)
+    activity = activity_new()
+    orb.eng_turn(
+        activity=activity)
+    assert 100 == cog.count
+    assert 1 == orb.get_queue_depth()
+    # (Still work to do. The engine should come straight back.)
+    assert activity.get()
+    orb.eng_turn(
+        activity=activity)
+    orb.eng_turn(
+        activity=activity)
+    assert 250 == cog.count
+    assert 0 == orb.get_queue_depth()
+    return True
+
 if __name__ == '__main__':
     run_tests()
 
@@ -0,0 +1,140 @@
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent.eng.poller import poller_new
+from solent.eng.poller import POLLER_H_EPOLL
+from solent.eng.poller import POLLER_H_POLL
+from solent.eng.poller import POLLER_H_SELECT
+
+from solent import run_tests
+from solent import test
+
+import select
+import socket
+import time
+
+def available_poller_hs():
+    lst = [POLLER_H_SELECT]
+    if hasattr(select, 'poll'):
+        lst.append(POLLER_H_POLL)
+    if hasattr(select, 'epoll'):
+        lst.append(POLLER_H_EPOLL)
+    return lst
+
+def events_for(events, fd):
+    for tpl in events:
+        if tpl[0] == fd:
+            return tpl[1:]
+    return None
+
+@test
+def should_report_read_and_write_interest():
+    for poller_h in available_poller_hs():
+        poller = poller_new(
+            poller_h=poller_h)
+        (sock_a, sock_b) = socket.socketpair()
+        sock_a.setblocking(0)
+        sock_b.setblocking(0)
+        fd = sock_a.fileno()
+        #
+        # Nothing to read, and no write interest: quiet.
+        poller.register(
+            fd=fd,
+            b_read=True,
+            b_write=False)
+        assert None == events_for(poller.poll(0), fd)
+        #
+        # Data arrives
+        sock_b.send(b'abc')
+        (b_read, b_write, b_except) = events_for(poller.poll(0.1), fd)
+        assert b_read == True
+        assert b_write == False
+        #
+        # Interest changes to write-only
+        poller.modify(
+            fd=fd,
+            b_read=False,
+            b_write=True)
+        (b_read, b_write, b_except) = events_for(poller.poll(0.1), fd)
+        assert b_read == False
+        assert b_write == True
+        #
+        # Once unregistered, we hear nothing more
+        poller.unregister(
+            fd=fd)
+        assert poller.is_empty()
+        assert None == events_for(poller.poll(0), fd)
+        #
+        poller.close()
+        sock_a.close()
+        sock_b.close()
+    #
+    return True
+
+@test
+def should_report_hangup_as_readable():
+    for poller_h in available_poller_hs():
+        poller = poller_new(
+            poller_h=poller_h)
+        (sock_a, sock_b) = socket.socketpair()
+        sock_a.setblocking(0)
+        fd = sock_a.fileno()
+        poller.register(
+            fd=fd,
+            b_read=True,
+            b_write=False)
+        #
+        sock_b.close()
+        (b_read, b_write, b_except) = events_for(poller.poll(0.1), fd)
+        assert b_read == True
+        assert 0 == len(sock_a.recv(10))
+        #
+        poller.unregister(
+            fd=fd)
+        poller.close()
+        sock_a.close()
+    #
+    return True
+
+@test
+def should_wait_out_timeouts_under_a_millisecond():
+    for poller_h in available_poller_hs():
+        poller = poller_new(
+            poller_h=poller_h)
+        (sock_a, sock_b) = socket.socketpair()
+        poller.register(
+            fd=sock_a.fileno(),
+            b_read=True,
+            b_write=False)
+        # Nothing to read, so each wait should last its full timeout.
+        count_polls = 5
+        t_start = time.perf_counter()
+        for idx in range(count_polls):
+            assert [] == poller.poll(0.0002)
+        duration = time.perf_counter() - t_start
+        assert duration >= count_polls * 0.0002
+        #
+        poller.unregister(
+            fd=sock_a.fileno())
+        poller.close()
+        sock_a.close()
+        sock_b.close()
+    return True
+
+if __name__ == '__main__':
+    run_tests()
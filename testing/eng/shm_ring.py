@@ -0,0 +1,154 @@
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent.eng.shm_ring import shm_ring_attach
+from solent.eng.shm_ring import shm_ring_create
+
+from solent import run_tests
+from solent import test
+
+import os
+import select
+import time
+
+@test
+def should_wrap_and_refuse_when_full():
+    ring = shm_ring_create(
+        capacity=64)
+    producer = shm_ring_attach(
+        name=ring.name)
+    received = []
+    def cb_record(view):
+        received.append(bytes(view))
+    #
+    sent = []
+    for idx in range(40):
+        bb = bytes([idx]) * (idx % 20)
+        if not producer.push(bb):
+            ring.drain(
+                cb_record=cb_record)
+            assert producer.push(bb)
+        sent.append(bb)
+    ring.drain(
+        cb_record=cb_record)
+    assert sent == received
+    assert ring.is_empty()
+    #
+    # full
+    assert producer.push(b'a' * 20)
+    assert producer.push(b'b' * 20)
+    assert not producer.push(b'c' * 20)
+    # too big ever to fit
+    b_error = False
+    try:
+        producer.push(b'd' * 40)
+    except Exception as e:
+        b_error = 'too large' in str(e)
+    assert b_error
+    #
+    producer.close()
+    ring.close()
+    assert not os.path.exists(ring.fifo_path)
+    assert not os.path.exists(ring.space_fifo_path)
+    return True
+
+def is_readable(fd):
+    (rlist, _, _) = select.select([fd], [], [], 0)
+    return bool(rlist)
+
+@test
+def should_wake_each_side_through_its_fifo():
+    ring = shm_ring_create(
+        capacity=64)
+    producer = shm_ring_attach(
+        name=ring.name)
+    received = []
+    def cb_record(view):
+        received.append(bytes(view))
+    #
+    # Pushing alone does not wake the consumer. notify does.
+    assert producer.push(b'a' * 20)
+    assert producer.push(b'b' * 20)
+    assert not is_readable(ring.fileno())
+    producer.notify()
+    assert is_readable(ring.fileno())
+    #
+    # The ring is full. Once the consumer takes records off, the producer
+    # hears about it.
+    assert not producer.push(b'c' * 20)
+    assert not is_readable(producer.space_fileno())
+    assert 2 == ring.drain(
+        cb_record=cb_record)
+    assert not is_readable(ring.fileno())
+    assert is_readable(producer.space_fileno())
+    producer.refresh_space()
+    assert not is_readable(producer.space_fileno())
+    assert producer.push(b'c' * 20)
+    #
+    # Once notified, the consumer knows there is a record, even if it
+    # stops before taking it.
+    producer.notify()
+    assert 0 == ring.drain(
+        cb_record=cb_record,
+        limit=0)
+    assert ring.has_seen_records()
+    assert 1 == ring.drain(
+        cb_record=cb_record)
+    assert [b'a' * 20, b'b' * 20, b'c' * 20] == received
+    #
+    producer.close()
+    ring.close()
+    return True
+
+@test
+def should_pass_records_and_wakeups_between_processes():
+    count = 20000
+    ring = shm_ring_create(
+        capacity=4096)
+    pid = os.fork()
+    if pid == 0:
+        try:
+            producer = shm_ring_attach(
+                name=ring.name)
+            for idx in range(count):
+                bb = idx.to_bytes(4, 'big')
+                while not producer.push(bb):
+                    producer.notify()
+                    time.sleep(0.0001)
+                if idx % 100 == 99:
+                    producer.notify()
+            producer.notify()
+            producer.close()
+        finally:
+            os._exit(0)
+    received = []
+    def cb_record(view):
+        received.append(int.from_bytes(view, 'big'))
+    t_give_up = time.time() + 20
+    while len(received) < count and time.time() < t_give_up:
+        # Sleep on the fifo, as the engine would.
+        select.select([ring.fileno()], [], [], 0.5)
+        ring.drain(
+            cb_record=cb_record)
+    os.waitpid(pid, 0)
+    ring.close()
+    assert list(range(count)) == received
+    return True
+
+if __name__ == '__main__':
+    run_tests()
@@ -0,0 +1,123 @@
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent.eng.supervisor import supervisor_new
+
+from solent import run_tests
+from solent import test
+
+import os
+import signal
+import socket
+import time
+
+MTU = 1500
+
+def find_free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+class SpinEchoServer:
+    def __init__(self, spin_h, engine):
+        self.spin_h = spin_h
+        self.engine = engine
+    def eng_turn(self, activity):
+        pass
+    def eng_close(self):
+        pass
+    #
+    def start(self, port):
+        self.engine.open_tcp_server(
+            addr='127.0.0.1',
+            port=port,
+            cb_tcp_server_start=self.cb_tcp_server_start,
+            cb_tcp_server_stop=self.cb_tcp_server_stop,
+            cb_tcp_accept_connect=self.cb_tcp_accept_connect,
+            cb_tcp_accept_condrop=self.cb_tcp_accept_condrop,
+            cb_tcp_accept_recv=self.cb_tcp_accept_recv)
+    def cb_tcp_server_start(self, cs_tcp_server_start):
+        pass
+    def cb_tcp_server_stop(self, cs_tcp_server_stop):
+        pass
+    def cb_tcp_accept_connect(self, cs_tcp_accept_connect):
+        pass
+    def cb_tcp_accept_condrop(self, cs_tcp_accept_condrop):
+        pass
+    def cb_tcp_accept_recv(self, cs_tcp_accept_recv):
+        self.engine.send(
+            sid=cs_tcp_accept_recv.accept_sid,
+            bb=bytes(cs_tcp_accept_recv.bb))
+
+def turn_until(supervisor, fn, seconds):
+    t_deadline = time.time() + seconds
+    timeout = 0
+    while time.time() < t_deadline:
+        if fn():
+            return True
+        timeout = supervisor.turn(
+            timeout=min(timeout, 0.05))
+    return fn()
+
+@test
+def should_share_a_port_and_restart_crashed_workers():
+    port = find_free_port()
+    def fn_worker_init(engine, worker_idx):
+        spin = engine.init_spin(
+            construct=SpinEchoServer)
+        spin.start(
+            port=port)
+    supervisor = supervisor_new(
+        fn_worker_init=fn_worker_init,
+        count_workers=2,
+        mtu=MTU,
+        stats_period=0.05,
+        restart_delay=0.05)
+    supervisor.start()
+    try:
+        # Both workers report in.
+        stats = supervisor.get_worker_stats()
+        assert turn_until(supervisor, lambda: 2 == len(stats), 5)
+        pids = supervisor.get_worker_pids()
+        assert set(pids) == set([stats[0]['pid'], stats[1]['pid']])
+        #
+        # Each is listening on the same port.
+        sock = socket.create_connection(('127.0.0.1', port), timeout=5)
+        sock.sendall(b'hello')
+        assert b'hello' == sock.recv(10)
+        sock.close()
+        #
+        # A worker that dies is replaced.
+        os.kill(pids[0], signal.SIGKILL)
+        def fn_replaced():
+            pid = supervisor.get_worker_pids()[0]
+            return pid not in (None, pids[0]) and stats[0]['pid'] == pid
+        assert turn_until(supervisor, fn_replaced, 5)
+        assert pids[1] == supervisor.get_worker_pids()[1]
+    finally:
+        supervisor.stop()
+    #
+    # Everything has been reaped.
+    for pid in supervisor.get_worker_pids():
+        assert pid == None
+    return True
+
+if __name__ == '__main__':
+    run_tests()
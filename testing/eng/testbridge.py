@@ -0,0 +1,75 @@
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent import run_tests
+from solent import test
+
+from fake import FakeEngine
+
+import sys
+
+I_NEARCAST_PING = '''
+    i message h
+        i field h
+
+    message ping
+        field n
+'''
+
+I_NEARCAST_PONG = '''
+    i message h
+        i field h
+
+    message pong
+        field n
+        field text
+    message reset
+'''
+
+@test
+def should_generate_a_class_per_schema_and_share_it():
+    sys_path = list(sys.path)
+    #
+    orb_a = FakeEngine().init_orb(
+        i_nearcast=I_NEARCAST_PING)
+    bridge_a = orb_a.init_testbridge()
+    orb_b = FakeEngine().init_orb(
+        i_nearcast=I_NEARCAST_PONG)
+    bridge_b = orb_b.init_testbridge()
+    orb_c = FakeEngine().init_orb(
+        i_nearcast=I_NEARCAST_PING)
+    bridge_c = orb_c.init_testbridge()
+    #
+    assert type(bridge_a) is type(bridge_c)
+    assert type(bridge_a) is not type(bridge_b)
+    assert sys_path == sys.path
+    #
+    bridge_a.nc_ping(
+        n=1)
+    bridge_b.nc_pong(
+        n=2,
+        text='two')
+    bridge_b.nc_reset()
+    assert [(1,)] == bridge_a.get_ping()
+    assert 0 == bridge_c.count_ping()
+    assert (2, 'two') == bridge_b.last_pong()
+    assert 1 == bridge_b.count_reset()
+    return True
+
+if __name__ == '__main__':
+    run_tests()
@@ -0,0 +1,146 @@
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent import Engine
+from solent import pool_handler
+from solent import run_tests
+from solent import test
+
+import time
+
+MTU = 1500
+
+I_NEARCAST = '''
+    i message h
+        i field h
+
+    message job
+        field n
+        field delay
+    message job_done
+        field n
+        field square
+    message bad_job
+'''
+
+class CogSquarer:
+    def __init__(self, cog_h, orb, engine):
+        self.cog_h = cog_h
+        self.orb = orb
+        self.engine = engine
+    @pool_handler(reply='job_done')
+    def on_job(n, delay):
+        time.sleep(delay)
+        return {'n': n, 'square': n * n}
+    @pool_handler()
+    def on_bad_job():
+        raise Exception('bad job')
+
+class CogWatcher:
+    def __init__(self, cog_h, orb, engine):
+        self.cog_h = cog_h
+        self.orb = orb
+        self.engine = engine
+        #
+        self.received = []
+    def on_job(self, n, delay):
+        self.received.append( ('job', n) )
+    def on_job_done(self, n, square):
+        self.received.append( ('job_done', n, square) )
+
+def wait_for(engine, fn_done, timeout=10):
+    t_give_up = time.time() + timeout
+    while not fn_done() and time.time() < t_give_up:
+        engine.turn(
+            timeout=0.05)
+
+@test
+def should_reply_in_order_without_blocking_the_engine():
+    engine = Engine(
+        mtu=MTU)
+    orb = engine.init_orb(
+        i_nearcast=I_NEARCAST)
+    orb.init_cog(CogSquarer)
+    cog = orb.init_cog(CogWatcher)
+    bridge = orb.init_autobridge()
+    # The first job is the slowest, so the workers finish out of order.
+    for n in range(4):
+        bridge.nc_job(
+            n=n,
+            delay=(3 - n) / 10)
+    ticks = []
+    engine.call_every(
+        period=0.02,
+        cb_eng_timer=lambda cs_eng_timer: ticks.append(cs_eng_timer))
+    wait_for(
+        engine=engine,
+        fn_done=lambda: len(cog.received) == 8)
+    engine.close()
+    assert [('job', n) for n in range(4)] == cog.received[:4]
+    assert [('job_done', n, n * n) for n in range(4)] == cog.received[4:]
+    # The engine kept turning while the jobs ran.
+    assert len(ticks) > 5
+    assert 0 == orb.worker_pool.get_depth()
+    return True
+
+@test
+def should_run_handlers_in_a_process_pool():
+    engine = Engine(
+        mtu=MTU)
+    orb = engine.init_orb(
+        i_nearcast=I_NEARCAST)
+    orb.init_worker_pool(
+        workers=2,
+        b_processes=True)
+    orb.init_cog(CogSquarer)
+    cog = orb.init_cog(CogWatcher)
+    bridge = orb.init_autobridge()
+    for n in range(6):
+        bridge.nc_job(
+            n=n,
+            delay=0)
+    wait_for(
+        engine=engine,
+        fn_done=lambda: len(cog.received) == 12)
+    engine.close()
+    assert [('job_done', n, n * n) for n in range(6)] == cog.received[6:]
+    return True
+
+@test
+def should_raise_pool_errors_on_the_loop():
+    engine = Engine(
+        mtu=MTU)
+    orb = engine.init_orb(
+        i_nearcast=I_NEARCAST)
+    orb.init_cog(CogSquarer)
+    bridge = orb.init_autobridge()
+    bridge.nc_bad_job()
+    b_raised = False
+    try:
+        wait_for(
+            engine=engine,
+            fn_done=lambda: False,
+            timeout=2)
+    except Exception as e:
+        b_raised = 'bad job' == str(e)
+    engine.close()
+    assert b_raised
+    return True
+
+if __name__ == '__main__':
+    run_tests()
@@ -0,0 +1,222 @@
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent import Engine
+from solent import Ns
+from solent import run_tests
+from solent import test
+from solent.base.sip import Sip
+from solent.eng.activity import activity_new
+from solent.util import SpinNearcastBridge
+from solent.util.spin_nearcast_bridge import S_HEADER
+
+import time
+
+MTU = 1500
+
+ADDR = '127.0.0.1'
+
+I_NEARCAST = '''
+    i message h
+        i field h t
+
+    message tick
+        field n u4
+    message note
+        field text vs
+    message local
+        field n u4
+'''
+
+class CogReceiver:
+    def __init__(self, cog_h, orb, engine):
+        self.cog_h = cog_h
+        self.orb = orb
+        self.engine = engine
+        #
+        self.received = []
+    def on_tick(self, n):
+        self.received.append( ('tick', n) )
+    def on_note(self, text):
+        self.received.append( ('note', text) )
+    def on_local(self, n):
+        self.received.append( ('local', n) )
+
+def init_side(engine, send_message_hs, recv_message_hs, cb_bridge_gap=None):
+    orb = engine.init_orb(
+        i_nearcast=I_NEARCAST)
+    cog = orb.init_cog(CogReceiver)
+    bridge = orb.init_autobridge()
+    spin_bridge = engine.init_spin(
+        construct=SpinNearcastBridge,
+        orb=orb,
+        send_message_hs=send_message_hs,
+        recv_message_hs=recv_message_hs,
+        cb_bridge_gap=cb_bridge_gap)
+    return (orb, cog, bridge, spin_bridge)
+
+@test
+def should_carry_selected_messages_between_orbs_in_batches():
+    engine = Engine(
+        mtu=MTU)
+    (orb_a, cog_a, bridge_a, spin_a) = init_side(
+        engine=engine,
+        send_message_hs=['tick', 'note'],
+        recv_message_hs=[])
+    # b sends ticks too, so we can see that it does not echo what a sent.
+    (orb_b, cog_b, bridge_b, spin_b) = init_side(
+        engine=engine,
+        send_message_hs=['tick'],
+        recv_message_hs=['tick', 'note', 'local'])
+    spin_b.open_sub(
+        addr=ADDR,
+        port=0)
+    engine.turn(
+        timeout=0)
+    spin_a.open_pub(
+        addr=ADDR,
+        port=spin_b.get_sub_port())
+    spin_b.open_pub(
+        addr=ADDR,
+        port=spin_b.get_sub_port())
+    engine.turn(
+        timeout=0)
+    #
+    count_ticks = 500
+    for n in range(count_ticks):
+        bridge_a.nc_tick(
+            n=n)
+    bridge_a.nc_note(
+        text='fin')
+    bridge_a.nc_local(
+        n=1)
+    t_give_up = time.time() + 5
+    while len(cog_b.received) < count_ticks + 1 and time.time() < t_give_up:
+        engine.turn(
+            timeout=0.01)
+    engine.close()
+    #
+    expected = [('tick', n) for n in range(count_ticks)] + [('note', 'fin')]
+    assert expected == cog_b.received
+    assert spin_a.count_sent_messages == count_ticks + 1
+    # 500 ticks at 6 bytes each need a few datagrams, not hundreds.
+    assert spin_a.count_sent_datagrams < 10
+    assert spin_b.count_sent_messages == 0
+    assert spin_b.count_missed_datagrams == 0
+    return True
+
+@test
+def should_detect_gaps_and_drop_late_datagrams():
+    engine = Engine(
+        mtu=MTU)
+    gaps = []
+    def cb_bridge_gap(cs_bridge_gap):
+        gaps.append( (cs_bridge_gap.expected_seq, cs_bridge_gap.seq) )
+    (orb, cog, bridge, spin) = init_side(
+        engine=engine,
+        send_message_hs=[],
+        recv_message_hs=['tick'],
+        cb_bridge_gap=cb_bridge_gap)
+    def recv(seq, n):
+        record = orb.nearcast_schema.get_record_class('tick')(
+            cog_h='x',
+            n=n)
+        codec = orb.nearcast_schema.get_codec()
+        sip = Sip(
+            size=MTU)
+        o = codec.encode(
+            record=record,
+            sip=sip)
+        header = S_HEADER.pack(77, seq, spin.schema_crc, 1)
+        cs_sub_recv = Ns()
+        cs_sub_recv.bb = header + bytes(sip.arr[:o])
+        spin.cb_sub_recv(
+            cs_sub_recv=cs_sub_recv)
+    recv(seq=10, n=0)
+    recv(seq=11, n=1)
+    recv(seq=14, n=2)
+    recv(seq=12, n=3)
+    orb.distribute()
+    engine.close()
+    #
+    assert [(12, 14)] == gaps
+    assert spin.count_missed_datagrams == 2
+    assert spin.count_dropped_datagrams == 1
+    assert [('tick', 0), ('tick', 1), ('tick', 2)] == cog.received
+    return True
+
+@test
+def should_start_a_new_datagram_when_a_message_does_not_fit():
+    engine = Engine(
+        mtu=MTU)
+    (orb_a, cog_a, bridge_a, spin_a) = init_side(
+        engine=engine,
+        send_message_hs=['note'],
+        recv_message_hs=[])
+    (orb_b, cog_b, bridge_b, spin_b) = init_side(
+        engine=engine,
+        send_message_hs=[],
+        recv_message_hs=['note'])
+    spin_b.open_sub(
+        addr=ADDR,
+        port=0)
+    engine.turn(
+        timeout=0)
+    spin_a.open_pub(
+        addr=ADDR,
+        port=spin_b.get_sub_port())
+    engine.turn(
+        timeout=0)
+    #
+    # Three of these fit in a datagram.
+    texts = [('%s' % n) * 400 for n in range(10)]
+    for text in texts:
+        bridge_a.nc_note(
+            text=text)
+    t_give_up = time.time() + 5
+    while len(cog_b.received) < len(texts) and time.time() < t_give_up:
+        engine.turn(
+            timeout=0.01)
+    assert [('note', text) for text in texts] == cog_b.received
+    assert 4 == spin_a.count_sent_datagrams
+    #
+    # Too large for any datagram.
+    b_error = False
+    try:
+        bridge_a.nc_note(
+            text='x' * MTU)
+        orb_a.distribute()
+    except Exception:
+        b_error = True
+    assert b_error
+    #
+    # If the pub goes away with a batch waiting, the batch is dropped.
+    bridge_a.nc_note(
+        text='late')
+    orb_a.distribute()
+    assert 1 == spin_a.batch_count
+    spin_a.pub_sid = None
+    spin_a.eng_turn(
+        activity=activity_new())
+    assert 0 == spin_a.batch_count
+    assert 4 == spin_a.count_sent_datagrams
+    engine.close()
+    return True
+
+if __name__ == '__main__':
+    run_tests()
@@ -0,0 +1,135 @@
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent import Engine
+from solent import run_tests
+from solent import test
+from solent.util import SpinNearcastJournalReplay
+
+import os
+import shutil
+import tempfile
+import time
+
+MTU = 1500
+
+I_NEARCAST = '''
+    i message h
+        i field h t
+
+    message order
+        field qty u4
+    message fill
+        field qty u4
+'''
+
+class CogMatcher:
+    def __init__(self, cog_h, orb, engine):
+        self.cog_h = cog_h
+        self.orb = orb
+        self.engine = engine
+        #
+        self.fills = []
+    def on_order(self, qty):
+        self.nearcast.fill(
+            qty=qty * 2)
+    def on_fill(self, qty):
+        self.fills.append(qty)
+
+def record_session(path, qtys, gap):
+    engine = Engine(
+        mtu=MTU)
+    orb = engine.init_orb(
+        i_nearcast=I_NEARCAST)
+    orb.init_cog(CogMatcher)
+    bridge = orb.init_autobridge()
+    orb.add_journal_snoop(
+        path=path)
+    for qty in qtys:
+        bridge.nc_order(
+            qty=qty)
+        engine.cycle()
+        time.sleep(gap)
+    engine.close()
+
+def init_replay(path, b_paced):
+    engine = Engine(
+        mtu=MTU)
+    orb = engine.init_orb(
+        i_nearcast=I_NEARCAST)
+    cog = orb.init_cog(CogMatcher)
+    replay = engine.init_spin(
+        construct=SpinNearcastJournalReplay,
+        orb=orb,
+        path=path,
+        message_hs=['order'],
+        b_paced=b_paced)
+    return (engine, cog, replay)
+
+@test
+def should_replay_inputs_so_that_cogs_reproduce_the_session():
+    tdir = tempfile.mkdtemp()
+    try:
+        path = os.sep.join( [tdir, 'nc.journal'] )
+        qtys = list(range(3000))
+        record_session(
+            path=path,
+            qtys=qtys,
+            gap=0)
+        (engine, cog, replay) = init_replay(
+            path=path,
+            b_paced=False)
+        while not replay.b_done:
+            engine.turn(
+                timeout=0.1)
+        engine.cycle()
+        engine.close()
+        assert 3000 == replay.count_replayed
+        assert [qty * 2 for qty in qtys] == cog.fills
+    finally:
+        shutil.rmtree(tdir)
+    return True
+
+@test
+def should_keep_recorded_gaps_when_paced():
+    tdir = tempfile.mkdtemp()
+    try:
+        path = os.sep.join( [tdir, 'nc.journal'] )
+        record_session(
+            path=path,
+            qtys=[1, 2, 3],
+            gap=0.15)
+        (engine, cog, replay) = init_replay(
+            path=path,
+            b_paced=True)
+        t_start = time.time()
+        while not replay.b_done:
+            engine.turn(
+                timeout=1.0)
+        engine.cycle()
+        duration = time.time() - t_start
+        engine.close()
+        assert [2, 4, 6] == cog.fills
+        # two gaps of 0.15
+        assert 0.28 < duration < 1.0
+    finally:
+        shutil.rmtree(tdir)
+    return True
+
+if __name__ == '__main__':
+    run_tests()
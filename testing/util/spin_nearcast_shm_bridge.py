@@ -0,0 +1,219 @@
+# // license
+# Copyright 2016, Free Software Foundation.
+#
+# This file is part of Solent.
+#
+# Solent is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# Solent is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Solent. If not, see <http://www.gnu.org/licenses/>.
+
+from solent import Engine
+from solent import run_tests
+from solent import test
+from solent.eng.activity import activity_new
+from solent.eng.shm_ring import shm_ring_create
+from solent.util import SpinNearcastShmBridge
+
+import time
+
+MTU = 1500
+
+I_NEARCAST = '''
+    i message h
+        i field h t
+
+    message tick
+        field n u4
+    message note
+        field text vs
+'''
+
+class CogReceiver:
+    def __init__(self, cog_h, orb, engine):
+        self.cog_h = cog_h
+        self.orb = orb
+        self.engine = engine
+        #
+        self.received = []
+    def on_tick(self, n):
+        self.received.append( ('tick', n) )
+    def on_note(self, text):
+        self.received.append( ('note', text) )
+
+@test
+def should_carry_messages_through_a_small_ring_in_order():
+    engine = Engine(
+        mtu=MTU)
+    orb_a = engine.init_orb(
+        i_nearcast=I_NEARCAST)
+    bridge_a = orb_a.init_autobridge()
+    spin_a = engine.init_spin(
+        construct=SpinNearcastShmBridge,
+        orb=orb_a,
+        send_message_hs=['tick', 'note'],
+        recv_message_hs=[])
+    orb_b = engine.init_orb(
+        i_nearcast=I_NEARCAST)
+    cog_b = orb_b.init_cog(CogReceiver)
+    # b sends ticks too, so we can see that it does not echo what a sent.
+    spin_b = engine.init_spin(
+        construct=SpinNearcastShmBridge,
+        orb=orb_b,
+        send_message_hs=['tick'],
+        recv_message_hs=['tick', 'note'])
+    # Small enough that the sender has to hold messages back.
+    name = spin_b.open_recv(
+        capacity=1024)
+    spin_a.open_send(
+        name=name)
+    spin_b.open_send(
+        name=spin_a.open_recv())
+    #
+    count_ticks = 2000
+    for n in range(count_ticks):
+        bridge_a.nc_tick(
+            n=n)
+    bridge_a.nc_note(
+        text='fin')
+    t_give_up = time.time() + 10
+    while len(cog_b.received) < count_ticks + 1 and time.time() < t_give_up:
+        engine.turn(
+            timeout=0.01)
+    engine.close()
+    #
+    expected = [('tick', n) for n in range(count_ticks)] + [('note', 'fin')]
+    assert expected == cog_b.received
+    assert spin_a.count_sent_messages == count_ticks + 1
+    # Many messages to a record.
+    assert spin_a.count_sent_batches < count_ticks / 10
+    assert spin_b.count_sent_messages == 0
+    return True
+
+@test
+def should_wait_quietly_for_room_and_limit_what_waits():
+    engine = Engine(
+        mtu=MTU)
+    orb = engine.init_orb(
+        i_nearcast=I_NEARCAST)
+    bridge = orb.init_autobridge()
+    spin = engine.init_spin(
+        construct=SpinNearcastShmBridge,
+        orb=orb,
+        send_message_hs=['note'],
+        recv_message_hs=[],
+        pending_max=4096)
+    # A ring that nothing drains until we say.
+    ring = shm_ring_create(
+        capacity=1024,
+        tag=spin.schema_crc)
+    spin.open_send(
+        name=ring.name)
+    #
+    # More than the ring holds.
+    for idx in range(10):
+        bridge.nc_note(
+            text='x' * 100)
+    orb.distribute()
+    activity = activity_new()
+    spin.eng_turn(
+        activity=activity)
+    assert 0 < spin.get_pending_bytes()
+    # Waiting for room is not activity, so the engine can sleep.
+    activity.clear()
+    spin.eng_turn(
+        activity=activity)
+    assert not activity.get()
+    #
+    # The other side makes room, and the bridge hears about it.
+    received = []
+    def cb_record(view):
+        received.append(len(view))
+    ring.drain(
+        cb_record=cb_record)
+    t_give_up = time.time() + 5
+    while spin.get_pending_bytes() and time.time() < t_give_up:
+        engine.turn(
+            timeout=0.1)
+    assert 0 == spin.get_pending_bytes()
+    ring.drain(
+        cb_record=cb_record)
+    assert 10 * 104 == sum(received)
+    #
+    # If the other side stops, what waits is limited.
+    b_error = False
+    try:
+        for idx in range(100):
+            bridge.nc_note(
+                text='x' * 100)
+            orb.distribute()
+            spin.eng_turn(
+                activity=activity)
+    except Exception as e:
+        b_error = 'ring is full' in str(e)
+    assert b_error
+    engine.close()
+    ring.close()
+    return True
+
+@test
+def should_refuse_another_schema_and_drop_bad_records():
+    engine = Engine(
+        mtu=MTU)
+    orb_a = engine.init_orb(
+        i_nearcast=I_NEARCAST)
+    spin_a = engine.init_spin(
+        construct=SpinNearcastShmBridge,
+        orb=orb_a,
+        send_message_hs=['tick'],
+        recv_message_hs=[])
+    orb_b = engine.init_orb(
+        i_nearcast='''
+            i message h
+                i field h t
+
+            message tick
+                field n u8
+            message note
+                field text vs
+        ''')
+    cog_b = orb_b.init_cog(CogReceiver)
+    spin_b = engine.init_spin(
+        construct=SpinNearcastShmBridge,
+        orb=orb_b,
+        send_message_hs=[],
+        recv_message_hs=['tick'])
+    name = spin_b.open_recv()
+    b_error = False
+    try:
+        spin_a.open_send(
+            name=name)
+    except Exception as e:
+        b_error = 'another schema' in str(e)
+    assert b_error
+    assert None == spin_a.ring_send
+    #
+    # A record that does not decode is dropped, and the engine carries on.
+    # (tick, then a u8 cut off after four bytes, then a good tick.)
+    spin_b.ring_recv.push(b'\x00\x00\x00\x00\x00\x07')
+    spin_b.ring_recv.push(b'\x00\x00' + (9).to_bytes(8, 'big'))
+    spin_b.ring_recv.notify()
+    t_give_up = time.time() + 5
+    while not cog_b.received and time.time() < t_give_up:
+        engine.turn(
+            timeout=0.1)
+    assert [('tick', 9)] == cog_b.received
+    assert 1 == spin_b.count_dropped_records
+    engine.close()
+    return True
+
+if __name__ == '__main__':
+    run_tests()